@@ -0,0 +1,297 @@
+"""
+Load-test the prediction API and write machine-readable results.
+
+By default main.app is driven in-process through httpx's ASGI transport (lifespan, micro-
+batcher and executor included). With --url the same scenarios run against a live server,
+e.g. one started with `uvicorn main:app`.
+
+Scenarios: /health, /predict and /batch_predict at each --batch-sizes, each under
+--concurrency concurrent clients. Each reports throughput, p50/p95/p99 latency and errors,
+plus peak RSS (this process in-process, the server's /metrics gauge with --url).
+
+When the models/ artifacts are missing or fail to load, a deterministic stand-in model of
+the same 7 -> 1 shape is served instead (or always, with --model stand-in).
+
+Usage:
+    python benchmarks/bench_api.py [--concurrency 16] [--requests 500] [--batch-sizes 10,100,1000]
+    python benchmarks/bench_api.py --url http://localhost:8000
+    python benchmarks/bench_api.py --compare benchmarks/results/baseline.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import httpx
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+# Load synchronously inside the lifespan so scenarios start against a ready model
+os.environ.setdefault("BACKGROUND_MODEL_LOAD", "0")
+# Keep benchmark rows out of data/predictions.db and compiled artifacts out of models/; the
+# history writer stays on so its cost is still measured
+SCRATCH_DIR = tempfile.TemporaryDirectory(prefix="bench_api_")
+os.environ.setdefault("HISTORY_DB_PATH", os.path.join(SCRATCH_DIR.name, "predictions.db"))
+os.environ.setdefault("ARTIFACT_CACHE_DIR", os.path.join(SCRATCH_DIR.name, "artifact_cache"))
+import main  # noqa: E402
+
+RESULTS_DIR = ROOT / "benchmarks" / "results"
+# Metrics compared by --compare; "higher" means larger is better
+COMPARED_METRICS = {"throughput_rps": "higher", "p50_ms": "lower", "p95_ms": "lower", "p99_ms": "lower"}
+
+
+def stand_in_bundle() -> "main.ModelBundle":
+    """Deterministic 7 -> 64 -> 32 -> 16 -> 8 -> 1 ReLU network with a min-max input scaler"""
+    rng = np.random.default_rng(1234)
+    sizes = [len(main.FEATURE_NAMES), 64, 32, 16, 8, 1]
+    layers = []
+    for i, (fan_in, fan_out) in enumerate(zip(sizes[:-1], sizes[1:])):
+        kernel = rng.normal(0, np.sqrt(2.0 / fan_in), (fan_in, fan_out)).astype(np.float32)
+        bias = np.zeros(fan_out, dtype=np.float32)
+        layers.append((f"dense_{i}", kernel, bias, "relu" if fan_out > 1 else "linear"))
+    # Center outputs on a plausible egg count so the recommendation rules see varied values
+    layers[-1][2][:] = 1500.0
+    model = main.NumpyDenseModel(layers, input_dim=sizes[0])
+    lo, hi = main.feature_bounds()
+    scaler = main.AffineScaler(2.0 / (hi - lo), -(hi + lo) / (hi - lo), source="stand-in")
+    return main.ModelBundle(model, scaler, "0" * 64, Path("stand-in.h5"), "stand-in")
+
+
+def farm_payloads(n: int, seed: int) -> list:
+    rows = main.reference_inputs(n, seed=seed).round(1)
+    return [dict(zip(main.FEATURE_NAMES, row)) for row in rows.tolist()]
+
+
+def percentile_ms(samples: list, q: float) -> float:
+    return round(float(np.percentile(samples, q)) * 1000, 3) if samples else 0.0
+
+
+async def run_scenario(client: httpx.AsyncClient, name: str, method: str, path: str, payloads: list,
+                       rows_per_request: int, total: int, concurrency: int, warmup: int) -> dict:
+    """Send `total` requests from `concurrency` workers cycling through payloads"""
+    for i in range(warmup):
+        await client.request(method, path, json=payloads[i % len(payloads)])
+
+    latencies, statuses = [], {}
+    next_index = 0
+
+    async def worker():
+        nonlocal next_index
+        while next_index < total:
+            index = next_index
+            next_index += 1
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, path, json=payloads[index % len(payloads)])
+                code = str(response.status_code)
+            except httpx.HTTPError as e:
+                code = type(e).__name__
+            latencies.append(time.perf_counter() - started)
+            statuses[code] = statuses.get(code, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    duration = time.perf_counter() - started
+
+    ok = statuses.get("200", 0)
+    return {
+        "name": name,
+        "endpoint": path,
+        "rows_per_request": rows_per_request,
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": total - ok,
+        "statuses": statuses,
+        "duration_s": round(duration, 4),
+        "throughput_rps": round(total / duration, 2),
+        "rows_per_s": round(ok * rows_per_request / duration, 2),
+        "mean_ms": round(float(np.mean(latencies)) * 1000, 3),
+        "p50_ms": percentile_ms(latencies, 50),
+        "p95_ms": percentile_ms(latencies, 95),
+        "p99_ms": percentile_ms(latencies, 99),
+        "max_ms": round(max(latencies) * 1000, 3),
+    }
+
+
+async def server_rss_bytes(client: httpx.AsyncClient):
+    """Resident memory reported by the server's /metrics endpoint"""
+    try:
+        response = await client.get("/metrics")
+        for line in response.text.splitlines():
+            if line.startswith("process_resident_memory_bytes "):
+                return int(float(line.split()[1]))
+    except httpx.HTTPError:
+        pass
+    return None
+
+
+async def run_suite(client: httpx.AsyncClient, args, live: bool) -> tuple:
+    payloads = farm_payloads(max(args.requests, 256), seed=args.seed)
+    scenarios = []
+    peak_rss = None
+
+    def plan():
+        if "health" in args.scenarios:
+            yield "health", "GET", "/health", [None], 1, args.requests
+        if "predict" in args.scenarios:
+            yield "predict", "POST", "/predict", payloads, 1, args.requests
+        if "batch" in args.scenarios:
+            for size in args.batch_sizes:
+                # Eight distinct batches per size, cycling through the payload pool
+                batches = [{"farms": [payloads[(start + j) % len(payloads)] for j in range(size)]}
+                           for start in range(0, 8 * size, size)]
+                yield f"batch_predict_{size}", "POST", "/batch_predict", batches, size, args.batch_requests
+
+    for name, method, path, bodies, rows, total in plan():
+        result = await run_scenario(client, name, method, path, bodies, rows, total, args.concurrency, args.warmup)
+        rss = await server_rss_bytes(client) if live else resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        result["peak_rss_bytes"] = rss
+        if rss is not None:
+            peak_rss = max(peak_rss or 0, rss)
+        scenarios.append(result)
+        print(f"{name:>22}  {result['throughput_rps']:>9.1f} req/s  p50 {result['p50_ms']:>8.2f} ms  "
+              f"p95 {result['p95_ms']:>8.2f} ms  p99 {result['p99_ms']:>8.2f} ms  errors {result['errors']}")
+    return scenarios, peak_rss
+
+
+async def run_in_process(args) -> tuple:
+    forced_stand_in = args.model == "stand-in"
+    artifacts_present = Path(main.MODEL_PATH).exists() and Path(main.SCALER_X_PATH).exists()
+    if forced_stand_in or not artifacts_present:
+        main.build_model_bundle = stand_in_bundle
+
+    async with main.app.router.lifespan_context(main.app):
+        if main.model_state == "failed" and args.model == "auto":
+            print("⚠️  Real model failed to load; using the deterministic stand-in model")
+            main.build_model_bundle = stand_in_bundle
+            await asyncio.to_thread(main.load_and_warm_model)
+        if main.model_state != "ready":
+            raise SystemExit("❌ Model is not ready; see the log above")
+        model_info = {
+            "model": "stand-in" if main.active_model.loaded_from == "stand-in" else "real",
+            "model_version": main.active_model.version,
+            "backend": main.active_model.backend,
+        }
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=args.timeout) as client:
+            scenarios, peak_rss = await run_suite(client, args, live=False)
+    return model_info, scenarios, peak_rss
+
+
+async def run_live(args) -> tuple:
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout,
+                                 limits=httpx.Limits(max_connections=args.concurrency)) as client:
+        info = (await client.get("/model/info")).json()
+        model_info = {
+            "model": "live",
+            "model_version": info.get("model_version"),
+            "backend": info.get("backend"),
+        }
+        scenarios, peak_rss = await run_suite(client, args, live=True)
+    return model_info, scenarios, peak_rss
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: dict, baseline_path: Path, tolerance: float) -> int:
+    """Print per-scenario changes against a baseline; returns the number of regressions"""
+    baseline = {s["name"]: s for s in json.loads(baseline_path.read_text())["scenarios"]}
+    regressions = 0
+    print(f"\nCompared with {baseline_path} (tolerance {tolerance:.0%}):")
+    for scenario in results["scenarios"]:
+        before = baseline.get(scenario["name"])
+        if before is None:
+            continue
+        changes = []
+        for metric, better in COMPARED_METRICS.items():
+            old, new = before[metric], scenario[metric]
+            if not old:
+                continue
+            change = (new - old) / old
+            worse = change < -tolerance if better == "higher" else change > tolerance
+            regressions += worse
+            changes.append(f"{metric} {change:+.1%}{' ❌' if worse else ''}")
+        print(f"{scenario['name']:>22}  " + "  ".join(changes))
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Benchmark a running server instead of main.app in-process")
+    parser.add_argument("--model", choices=["auto", "stand-in"], default="auto",
+                        help="In-process model: the real artifacts when they load (auto) or always the stand-in")
+    parser.add_argument("--scenarios", default="health,predict,batch")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=500, help="Requests per /health and /predict scenario")
+    parser.add_argument("--batch-sizes", default="10,100,1000")
+    parser.add_argument("--batch-requests", type=int, default=50, help="Requests per /batch_predict scenario")
+    parser.add_argument("--warmup", type=int, default=5, help="Unmeasured requests before each scenario")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="Results JSON (default benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--compare", type=Path, help="Baseline results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Relative change counted as a regression")
+    args = parser.parse_args()
+    args.scenarios = {s.strip() for s in args.scenarios.split(",") if s.strip()}
+    args.batch_sizes = [int(s) for s in args.batch_sizes.split(",") if s.strip()]
+    return args
+
+
+def main_cli():
+    args = parse_args()
+    model_info, scenarios, peak_rss = asyncio.run(run_live(args) if args.url else run_in_process(args))
+    results = {
+        "timestamp": datetime.now().isoformat(),
+        "commit": git_commit(),
+        "mode": "live" if args.url else "in-process",
+        "url": args.url,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        **model_info,
+        "config": {
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "batch_requests": args.batch_requests,
+            "batch_sizes": args.batch_sizes,
+            # Server settings are only known in-process
+            **({} if args.url else {
+                "micro_batch_enabled": main.MICRO_BATCH_ENABLED,
+                "inference_workers": main.INFERENCE_WORKERS,
+                "model_backend": main.MODEL_BACKEND,
+            }),
+        },
+        "peak_rss_bytes": peak_rss,
+        "scenarios": scenarios,
+    }
+
+    output = args.output or RESULTS_DIR / f"{datetime.now():%Y%m%dT%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+    print(f"\nPeak RSS: {peak_rss / 1e6:.1f} MB" if peak_rss else "\nPeak RSS: unavailable")
+    print(f"✅ Results written to {output}")
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance)
+        if regressions:
+            raise SystemExit(f"❌ {regressions} metric(s) regressed beyond {args.tolerance:.0%}")
+
+
+if __name__ == "__main__":
+    main_cli()
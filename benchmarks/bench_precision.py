@@ -0,0 +1,117 @@
+"""
+Compare the float32 model with its float16 and int8 variants (MODEL_PRECISION).
+
+For each precision: error against float32 on the precision reference set (the accuracy gate
+main.select_precision applies at startup), stored weight size and resident weight size
+(including the widened compute kernels), peak allocation while scoring the largest batch, and
+median latency of main.predict_array per batch size.
+
+The float32 model is loaded with main.build_model_bundle(); set MODEL_BACKEND=numpy to run
+without TensorFlow.
+
+Usage: python benchmarks/bench_precision.py [--batch-sizes 1,64,1024,16384] [--repeats 50]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+# The baseline is always float32; the variants are built from it below
+os.environ["MODEL_PRECISION"] = "float32"
+import main  # noqa: E402
+
+RESULTS_DIR = ROOT / "benchmarks" / "results"
+
+
+def median_ms(fn, repeats: int) -> float:
+    samples = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return round(float(np.median(samples)) * 1000, 4)
+
+
+def peak_alloc_bytes(fn) -> int:
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-sizes", default="1,64,1024,16384")
+    parser.add_argument("--repeats", type=int, default=50)
+    parser.add_argument("--output", type=Path, help="JSON results path (default benchmarks/results/precision-<time>.json)")
+    args = parser.parse_args()
+    batch_sizes = [int(n) for n in args.batch_sizes.split(",") if n.strip()]
+
+    baseline = main.build_model_bundle()
+    if not isinstance(baseline.model, main.NumpyDenseModel):
+        base_model = main.NumpyDenseModel.from_h5(baseline.model_file)
+    else:
+        base_model = baseline.model
+    reference = main.precision_reference_inputs()
+    inputs = main.reference_inputs(max(batch_sizes), seed=2)
+
+    variants = {"float32": baseline.model}
+    for precision in ("float16", "int8"):
+        variants[precision] = main.quantize_model(base_model, precision, baseline.scaler)
+
+    results = []
+    print(f"{'precision':>9} {'weights':>9} {'resident':>9} {'peak alloc':>11} {'max err':>9} {'mean err':>9} {'gate':>5}  latency ms by batch size")
+    for precision, model in variants.items():
+        bundle = main.ModelBundle(model, baseline.scaler, baseline.source_hash, baseline.model_file, "benchmark")
+        error = main.compare_precision(baseline.model, model, baseline.scaler, reference)
+        passed = error["relative_max_error"] <= main.MODEL_PRECISION_TOLERANCE
+        latency = {}
+        for size in batch_sizes:
+            batch = inputs[:size]
+            repeats = max(3, args.repeats * 64 // max(size, 64))
+            main.predict_array(batch, bundle)
+            latency[size] = median_ms(lambda: main.predict_array(batch, bundle), repeats)
+        peak = peak_alloc_bytes(lambda: main.predict_array(inputs, bundle))
+        weights = model.weight_nbytes() if isinstance(model, main.NumpyDenseModel) else None
+        resident = model.runtime_nbytes() if isinstance(model, main.NumpyDenseModel) else None
+        results.append({
+            "precision": precision,
+            "backend": bundle.backend,
+            "weight_bytes": weights,
+            "resident_weight_bytes": resident,
+            "peak_alloc_bytes": peak,
+            "error": error,
+            "gate_passed": passed,
+            "latency_ms": latency,
+        })
+        print(
+            f"{precision:>9} {weights if weights is not None else '-':>9} {resident if resident is not None else '-':>9} {peak:>11} {error['max_abs_error']:>9.3f} "
+            f"{error['mean_abs_error']:>9.3f} {'pass' if passed else 'FAIL':>5}  "
+            + "  ".join(f"{size}: {ms:.3f}" for size, ms in latency.items())
+        )
+
+    output = args.output or RESULTS_DIR / f"precision-{datetime.now():%Y%m%dT%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps({
+        "timestamp": datetime.now().isoformat(),
+        "model_version": baseline.version,
+        "reference_rows": len(reference),
+        "tolerance": main.MODEL_PRECISION_TOLERANCE,
+        "results": results,
+    }, indent=2))
+    print(f"✅ Results written to {output}")
+
+
+if __name__ == "__main__":
+    main_cli()
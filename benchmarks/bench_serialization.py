@@ -0,0 +1,91 @@
+"""
+Compare response serialization CPU cost for /batch_predict.
+
+old: Pydantic response objects -> FastAPI response_model re-validation -> stdlib JSONResponse
+new: plain dicts -> FastJSONResponse (orjson when installed)
+
+No model is loaded; predictions are synthetic so only the response path is measured.
+
+Usage: python benchmarks/bench_serialization.py [--sizes 1,100,10000] [--repeats 20]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import main  # noqa: E402
+
+
+def make_farms(n, seed=0):
+    inputs = main.reference_inputs(n, seed=seed)
+    farms = [main.FarmInput(**dict(zip(main.FEATURE_NAMES, row))) for row in inputs.tolist()]
+    predictions = np.random.default_rng(seed).uniform(0, 2000, n)
+    return farms, main.farms_to_array(farms), predictions
+
+
+def old_path(farms, features, predictions, field, timestamp):
+    """Previous behaviour: build models, let FastAPI validate them against response_model"""
+    response = main.BatchPredictionResponse(
+        predictions=[
+            main.PredictionResponse(**response)
+            for response in main.prediction_response_dicts(farms, features, predictions, timestamp, main.MODEL_VERSION)
+        ],
+        total_predictions=len(farms),
+        timestamp=timestamp,
+    )
+    content = asyncio.run(serialize_response(field=field, response_content=response, is_coroutine=True))
+    return JSONResponse(content).body
+
+
+def new_path(farms, features, predictions, timestamp):
+    predictions = main.prediction_response_dicts(farms, features, predictions, timestamp, main.MODEL_VERSION)
+    return main.FastJSONResponse({
+        "predictions": predictions,
+        "total_predictions": len(predictions),
+        "timestamp": timestamp,
+    }).body
+
+
+def cpu_ms(fn, repeats):
+    start = time.process_time()
+    for _ in range(repeats):
+        fn()
+    return (time.process_time() - start) * 1000 / repeats
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1,100,10000")
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+    # Rules are otherwise compiled on the server's startup path
+    if not main.load_rules_engine():
+        sys.exit(1)
+
+    route = next(r for r in main.app.routes if getattr(r, "path", None) == "/batch_predict")
+    timestamp = datetime.now().isoformat()
+    print(f"encoder: {'orjson' if main.orjson is not None else 'stdlib json'}")
+    print(f"{'batch':>8} {'old ms':>10} {'new ms':>10} {'speedup':>8}")
+    for size in [int(s) for s in args.sizes.split(",")]:
+        farms, features, predictions = make_farms(size)
+        old_body = old_path(farms, features, predictions, route.response_field, timestamp)
+        new_body = new_path(farms, features, predictions, timestamp)
+        if json.loads(old_body) != json.loads(new_body):
+            raise SystemExit(f"❌ response mismatch at batch size {size}")
+        repeats = max(1, args.repeats * 100 // max(size, 100))
+        old_ms = cpu_ms(lambda: old_path(farms, features, predictions, route.response_field, timestamp), repeats)
+        new_ms = cpu_ms(lambda: new_path(farms, features, predictions, timestamp), repeats)
+        print(f"{size:>8} {old_ms:>10.3f} {new_ms:>10.3f} {old_ms / new_ms:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,433 @@
+"""
+Offline bulk scoring: rescore large CSV, NDJSON or Parquet files with the served model.
+
+    python bulk_score.py history.csv scored.csv [--workers 8] [--shard-mb 64]
+
+The input is split into shards (line-aligned byte ranges of CSV/NDJSON, row groups of
+Parquet) that a pool of worker processes scores in parallel, one BLAS/TensorFlow thread each
+so throughput scales with the number of cores. Every worker loads the model once with
+main.build_model_bundle(), the loader the API uses, and scores its shard in vectorized
+chunks of --chunk-rows rows.
+
+Each finished shard is written to <output>.parts/ and recorded in a checkpoint manifest, so
+re-running an interrupted job with the same arguments only scores the missing shards. The
+parts are concatenated in input order at the end.
+
+The output has the input's format and every input column, plus predicted_egg_production
+and error (set for rows that aren't valid UTF-8, can't be parsed or are outside the FarmInput
+ranges). CSV needs a header row with the seven feature columns (case-insensitive); quoted
+fields must not contain newlines. Parquet requires pyarrow.
+"""
+
+import os
+
+# One math-library thread per worker process; set before numpy/TensorFlow are imported here
+# and in the spawned workers, which re-import this module
+for _var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "TF_NUM_INTRAOP_THREADS", "TF_NUM_INTEROP_THREADS"):
+    os.environ.setdefault(_var, "1")
+
+import argparse
+import csv
+import json
+import logging
+import multiprocessing
+import shutil
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+import numpy as np
+
+import main
+
+logger = logging.getLogger("bulk_score")
+
+FORMATS = {".csv": "csv", ".ndjson": "ndjson", ".jsonl": "ndjson", ".parquet": "parquet"}
+OUTPUT_COLUMNS = ["predicted_egg_production", "error"]
+MANIFEST_VERSION = 1
+
+# Per-process state of a pool worker, set by init_worker
+worker_bundle = None
+worker_options = None
+
+
+def detect_format(path: Path) -> str:
+    fmt = FORMATS.get(path.suffix.lower())
+    if fmt is None:
+        raise ValueError(f"Can't tell the format of {path}; use one of {', '.join(FORMATS)}")
+    return fmt
+
+
+def import_pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise SystemExit("Parquet input requires pyarrow. Please install: pip install pyarrow")
+    return pa, pq
+
+
+def csv_header(path: Path) -> tuple:
+    """The header line and its length in bytes (shard 0 starts after it)"""
+    with open(path, "rb") as f:
+        line = f.readline()
+    return line.decode("utf-8-sig").rstrip("\r\n"), len(line)
+
+
+def feature_columns(header: list) -> list:
+    """Index of each feature in a list of column names, matched case-insensitively"""
+    names = [str(name).strip().lower() for name in header]
+    missing = [name for name in main.FEATURE_NAMES if name not in names]
+    if missing:
+        raise ValueError(f"Input is missing columns: {', '.join(missing)}")
+    return [names.index(name) for name in main.FEATURE_NAMES]
+
+
+def plan_shards(path: Path, fmt: str, shard_bytes: int) -> list:
+    """[start, end) byte ranges aligned to line starts, or Parquet row group indexes"""
+    if fmt == "parquet":
+        _, pq = import_pyarrow()
+        return [[i] for i in range(pq.ParquetFile(path).num_row_groups)]
+
+    start = csv_header(path)[1] if fmt == "csv" else 0
+    size = path.stat().st_size
+    shards = []
+    with open(path, "rb") as f:
+        while start < size:
+            f.seek(min(start + shard_bytes, size))
+            if f.tell() < size:
+                f.readline()
+            end = min(f.tell(), size)
+            shards.append([start, end])
+            start = end
+    return shards
+
+
+# Scoring (runs in the worker processes)
+def init_worker(options: dict):
+    global worker_bundle, worker_options
+    worker_options = options
+    worker_bundle = main.build_model_bundle()
+
+
+def score_matrix(matrix: np.ndarray, errors: list) -> np.ndarray:
+    """Predictions for the valid rows of matrix (NaN elsewhere); fills in errors for the rest.
+
+    NaN rows (unparseable or missing values) fail the bounds check too, keeping their
+    original error message.
+    """
+    out_of_range = main.out_of_range_mask(matrix)
+    valid = ~out_of_range.any(axis=1)
+    for i in np.flatnonzero(~valid).tolist():
+        if errors[i] is None:
+            errors[i] = "Out of range: " + ", ".join(
+                main.FEATURE_NAMES[j] for j in np.flatnonzero(out_of_range[i]).tolist()
+            )
+    predictions = np.full(len(matrix), np.nan)
+    if valid.any():
+        rows = matrix[valid]
+        predictions[valid] = main.predict_array(rows, worker_bundle, chunk_size=worker_options["chunk_rows"])
+    return predictions
+
+
+def parse_csv_rows(fields: list, columns: list) -> tuple:
+    """(N, 7) float matrix from parsed CSV rows, NaN and an error for unparseable rows"""
+    errors = [None] * len(fields)
+    try:
+        return np.array([[row[i] for i in columns] for row in fields], dtype=np.float64).reshape(-1, len(columns)), errors
+    except (ValueError, IndexError):
+        pass
+    matrix = np.full((len(fields), len(columns)), np.nan)
+    for n, row in enumerate(fields):
+        try:
+            matrix[n] = [float(row[i]) for i in columns]
+        except (ValueError, IndexError) as e:
+            errors[n] = f"Unparseable row: {e}"
+    return matrix, errors
+
+
+def quote_csv(value: str) -> str:
+    return '"' + value.replace('"', '""') + '"' if any(c in value for c in ',"\r\n') else value
+
+
+def decode_lines(data: bytes) -> tuple:
+    """Non-blank lines of a shard and, per line, an error if it isn't valid UTF-8.
+
+    Invalid lines are kept (with replacement characters) so they can be reported as rows.
+    """
+    try:
+        lines = [line for line in data.decode("utf-8").splitlines() if line.strip()]
+        return lines, [None] * len(lines)
+    except UnicodeDecodeError:
+        pass
+    lines, errors = [], []
+    for raw in data.splitlines():
+        try:
+            line, error = raw.decode("utf-8"), None
+        except UnicodeDecodeError as e:
+            line, error = raw.decode("utf-8", errors="replace"), f"Invalid UTF-8 at byte {e.start}: {e.reason}"
+        if line.strip():
+            lines.append(line)
+            errors.append(error)
+    return lines, errors
+
+
+def score_text_chunk(lines: list, fmt: str, columns: list, decode_errors: list) -> tuple:
+    """Score a chunk of CSV/NDJSON lines; returns (output text, rows, invalid rows)"""
+    if fmt == "csv":
+        fields = list(csv.reader(lines))
+        matrix, errors = parse_csv_rows(fields, columns)
+    else:
+        records, errors = [], [None] * len(lines)
+        matrix = np.full((len(lines), len(main.FEATURE_NAMES)), np.nan)
+        for n, line in enumerate(lines):
+            record = None
+            try:
+                record = json.loads(line)
+                if not isinstance(record, dict):
+                    raise ValueError("Each NDJSON line must be a JSON object")
+                matrix[n] = [float(record[name]) for name in main.FEATURE_NAMES]
+            except KeyError as e:
+                errors[n] = f"Missing field: {e.args[0]}"
+            except (ValueError, TypeError) as e:
+                record = record if isinstance(record, dict) else {"line": line}
+                errors[n] = f"Unparseable row: {e}"
+            records.append(record)
+    for n, error in enumerate(decode_errors):
+        if error is not None:
+            matrix[n] = np.nan
+            errors[n] = error
+
+    predictions = np.round(score_matrix(matrix, errors), 2).tolist()
+    out = []
+    if fmt == "csv":
+        for line, prediction, error in zip(lines, predictions, errors):
+            if error is None:
+                out.append(f"{line},{prediction},\n")
+            else:
+                out.append(f"{line},,{quote_csv(error)}\n")
+    else:
+        for record, prediction, error in zip(records, predictions, errors):
+            record["predicted_egg_production"] = None if error is not None else prediction
+            record["error"] = error
+            out.append(main.encode_json(record) + "\n")
+    return "".join(out), len(lines), sum(error is not None for error in errors)
+
+
+def score_shard(index: int, shard: list, part_path: str) -> dict:
+    """Score one shard into its part file; the part only appears once it is complete"""
+    started = time.perf_counter()
+    options = worker_options
+    fmt, chunk_rows = options["format"], options["chunk_rows"]
+    rows = invalid = 0
+    tmp_path = f"{part_path}.tmp"
+
+    if fmt == "parquet":
+        pa, pq = import_pyarrow()
+        table = pq.ParquetFile(options["input"]).read_row_group(shard[0])
+        columns = feature_columns(table.column_names)
+        matrix = np.column_stack([
+            table.column(i).to_numpy(zero_copy_only=False).astype(np.float64) for i in columns
+        ]).reshape(-1, len(columns))
+        # Nulls arrive as NaN
+        errors = [None if finite else "Missing feature value" for finite in np.isfinite(matrix).all(axis=1).tolist()]
+        predictions = score_matrix(matrix, errors)
+        table = table.append_column("predicted_egg_production", pa.array(np.round(predictions, 2), from_pandas=True))
+        table = table.append_column("error", pa.array(errors, type=pa.string()))
+        pq.write_table(table, tmp_path)
+        rows, invalid = len(matrix), sum(error is not None for error in errors)
+    else:
+        with open(options["input"], "rb") as f:
+            f.seek(shard[0])
+            data = f.read(shard[1] - shard[0])
+        lines, decode_errors = decode_lines(data)
+        del data
+        with open(tmp_path, "w", encoding="utf-8", newline="") as out:
+            for start in range(0, len(lines), chunk_rows):
+                text, chunk_count, chunk_invalid = score_text_chunk(
+                    lines[start:start + chunk_rows], fmt, options["columns"], decode_errors[start:start + chunk_rows]
+                )
+                out.write(text)
+                rows += chunk_count
+                invalid += chunk_invalid
+
+    os.replace(tmp_path, part_path)
+    return {"index": index, "rows": rows, "invalid": invalid, "seconds": time.perf_counter() - started}
+
+
+# Checkpointing and assembly (parent process)
+def write_manifest(path: Path, manifest: dict):
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(manifest, indent=2))
+    os.replace(tmp, path)
+
+
+def load_checkpoint(parts_dir: Path, manifest: dict, restart: bool) -> dict:
+    """Completed shards from a previous run of the same job, or {} when starting over"""
+    manifest_path = parts_dir / "manifest.json"
+    if restart and parts_dir.exists():
+        shutil.rmtree(parts_dir)
+    if not manifest_path.exists():
+        return {}
+    previous = json.loads(manifest_path.read_text())
+    job_keys = ("version", "input", "input_size", "input_mtime", "format", "shards", "model")
+    if any(previous.get(key) != manifest[key] for key in job_keys):
+        raise SystemExit(
+            f"{parts_dir} holds a checkpoint for a different input, shard plan or model; "
+            "re-run with --restart to discard it"
+        )
+    return {
+        index: result for index, result in previous.get("completed", {}).items()
+        if (parts_dir / part_name(int(index), manifest["format"])).exists()
+    }
+
+
+def part_name(index: int, fmt: str) -> str:
+    return f"part-{index:06d}.{'parquet' if fmt == 'parquet' else fmt}"
+
+
+def assemble_output(parts_dir: Path, output: Path, n_shards: int, fmt: str, header: str):
+    """Concatenate the parts in shard order into the output file"""
+    tmp = output.with_name(output.name + ".tmp")
+    if fmt == "parquet":
+        _, pq = import_pyarrow()
+        writer = None
+        try:
+            for index in range(n_shards):
+                table = pq.read_table(parts_dir / part_name(index, fmt))
+                if writer is None:
+                    writer = pq.ParquetWriter(tmp, table.schema)
+                writer.write_table(table)
+        finally:
+            if writer is not None:
+                writer.close()
+    else:
+        with open(tmp, "wb") as out:
+            if fmt == "csv":
+                out.write((header + "," + ",".join(OUTPUT_COLUMNS) + "\n").encode("utf-8"))
+            for index in range(n_shards):
+                with open(parts_dir / part_name(index, fmt), "rb") as part:
+                    shutil.copyfileobj(part, out, 1 << 20)
+    os.replace(tmp, output)
+
+
+def run(args) -> dict:
+    input_path = Path(args.input).resolve()
+    output_path = Path(args.output).resolve()
+    fmt = detect_format(input_path)
+    if detect_format(output_path) != fmt:
+        raise SystemExit("The output must have the same format as the input")
+
+    header, columns = "", None
+    if fmt == "csv":
+        header = csv_header(input_path)[0]
+        columns = feature_columns(next(csv.reader([header])))
+
+    # Load once here too: fails fast on a broken model, compiles the artifact the workers
+    # then load cheaply, and gives the model hash the checkpoint is tied to
+    bundle = main.build_model_bundle()
+    shards = plan_shards(input_path, fmt, args.shard_mb << 20)
+    stat = input_path.stat()
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "input": str(input_path),
+        "input_size": stat.st_size,
+        "input_mtime": stat.st_mtime,
+        "format": fmt,
+        "shards": shards,
+        "model": bundle.source_hash,
+        "model_version": bundle.version,
+        "completed": {},
+    }
+    del bundle
+
+    parts_dir = output_path.with_name(output_path.name + ".parts")
+    completed = load_checkpoint(parts_dir, manifest, args.restart)
+    parts_dir.mkdir(parents=True, exist_ok=True)
+    manifest["completed"] = completed
+    write_manifest(parts_dir / "manifest.json", manifest)
+
+    pending = [index for index in range(len(shards)) if str(index) not in completed]
+    workers = max(1, min(args.workers, len(pending) or 1))
+    if completed:
+        logger.info(f"✅ Resuming: {len(completed)}/{len(shards)} shards already scored")
+    logger.info(f"Scoring {len(pending)} shards of {input_path.name} on {workers} worker processes")
+
+    started = time.perf_counter()
+    scored_rows = 0
+    options = {"input": str(input_path), "format": fmt, "columns": columns, "chunk_rows": args.chunk_rows}
+    if pending:
+        # spawn: TensorFlow and BLAS thread pools are not safe to fork
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(workers, mp_context=context, initializer=init_worker, initargs=(options,)) as pool:
+            futures = {
+                pool.submit(score_shard, index, shards[index], str(parts_dir / part_name(index, fmt)))
+                for index in pending
+            }
+            try:
+                while futures:
+                    done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        result = future.result()
+                        completed[str(result["index"])] = {key: result[key] for key in ("rows", "invalid")}
+                        write_manifest(parts_dir / "manifest.json", manifest)
+                        scored_rows += result["rows"]
+                        elapsed = time.perf_counter() - started
+                        logger.info(
+                            f"Shard {result['index'] + 1}/{len(shards)}: {result['rows']} rows in "
+                            f"{result['seconds']:.2f}s ({len(completed)}/{len(shards)} done, "
+                            f"{scored_rows / elapsed:,.0f} rows/s overall)"
+                        )
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                logger.error(f"❌ Interrupted; {len(completed)}/{len(shards)} shards are checkpointed in {parts_dir}")
+                raise
+    elapsed = time.perf_counter() - started
+
+    assemble_output(parts_dir, output_path, len(shards), fmt, header)
+    if not args.keep_parts:
+        shutil.rmtree(parts_dir)
+
+    summary = {
+        "input": str(input_path),
+        "output": str(output_path),
+        "rows": sum(result["rows"] for result in completed.values()),
+        "invalid_rows": sum(result["invalid"] for result in completed.values()),
+        "rows_scored_this_run": scored_rows,
+        "shards": len(shards),
+        "workers": workers,
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(scored_rows / elapsed, 1) if elapsed > 0 else None,
+        "model_version": manifest["model_version"],
+    }
+    logger.info(
+        f"✅ Wrote {summary['rows']} rows to {output_path} "
+        f"({summary['rows_per_second']} rows/s on {workers} workers, {summary['invalid_rows']} invalid)"
+    )
+    return summary
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Score large CSV/NDJSON/Parquet files offline across processes")
+    parser.add_argument("input", help="Input file (.csv, .ndjson/.jsonl or .parquet)")
+    parser.add_argument("output", help="Output file, same format as the input")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Worker processes (default: CPU count)")
+    parser.add_argument("--shard-mb", type=int, default=64, help="Target CSV/NDJSON shard size in MiB (default 64)")
+    parser.add_argument("--chunk-rows", type=int, default=8192, help="Rows per vectorized model call (default 8192)")
+    parser.add_argument("--restart", action="store_true", help="Discard any checkpoint and score everything again")
+    parser.add_argument("--keep-parts", action="store_true", help="Keep the per-shard parts and manifest after assembly")
+    args = parser.parse_args(argv)
+    if args.workers < 1 or args.shard_mb < 1 or args.chunk_rows < 1:
+        parser.error("--workers, --shard-mb and --chunk-rows must be positive")
+    return args
+
+
+if __name__ == "__main__":
+    try:
+        summary = run(parse_args())
+    except KeyboardInterrupt:
+        # Completed shards are checkpointed; re-running with the same arguments resumes
+        sys.exit(130)
+    print(json.dumps(summary, indent=2))
@@ -0,0 +1,59 @@
+"""
+Gunicorn config for multi-worker serving: gunicorn main:app -c gunicorn.conf.py
+
+The model is loaded and warmed once in the master (main.preload_model) before workers are
+forked, so every worker shares the same read-only weight pages instead of loading its own
+copy. BLAS/TensorFlow thread pools are sized per worker so WEB_CONCURRENCY workers don't
+oversubscribe the CPU cores.
+"""
+
+import gc
+import multiprocessing
+import os
+import tempfile
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = max(1, int(os.environ.get("WEB_CONCURRENCY", "2")))
+# Tell the app how many workers share the traffic (per-worker state such as /farms warns on > 1)
+os.environ["GUNICORN_WORKERS"] = str(workers)
+# Shared by this master's workers so /admin/reload on one worker reaches all of them
+os.environ.setdefault("RELOAD_SIGNAL_PATH", os.path.join(tempfile.gettempdir(), f"model-reload-{os.getpid()}.json"))
+worker_class = "uvicorn.workers.UvicornWorker"
+# Import main (and numpy/BLAS) in the master; the model itself is loaded in when_ready
+preload_app = True
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = 30
+keepalive = 5
+
+# Threads per worker: cores split across workers unless MODEL_THREADS is set. Must be in the
+# environment before numpy/TensorFlow are imported, which preload_app does right after this file.
+threads_per_worker = max(1, int(os.environ.get("MODEL_THREADS", multiprocessing.cpu_count() // workers)))
+for var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "TF_NUM_INTRAOP_THREADS"):
+    os.environ.setdefault(var, str(threads_per_worker))
+os.environ.setdefault("TF_NUM_INTEROP_THREADS", "1")
+os.environ.setdefault("INFERENCE_WORKERS", str(threads_per_worker))
+# The master loads synchronously before forking; workers skip loading entirely
+os.environ.setdefault("BACKGROUND_MODEL_LOAD", "0")
+
+
+def when_ready(server):
+    import main
+
+    if main.preload_model():
+        server.log.info(f"Model preloaded in master: {main.active_model.version}")
+    else:
+        server.log.warning("Model not preloaded; each worker loads its own copy")
+    # Move everything allocated so far out of the GC's reach so collections in the workers
+    # don't write to (and un-share) the preloaded objects
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    server.log.info(f"Worker {worker.pid} forked ({threads_per_worker} BLAS/TF threads)")
+
+
+def on_exit(server):
+    try:
+        os.remove(os.environ["RELOAD_SIGNAL_PATH"])
+    except OSError:
+        pass
@@ -4,16 +4,40 @@ Corrected to match your actual 5 features:
 - amount_of_chicken, ammonia, temperature, humidity, light_intensity
 """
 
-from fastapi import FastAPI, HTTPException, status
+from fastapi import FastAPI, HTTPException, Header, Query, Request, WebSocket, WebSocketDisconnect, status
+from fastapi.exceptions import RequestValidationError
+from fastapi.exception_handlers import request_validation_exception_handler
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel, Field, field_validator
-from typing import Optional, List, Dict
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.requests import ClientDisconnect
+from pydantic import BaseModel, Field, ValidationError, field_validator, model_validator
+from typing import Optional, List, Dict, Tuple, AsyncIterator, Literal
 from contextlib import asynccontextmanager
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import bisect
+import contextvars
+import cProfile
+import pstats
+import random
+import re
+import secrets
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
 import numpy as np
 import joblib
+import csv
+import hashlib
+import io
+import hmac
+import json
 import os
 from datetime import datetime
+from functools import lru_cache
 import logging
 # Workaround for protobuf / tensorflow compatibility issues on some environments.
 # Use the pure-Python protobuf implementation to avoid the "Descriptors cannot be created directly" error
@@ -25,28 +49,53 @@ from pathlib import Path
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Import TensorFlow/Keras early to ensure proper initialization
+# orjson is optional: prediction responses use it when installed, else the stdlib encoder
+try:
+    import orjson
+except ImportError:
+    orjson = None
+    logger.warning("⚠️  orjson not installed; falling back to the standard JSON encoder")
+
+# TensorFlow/Keras are imported lazily by import_keras() so the NumPy backend can serve
+# without paying the TensorFlow import cost.
 keras = None
 tf = None
 
-# Try importing keras first (works with both standalone keras and tensorflow.keras)
-try:
-    import keras
-    logger.info("✅ Keras imported successfully")
-except ImportError as e:
-    logger.warning(f"⚠️  Failed to import standalone keras: {e}")
+
+def import_keras():
+    """Import Keras on first use (standalone keras first, then tensorflow.keras)"""
+    global keras, tf
+    if keras is not None:
+        return keras
     try:
-        import tensorflow as tf
-        from tensorflow import keras
-        logger.info("✅ Keras imported from TensorFlow")
-    except ImportError as e2:
-        logger.error(f"❌ Failed to import TensorFlow/Keras: {e2}")
+        import keras as _keras
+        keras = _keras
+        logger.info("✅ Keras imported successfully")
+    except ImportError as e:
+        logger.warning(f"⚠️  Failed to import standalone keras: {e}")
+        try:
+            import tensorflow as _tf
+            tf = _tf
+            keras = _tf.keras
+            logger.info("✅ Keras imported from TensorFlow")
+        except ImportError as e2:
+            logger.error(f"❌ Failed to import TensorFlow/Keras: {e2}")
+    return keras
 
-# Global variables for model and scalers
+# Global variables for model and scalers. active_model holds the served model/scaler pair
+# as one ModelBundle and is what inference reads; it is replaced atomically on reload.
+# model and scaler_X mirror it for diagnostics.
+active_model = None
 model = None
 scaler_X = None
 # Store the last model load error (traceback) for diagnostics
 last_load_error: Optional[str] = None
+# Model lifecycle state: "loading" -> "warming" -> "ready", or "failed"
+model_state = "loading"
+model_load_seconds: Optional[float] = None
+model_warmup_seconds: Optional[float] = None
+# Set when the model was loaded in a pre-fork master (gunicorn preload); workers then skip loading
+model_preloaded = False
 
 # Resolve project root and model/scaler paths. Prefer env var but fall back to common filenames.
 BASE_DIR = Path(__file__).resolve().parent
@@ -65,15 +114,197 @@ else:
 
 SCALER_X_PATH = Path(os.environ.get("SCALER_X_PATH", str(MODELS_DIR / "scaler_X.pkl")))
 
+# Inference backend: "keras" (default) or "numpy" (TensorFlow-free forward pass over the
+# H5 weights). The NumPy model is checked against Keras on load when Keras is installed.
+MODEL_BACKEND = os.environ.get("MODEL_BACKEND", "keras").strip().lower()
+MODEL_PARITY_CHECK = os.environ.get("MODEL_PARITY_CHECK", "1").lower() in ("1", "true", "yes")
+MODEL_PARITY_TOLERANCE = float(os.environ.get("MODEL_PARITY_TOLERANCE", "1e-3"))
+
+# Reduced-precision serving: MODEL_PRECISION=float16|int8 serves a quantized copy of the NumPy
+# model. It is activated only if its max abs error against the float32 model on the reference
+# set (PRECISION_REFERENCE_PATH, else synthetic inputs) is within MODEL_PRECISION_TOLERANCE of
+# the output scale; otherwise float32 keeps serving.
+MODEL_PRECISION = os.environ.get("MODEL_PRECISION", "float32").strip().lower()
+MODEL_PRECISION_TOLERANCE = float(os.environ.get("MODEL_PRECISION_TOLERANCE", "0.01"))
+PRECISION_REFERENCE_PATH = Path(os.environ.get("PRECISION_REFERENCE_PATH", str(BASE_DIR / "Data" / "Egg_Production(1).csv")))
+
+# Uncertainty estimation (opt-in): UNCERTAINTY_MODE=mc_dropout|ensemble adds a predictive
+# interval (UNCERTAINTY_INTERVAL coverage) to /predict, /batch_predict and /farms/{id}/predict
+# and derives confidence_score from its width instead of the rules table. The UNCERTAINTY_SAMPLES
+# (K) samples of all N rows are scored as one (K*N, 7) batch: dropout passes of the served model,
+# or the served model plus the UNCERTAINTY_ENSEMBLE_PATHS members (.h5, same scaler_X).
+UNCERTAINTY_MODE = os.environ.get("UNCERTAINTY_MODE", "off").strip().lower()
+UNCERTAINTY_SAMPLES = max(2, int(os.environ.get("UNCERTAINTY_SAMPLES", "20")))
+UNCERTAINTY_INTERVAL = min(0.999, max(0.5, float(os.environ.get("UNCERTAINTY_INTERVAL", "0.9"))))
+UNCERTAINTY_ENSEMBLE_PATHS = [
+    Path(p.strip()) for p in os.environ.get("UNCERTAINTY_ENSEMBLE_PATHS", "").split(",") if p.strip()
+]
+
+# The sklearn scaler is replaced at load time by its precomputed affine form
+# (x * coef + offset). With SCALER_FOLD and the NumPy backend the affine step is folded
+# into the first Dense layer so the hot path skips input scaling entirely.
+SCALER_FOLD = os.environ.get("SCALER_FOLD", "1").lower() in ("1", "true", "yes")
+
+# Compiled artifact cache: weights + scaler params + metadata in one .npz keyed by the
+# content hash of the model and scaler files. A matching artifact is loaded directly at
+# startup without importing Keras or unpickling the scaler.
+MODEL_ARTIFACT_CACHE = os.environ.get("MODEL_ARTIFACT_CACHE", "1").lower() in ("1", "true", "yes")
+ARTIFACT_CACHE_DIR = Path(os.environ.get("ARTIFACT_CACHE_DIR", str(MODELS_DIR / ".artifact_cache")))
+ARTIFACT_FORMAT_VERSION = 1
+
+# Startup: the model loads in the background (BACKGROUND_MODEL_LOAD) so the server accepts
+# liveness probes immediately, then WARMUP_BATCH_SIZES are run WARMUP_ROUNDS times each
+# before /health/ready reports ready.
+BACKGROUND_MODEL_LOAD = os.environ.get("BACKGROUND_MODEL_LOAD", "1").lower() in ("1", "true", "yes")
+WARMUP_BATCH_SIZES = [int(n) for n in os.environ.get("WARMUP_BATCH_SIZES", "1,8,64,256").split(",") if n.strip()]
+WARMUP_ROUNDS = max(0, int(os.environ.get("WARMUP_ROUNDS", "2")))
+
+# Hot reload: POST /admin/reload (requires the X-Admin-Token header to match ADMIN_TOKEN)
+# and, when MODEL_WATCH_INTERVAL_S > 0, a poller that reloads when files in MODELS_DIR change.
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+MODEL_WATCH_INTERVAL_S = max(0.0, float(os.environ.get("MODEL_WATCH_INTERVAL_S", "0")))
+# With several gunicorn workers, the worker that serves /admin/reload writes RELOAD_SIGNAL_PATH
+# (set per master by gunicorn.conf.py) and the others poll it every RELOAD_SIGNAL_INTERVAL_S.
+RELOAD_SIGNAL_PATH = Path(os.environ.get("RELOAD_SIGNAL_PATH", str(Path(tempfile.gettempdir()) / "model-reload-signal.json")))
+RELOAD_SIGNAL_INTERVAL_S = max(0.5, float(os.environ.get("RELOAD_SIGNAL_INTERVAL_S", "2")))
+
+# Request profiling (off by default): PROFILE_SAMPLE_RATE profiles that fraction of
+# prediction requests, and with PROFILE_ON_DEMAND an admin can profile a single request via
+# the X-Profile header. Summaries go to PROFILE_DIR, which keeps the newest PROFILE_KEEP.
+PROFILE_SAMPLE_RATE = min(1.0, max(0.0, float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))))
+PROFILE_ON_DEMAND = os.environ.get("PROFILE_ON_DEMAND", "0").lower() in ("1", "true", "yes")
+PROFILE_DIR = Path(os.environ.get("PROFILE_DIR", str(BASE_DIR / "profiles")))
+PROFILE_KEEP = max(1, int(os.environ.get("PROFILE_KEEP", "50")))
+PROFILE_TOP_N = max(1, int(os.environ.get("PROFILE_TOP_N", "25")))
+PROFILE_PATH_PREFIXES = ("/predict", "/batch_predict")
+
+# Optional /predict response cache (PREDICTION_CACHE_SIZE > 0 enables it). Inputs are
+# quantized to PREDICTION_CACHE_RESOLUTION per feature ("temperature=0.5,humidity=1", merged
+# over the defaults) so readings within sensor resolution share an entry.
+PREDICTION_CACHE_SIZE = max(0, int(os.environ.get("PREDICTION_CACHE_SIZE", "0")))
+PREDICTION_CACHE_TTL_S = max(0.0, float(os.environ.get("PREDICTION_CACHE_TTL_S", "60")))
+DEFAULT_CACHE_RESOLUTION = {
+    "amount_of_chicken": 1.0,
+    "amount_of_feeding": 0.1,
+    "ammonia": 0.1,
+    "temperature": 0.1,
+    "humidity": 0.1,
+    "light_intensity": 1.0,
+    "noise": 0.1,
+}
+
+# Batch inference settings: rows are scaled and predicted in chunks of BATCH_CHUNK_SIZE,
+# and a single /batch_predict request may carry up to MAX_BATCH_SIZE farms.
+BATCH_CHUNK_SIZE = max(1, int(os.environ.get("BATCH_CHUNK_SIZE", "1024")))
+MAX_BATCH_SIZE = max(1, int(os.environ.get("MAX_BATCH_SIZE", "10000")))
+# /batch_predict/stream parses and scores uploads STREAM_CHUNK_SIZE rows at a time
+STREAM_CHUNK_SIZE = max(1, int(os.environ.get("STREAM_CHUNK_SIZE", "2048")))
+# Longer lines are not buffered; they are skipped and reported as row errors
+STREAM_MAX_LINE_BYTES = max(256, int(os.environ.get("STREAM_MAX_LINE_BYTES", "65536")))
+# /ws/predict: readings a single gateway connection may have in flight before the server
+# stops reading its socket (backpressure)
+WS_MAX_IN_FLIGHT = max(1, int(os.environ.get("WS_MAX_IN_FLIGHT", "256")))
+# Per-farm feature store (/farms/...): the last FEATURE_STORE_WINDOW readings per farm in a
+# ring buffer, at most FEATURE_STORE_MAX_FARMS farms, dropped after FEATURE_STORE_IDLE_S idle
+FEATURE_STORE_WINDOW = max(1, int(os.environ.get("FEATURE_STORE_WINDOW", "60")))
+FEATURE_STORE_MAX_FARMS = max(1, int(os.environ.get("FEATURE_STORE_MAX_FARMS", "10000")))
+FEATURE_STORE_IDLE_S = max(0.0, float(os.environ.get("FEATURE_STORE_IDLE_S", "3600")))
+FEATURE_STORE_EWMA_ALPHA = min(1.0, max(0.001, float(os.environ.get("FEATURE_STORE_EWMA_ALPHA", "0.1"))))
+# Worker processes serving the app (exported by gunicorn.conf.py). The feature store lives in
+# each worker's memory, so /farms needs a single worker to see a consistent window.
+SERVING_WORKERS = max(1, int(os.environ.get("GUNICORN_WORKERS", "1")))
+# /optimize: what-if setpoint search. Each search round scores a grid of at most
+# OPTIMIZE_MAX_CANDIDATES points in one scaler+model call; results are cached per input
+# (OPTIMIZE_CACHE_SIZE entries for OPTIMIZE_CACHE_TTL_S, 0 disables the cache).
+OPTIMIZE_MAX_CANDIDATES = max(27, int(os.environ.get("OPTIMIZE_MAX_CANDIDATES", "20000")))
+OPTIMIZE_CACHE_SIZE = max(0, int(os.environ.get("OPTIMIZE_CACHE_SIZE", "256")))
+OPTIMIZE_CACHE_TTL_S = max(0.0, float(os.environ.get("OPTIMIZE_CACHE_TTL_S", "300")))
+OPTIMIZE_CONTROLS = ["temperature", "light_intensity", "amount_of_feeding", "humidity"]
+# Prediction history: every prediction is queued and written behind the request to a SQLite
+# database in WAL mode, in batches of up to HISTORY_BATCH_SIZE rows at least every
+# HISTORY_FLUSH_INTERVAL_S. Beyond HISTORY_QUEUE_ROWS pending rows new records are dropped
+# (and counted). Rows older than HISTORY_RETENTION_DAYS are deleted hourly (0 keeps all).
+HISTORY_ENABLED = os.environ.get("HISTORY_ENABLED", "1").lower() in ("1", "true", "yes")
+HISTORY_DB_PATH = Path(os.environ.get("HISTORY_DB_PATH", str(BASE_DIR / "data" / "predictions.db")))
+HISTORY_BATCH_SIZE = max(1, int(os.environ.get("HISTORY_BATCH_SIZE", "1000")))
+HISTORY_FLUSH_INTERVAL_S = max(0.01, float(os.environ.get("HISTORY_FLUSH_INTERVAL_S", "1")))
+HISTORY_QUEUE_ROWS = max(1, int(os.environ.get("HISTORY_QUEUE_ROWS", "200000")))
+HISTORY_RETENTION_DAYS = max(0.0, float(os.environ.get("HISTORY_RETENTION_DAYS", "30")))
+HISTORY_PURGE_INTERVAL_S = 3600
+# /history returns at most HISTORY_PAGE_SIZE records per page
+HISTORY_PAGE_SIZE = max(1, int(os.environ.get("HISTORY_PAGE_SIZE", "1000")))
+# /batch_predict/binary accepts up to MAX_BINARY_BATCH_SIZE rows per request
+MAX_BINARY_BATCH_SIZE = max(1, int(os.environ.get("MAX_BINARY_BATCH_SIZE", "1000000")))
+# /batch_predict/columnar is parsed into Python lists like /batch_predict, so it shares that
+# bound by default (MAX_COLUMNAR_BATCH_SIZE rows per request)
+MAX_COLUMNAR_BATCH_SIZE = max(1, int(os.environ.get("MAX_COLUMNAR_BATCH_SIZE", str(MAX_BATCH_SIZE))))
+
+# Recommendation/confidence thresholds and messages, compiled by RulesEngine at startup
+RULES_PATH = Path(os.environ.get("RULES_PATH", str(BASE_DIR / "rules.json")))
+
+# Feature column order expected by the scaler and the model
+FEATURE_NAMES = [
+    "amount_of_chicken",
+    "amount_of_feeding",
+    "ammonia",
+    "temperature",
+    "humidity",
+    "light_intensity",
+    "noise",
+]
+MODEL_VERSION = "Keras Neural Network v1.0"
+
+# Micro-batching for /predict: concurrent single-row requests are coalesced into one
+# model call of up to MICRO_BATCH_MAX_SIZE rows, waiting at most MICRO_BATCH_MAX_WAIT_MS.
+MICRO_BATCH_ENABLED = os.environ.get("MICRO_BATCH_ENABLED", "1").lower() in ("1", "true", "yes")
+MICRO_BATCH_MAX_SIZE = max(1, int(os.environ.get("MICRO_BATCH_MAX_SIZE", "64")))
+MICRO_BATCH_MAX_WAIT_MS = max(0.0, float(os.environ.get("MICRO_BATCH_MAX_WAIT_MS", "2")))
+
+# Inference executor: blocking scaler/model calls run on INFERENCE_WORKERS threads with at
+# most INFERENCE_QUEUE_SIZE jobs admitted at once; beyond that requests are shed with 503.
+# Each request gets a deadline (INFERENCE_TIMEOUT_S, or a shorter X-Request-Timeout header).
+INFERENCE_WORKERS = max(1, int(os.environ.get("INFERENCE_WORKERS", "2")))
+INFERENCE_QUEUE_SIZE = max(1, int(os.environ.get("INFERENCE_QUEUE_SIZE", "32")))
+INFERENCE_TIMEOUT_S = max(0.001, float(os.environ.get("INFERENCE_TIMEOUT_S", "10")))
+RETRY_AFTER_S = max(1, int(os.environ.get("RETRY_AFTER_S", "1")))
+
 # Initialize FastAPI app
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifespan handler: runs at startup to load the model and can handle shutdown tasks."""
     logger.info("Starting Egg Production API (lifespan)...")
-    success = load_model()
-    if not success:
-        logger.error("CRITICAL: Model failed to load. API will not function properly.")
+    if model_preloaded:
+        startup_task = None
+        logger.info(f"✅ Serving the model preloaded before fork (pid {os.getpid()})")
+    elif BACKGROUND_MODEL_LOAD:
+        startup_task = asyncio.create_task(asyncio.to_thread(load_and_warm_model))
+    else:
+        startup_task = None
+        load_and_warm_model()
+    if MICRO_BATCH_ENABLED:
+        batcher.start()
+    if SERVING_WORKERS > 1:
+        logger.warning(
+            f"⚠️  Worker {os.getpid()} is one of {SERVING_WORKERS}: the /farms feature store is per worker, so "
+            f"a farm's readings are only visible to the worker that received them. Use WEB_CONCURRENCY=1 for /farms."
+        )
+    if HISTORY_ENABLED:
+        try:
+            prediction_history.start()
+        except (sqlite3.Error, OSError) as e:
+            logger.error(f"❌ Prediction history disabled, could not open {HISTORY_DB_PATH}: {e}")
+    watch_task = asyncio.create_task(watch_model_files(MODEL_WATCH_INTERVAL_S)) if MODEL_WATCH_INTERVAL_S > 0 else None
+    signal_task = asyncio.create_task(watch_reload_signal(RELOAD_SIGNAL_INTERVAL_S)) if SERVING_WORKERS > 1 else None
     yield
+    for task in (watch_task, signal_task):
+        if task is not None:
+            task.cancel()
+    if startup_task is not None and not startup_task.done():
+        # The loader thread can't be interrupted; stop waiting on it
+        startup_task.cancel()
+    await batcher.stop()
+    inference_executor.shutdown()
+    await asyncio.to_thread(prediction_history.stop)
 
 
 app = FastAPI(
@@ -130,12 +361,14 @@ class FarmInput(BaseModel):
 class PredictionResponse(BaseModel):
     """Response schema for prediction"""
     predicted_egg_production: float = Field(..., description="Predicted total egg production")
-    confidence_score: float = Field(..., description="Model confidence score (0-1)")
+    confidence_score: float = Field(..., description="Model confidence score (0-1); from the prediction interval when UNCERTAINTY_MODE is set")
     farm_size_category: str = Field(..., description="Farm size category")
     recommendations: List[str] = Field(..., description="Optimization recommendations")
     timestamp: str = Field(..., description="Prediction timestamp")
     model_version: str = Field(..., description="Model version used")
     input_data: Dict = Field(..., description="Input data used for prediction")
+    prediction_interval: Optional[List[float]] = Field(None, description="Predictive interval [lower, upper] (UNCERTAINTY_MODE only)")
+    prediction_std: Optional[float] = Field(None, description="Standard deviation of the sampled predictions (UNCERTAINTY_MODE only)")
     # Avoid Pydantic protected namespace warnings for fields starting with "model_"
     model_config = {"protected_namespaces": ()}
 
@@ -143,257 +376,3374 @@ class PredictionResponse(BaseModel):
 class HealthResponse(BaseModel):
     """Health check response"""
     status: str
+    model_state: str
+    model_version: Optional[str]
     model_loaded: bool
     scaler_X_loaded: bool
+    rules_loaded: bool
     last_error: Optional[str]
+    rules_error: Optional[str] = None
     timestamp: str
     version: str
     # Avoid Pydantic protected namespace warnings for fields starting with "model_"
     model_config = {"protected_namespaces": ()}
 
 
-class BatchPredictionInput(BaseModel):
-    """Input for batch predictions"""
-    farms: List[FarmInput] = Field(..., max_items=100, description="List of farm inputs (max 100)")
+class BatchPredictionInput(BaseModel):
+    """Input for batch predictions"""
+    farms: List[FarmInput] = Field(..., max_length=MAX_BATCH_SIZE, description=f"List of farm inputs (max {MAX_BATCH_SIZE})")
+
+
+class BatchPredictionResponse(BaseModel):
+    """Response for batch predictions"""
+    predictions: List[PredictionResponse]
+    total_predictions: int
+    timestamp: str
+
+
+class ColumnarBatchInput(BaseModel):
+    """Columnar batch input: one array per feature, all the same length"""
+    amount_of_chicken: List[float] = Field(..., max_length=MAX_COLUMNAR_BATCH_SIZE)
+    amount_of_feeding: List[float] = Field(..., max_length=MAX_COLUMNAR_BATCH_SIZE)
+    ammonia: List[float] = Field(..., max_length=MAX_COLUMNAR_BATCH_SIZE)
+    temperature: List[float] = Field(..., max_length=MAX_COLUMNAR_BATCH_SIZE)
+    humidity: List[float] = Field(..., max_length=MAX_COLUMNAR_BATCH_SIZE)
+    light_intensity: List[float] = Field(..., max_length=MAX_COLUMNAR_BATCH_SIZE)
+    noise: List[float] = Field(..., max_length=MAX_COLUMNAR_BATCH_SIZE)
+
+    @model_validator(mode="after")
+    def validate_lengths(self):
+        lengths = {len(getattr(self, name)) for name in FEATURE_NAMES}
+        if len(lengths) > 1:
+            raise ValueError("All feature arrays must have the same length")
+        return self
+
+
+class ColumnarBatchResponse(BaseModel):
+    """Compact columnar batch response; codes index into the shared lookup tables"""
+    predictions: List[float]
+    confidence_scores: List[float]
+    farm_size_categories: List[int] = Field(..., description="Index into lookup.farm_size_categories")
+    recommendation_codes: List[List[int]] = Field(..., description="Indexes into lookup.recommendations, per farm")
+    lookup: Dict[str, List[str]]
+    total_predictions: int
+    timestamp: str
+    model_version: str
+    model_config = {"protected_namespaces": ()}
+
+
+class FarmReading(BaseModel):
+    """One sensor reading for the per-farm feature store; omitted features keep their last value"""
+    amount_of_chicken: Optional[float] = Field(None, ge=10, le=10000)
+    amount_of_feeding: Optional[float] = Field(None, ge=24.6, le=675.9)
+    ammonia: Optional[float] = Field(None, ge=2.0, le=53.5)
+    temperature: Optional[float] = Field(None, ge=5.0, le=45.0)
+    humidity: Optional[float] = Field(None, ge=36.9, le=95.0)
+    light_intensity: Optional[float] = Field(None, ge=97.5, le=929.2)
+    noise: Optional[float] = Field(None, ge=64.4, le=607.3)
+    timestamp: Optional[float] = Field(None, description="Unix time of the reading (defaults to now)")
+
+
+class FarmReadingResponse(BaseModel):
+    farm_id: str
+    readings: int = Field(..., description="Readings currently in the window")
+    total_readings: int
+    prediction: Optional[PredictionResponse] = None
+
+
+class OptimizationInput(BaseModel):
+    """What-if search: a farm's current conditions and the features it can change"""
+    farm: FarmInput
+    controls: List[str] = Field(
+        default_factory=lambda: list(OPTIMIZE_CONTROLS), min_length=1, max_length=len(FEATURE_NAMES),
+        description="Features the search may change; the rest stay at the farm's current values",
+    )
+    bounds: Dict[str, Tuple[float, float]] = Field(
+        default_factory=dict, description="Optional narrower (low, high) search range per control"
+    )
+    refine_rounds: int = Field(2, ge=0, le=6, description="Zoom-in rounds around the best point after the initial grid")
+    top_k: int = Field(5, ge=1, le=50, description="Number of best setpoints to return")
+
+    model_config = {
+        "json_schema_extra": {
+            "example": {
+                "farm": FarmInput.model_config["json_schema_extra"]["example"],
+                "controls": OPTIMIZE_CONTROLS,
+                "bounds": {"temperature": [18.0, 28.0]},
+                "refine_rounds": 2,
+                "top_k": 5,
+            }
+        }
+    }
+
+    @field_validator("controls")
+    def validate_controls(cls, v):
+        unknown = [name for name in v if name not in FEATURE_NAMES]
+        if unknown:
+            raise ValueError(f"Unknown controls {unknown}; expected names from {FEATURE_NAMES}")
+        if len(set(v)) != len(v):
+            raise ValueError("controls must not repeat a feature")
+        return v
+
+    @model_validator(mode="after")
+    def validate_bounds(self):
+        lower, upper = feature_bounds()
+        for name, (low, high) in self.bounds.items():
+            if name not in self.controls:
+                raise ValueError(f"bounds given for '{name}', which is not in controls")
+            i = FEATURE_NAMES.index(name)
+            if not lower[i] <= low < high <= upper[i]:
+                raise ValueError(f"bounds for '{name}' must satisfy {lower[i]} <= low < high <= {upper[i]}")
+        return self
+
+
+class Setpoint(BaseModel):
+    setpoints: Dict[str, float] = Field(..., description="Suggested value of each control")
+    changes: Dict[str, float] = Field(..., description="Change from the farm's current value")
+    predicted_egg_production: float
+    gain: float = Field(..., description="Predicted gain over the current conditions")
+    gain_pct: Optional[float] = Field(None, description="Gain as a percentage of the current prediction")
+
+
+class OptimizationResponse(BaseModel):
+    baseline_prediction: float = Field(..., description="Prediction at the farm's current conditions")
+    improved: bool = Field(..., description="Whether any setpoint beats the current conditions")
+    best: List[Setpoint]
+    controls: List[str]
+    search: Dict = Field(..., description="Grid points per control, rounds and candidates scored")
+    cached: bool
+    timestamp: str
+    model_version: str
+    input_data: Dict
+    model_config = {"protected_namespaces": ()}
+
+
+# NumPy inference backend
+NUMPY_ACTIVATIONS = {
+    "linear": lambda x: x,
+    "relu": lambda x: np.maximum(x, 0, out=x),
+    "sigmoid": lambda x: 1.0 / (1.0 + np.exp(-x)),
+    "tanh": np.tanh,
+}
+
+
+class NumpyDenseModel:
+    """TensorFlow-free forward pass for a Sequential stack of Dense/Dropout layers.
+
+    Weights and activations are read from a Keras HDF5 file with h5py and inference is
+    a chain of float32 matmuls. Exposes the subset of the Keras model interface used by
+    this API (``predict``, ``summary``, ``input_shape``, ``output_shape``).
+    """
+
+    precision = "float32"
+
+    def __init__(self, layers: list, input_dim: int, dropout_rates: Optional[List[float]] = None):
+        # layers: list of (name, kernel, bias, activation_name)
+        self.layers = layers
+        self.dropout_rates = dropout_rates or [0.0] * len(layers)
+        self._activations = [NUMPY_ACTIVATIONS[act] for _, _, _, act in layers]
+        self.input_shape = (None, input_dim)
+        self.output_shape = (None, layers[-1][1].shape[1])
+
+    @classmethod
+    def from_h5(cls, path: Path) -> "NumpyDenseModel":
+        import h5py
+
+        if Path(path).suffix != ".h5":
+            raise ValueError(f"NumPy backend requires an HDF5 (.h5) model, got: {path}")
+
+        with h5py.File(str(path), "r") as f:
+            if "model_config" not in f.attrs:
+                raise ValueError("No model_config found in H5 file")
+            raw_config = f.attrs["model_config"]
+            config = json.loads(raw_config.decode() if isinstance(raw_config, bytes) else raw_config)
+            if config.get("class_name") != "Sequential":
+                raise ValueError(f"NumPy backend supports Sequential models only, got {config.get('class_name')}")
+
+            weights_root = f["model_weights"] if "model_weights" in f else f
+            layers = []
+            # Dropout rate that applies to each dense layer's output (used for MC-dropout)
+            dropout_rates = []
+            input_dim = None
+            for layer in config["config"]["layers"]:
+                layer_class = layer["class_name"]
+                layer_config = layer.get("config", {})
+                if layer_class == "InputLayer":
+                    shape = layer_config.get("batch_input_shape") or layer_config.get("batch_shape")
+                    input_dim = shape[-1]
+                elif layer_class == "Dense":
+                    name = layer_config["name"]
+                    activation = layer_config.get("activation", "linear")
+                    if activation not in NUMPY_ACTIVATIONS:
+                        raise ValueError(f"Unsupported activation '{activation}' in layer {name}")
+                    group = weights_root[name]
+                    weight_names = [n.decode() if isinstance(n, bytes) else n for n in group.attrs["weight_names"]]
+                    kernel = np.asarray(group[weight_names[0]], dtype=np.float32)
+                    if layer_config.get("use_bias", True):
+                        bias = np.asarray(group[weight_names[1]], dtype=np.float32)
+                    else:
+                        bias = np.zeros(kernel.shape[1], dtype=np.float32)
+                    layers.append((name, kernel, bias, activation))
+                    dropout_rates.append(0.0)
+                elif layer_class == "Dropout":
+                    # Identity at inference time
+                    if dropout_rates:
+                        dropout_rates[-1] = float(layer_config.get("rate", 0.0))
+                else:
+                    raise ValueError(f"Unsupported layer type '{layer_class}' for NumPy backend")
+
+        if not layers:
+            raise ValueError("No Dense layers found in model config")
+        return cls(layers, input_dim or layers[0][1].shape[0], dropout_rates)
+
+    def fold_input_affine(self, coef: np.ndarray, offset: np.ndarray) -> "NumpyDenseModel":
+        """Return a copy whose first layer absorbs an input transform x * coef + offset"""
+        name, kernel, bias, activation = self.layers[0]
+        kernel64 = kernel.astype(np.float64)
+        folded_kernel = (coef[:, None] * kernel64).astype(np.float32)
+        folded_bias = (offset @ kernel64 + bias).astype(np.float32)
+        layers = [(name, folded_kernel, folded_bias, activation)] + list(self.layers[1:])
+        return NumpyDenseModel(layers, self.input_shape[1], list(self.dropout_rates))
+
+    def layer_output(self, i: int, h: np.ndarray) -> np.ndarray:
+        """Output of dense layer i for input h"""
+        _, kernel, bias, _ = self.layers[i]
+        return self._activations[i](h @ kernel + bias)
+
+    def predict(self, x, batch_size=None, verbose=0) -> np.ndarray:
+        h = np.asarray(x, dtype=np.float32)
+        for i in range(len(self.layers)):
+            h = self.layer_output(i, h)
+        return h
+
+    def predict_samples(self, x, samples: int, rng: np.random.Generator) -> np.ndarray:
+        """MC-dropout: (samples, N, outputs) predictions with dropout active.
+
+        The input is tiled to (samples * N, inputs) so every sample of every row goes
+        through one matmul per layer, with an independent inverted-dropout mask per row.
+        """
+        x = np.asarray(x, dtype=np.float32)
+        h = np.tile(x, (samples, 1))
+        for i, rate in enumerate(self.dropout_rates):
+            h = self.layer_output(i, h)
+            if rate > 0:
+                keep = rng.random(h.shape, dtype=np.float32) >= rate
+                h = h * keep
+                h *= 1.0 / (1.0 - rate)
+        return h.reshape(samples, len(x), -1)
+
+    def weight_arrays(self) -> List[np.ndarray]:
+        return [array for _, kernel, bias, _ in self.layers for array in (kernel, bias)]
+
+    def weight_nbytes(self) -> int:
+        return sum(array.nbytes for array in self.weight_arrays())
+
+    def runtime_arrays(self) -> List[np.ndarray]:
+        """Every array inference reads: the weights plus any derived compute copies"""
+        return self.weight_arrays()
+
+    def runtime_nbytes(self) -> int:
+        """Resident weight memory: stored weights plus compute copies"""
+        return sum(array.nbytes for array in self.runtime_arrays())
+
+    def summary(self, print_fn=print):
+        print_fn(f"NumPy Dense model (TensorFlow-free, {self.precision} weights)")
+        total = 0
+        for name, kernel, bias, activation in self.layers:
+            params = kernel.size + bias.size
+            total += params
+            print_fn(f"{name}: Dense {kernel.shape[0]} -> {kernel.shape[1]} ({activation}), {params} params")
+        print_fn(f"Total params: {total} ({self.weight_nbytes()} bytes)")
+
+
+MODEL_PRECISIONS = ("float32", "float16", "int8")
+
+
+class QuantizedDenseModel(NumpyDenseModel):
+    """Reduced-precision copy of a NumpyDenseModel.
+
+    float16: kernels are stored as float16 (the TFLite float16 scheme), halving the stored
+    weights; inference uses float32 copies widened once at build. int8: kernels are quantized symmetrically
+    per output channel, and each layer's input is quantized to int8 as well. Hidden layers
+    use a per-row scale. The first layer uses static per-feature scales from the expected
+    input range, folded into its kernel rows, since raw features differ by orders of
+    magnitude. The int8 x int8 products are summed with float32 BLAS, which is exact while
+    fan_in * 127**2 < 2**24.
+    """
+
+    def __init__(self, source: NumpyDenseModel, precision: str, input_range: Optional[np.ndarray] = None):
+        if precision not in ("float16", "int8"):
+            raise ValueError(f"Unknown quantized precision '{precision}'. Use 'float16' or 'int8'.")
+        if precision == "int8" and input_range is None:
+            raise ValueError("int8 quantization needs the model's input range")
+        layers = []
+        self.kernel_scales = []
+        self.input_scale = None
+        for i, (name, kernel, bias, activation) in enumerate(source.layers):
+            if precision == "float16":
+                layers.append((name, kernel.astype(np.float16), bias, activation))
+                continue
+            kernel64 = kernel.astype(np.float64)
+            if i == 0:
+                self.input_scale = (np.maximum(np.asarray(input_range, dtype=np.float64), 1e-12) / 127).astype(np.float32)
+                kernel64 = kernel64 * self.input_scale[:, None]
+            scale = np.maximum(np.abs(kernel64).max(axis=0), 1e-12) / 127
+            layers.append((name, np.clip(np.rint(kernel64 / scale), -127, 127).astype(np.int8), bias, activation))
+            self.kernel_scales.append(scale.astype(np.float32))
+        super().__init__(layers, source.input_shape[1], list(source.dropout_rates))
+        self.precision = precision
+        fan_in = max(kernel.shape[0] for _, kernel, _, _ in layers)
+        self.accumulator = np.float32 if fan_in * 127 ** 2 < 2 ** 24 else np.float64
+        # NumPy has no BLAS matmul for float16/int8, so each kernel is widened once here
+        # rather than per call. The compact kernels in self.layers stay the stored weights.
+        compute_dtype = np.float32 if precision == "float16" else self.accumulator
+        self.compute_kernels = [kernel.astype(compute_dtype) for _, kernel, _, _ in layers]
+
+    def layer_output(self, i: int, h: np.ndarray) -> np.ndarray:
+        kernel, bias = self.compute_kernels[i], self.layers[i][2]
+        if self.precision == "float16":
+            return self._activations[i](h @ kernel + bias)
+
+        if i == 0:
+            # Static scales: clip inputs outside the calibrated range
+            quantized = np.clip(np.rint(h / self.input_scale), -127, 127, dtype=self.accumulator)
+            h = quantized @ kernel
+        else:
+            # Per-row scales map each row's largest value to 127, so no clip is needed
+            scale = np.abs(h).max(axis=1, keepdims=True)
+            np.maximum(scale, 1e-12, out=scale)
+            scale /= 127
+            quantized = np.rint(h / scale).astype(self.accumulator, copy=False)
+            h = quantized @ kernel
+            h *= scale
+        h *= self.kernel_scales[i]
+        h += bias
+        return self._activations[i](h.astype(np.float32, copy=False))
+
+    def weight_arrays(self) -> List[np.ndarray]:
+        arrays = super().weight_arrays() + list(self.kernel_scales)
+        if self.input_scale is not None:
+            arrays.append(self.input_scale)
+        return arrays
+
+    def runtime_arrays(self) -> List[np.ndarray]:
+        return self.weight_arrays() + self.compute_kernels
+
+
+@lru_cache(maxsize=1)
+def feature_bounds() -> tuple:
+    """Lower/upper bounds of each feature (in FEATURE_NAMES order) from the FarmInput fields"""
+    lower, upper = [], []
+    for name in FEATURE_NAMES:
+        metadata = FarmInput.model_fields[name].metadata
+        lower.append(next(m.ge for m in metadata if hasattr(m, "ge")))
+        upper.append(next(m.le for m in metadata if hasattr(m, "le")))
+    return np.array(lower, dtype=np.float64), np.array(upper, dtype=np.float64)
+
+
+def out_of_range_mask(values: np.ndarray) -> np.ndarray:
+    """(N, 7) mask of feature values outside the FarmInput ranges (or non-finite)"""
+    lower, upper = feature_bounds()
+    # Compare at the input's precision: float32(675.9) > 675.9, yet it is the same bound
+    if values.dtype.kind == "f":
+        lower, upper = lower.astype(values.dtype), upper.astype(values.dtype)
+    return ~((values >= lower) & (values <= upper))
+
+
+def reference_inputs(n: int = 256, seed: int = 0) -> np.ndarray:
+    """Deterministic (n, 7) sample spanning the FarmInput ranges, for parity checks"""
+    lower, upper = feature_bounds()
+    rng = np.random.default_rng(seed)
+    return lower + rng.random((n, len(FEATURE_NAMES))) * (upper - lower)
+
+
+def check_numpy_parity(numpy_model: NumpyDenseModel, selected_model: Path, scaler):
+    """Compare the NumPy model against Keras on reference inputs.
+
+    Returns the model to serve: the NumPy model when it matches (or Keras is not
+    installed to compare against), otherwise the Keras model as a safe fallback.
+    """
+    try:
+        keras_model = load_keras_model(selected_model)
+    except Exception as e:
+        logger.warning(f"⚠️  Skipping NumPy/Keras parity check, Keras model unavailable: {e}")
+        return numpy_model
+
+    reference_scaled = scaler.transform(reference_inputs())
+    numpy_output = np.ravel(numpy_model.predict(reference_scaled))
+    keras_output = np.ravel(keras_model.predict(reference_scaled, batch_size=len(reference_scaled), verbose=0))
+    max_error = float(np.max(np.abs(numpy_output - keras_output)))
+    tolerance = MODEL_PARITY_TOLERANCE * max(1.0, float(np.max(np.abs(keras_output))))
+    if max_error > tolerance:
+        logger.error(f"❌ NumPy/Keras parity check failed (max abs error {max_error:.6g} > {tolerance:.6g}); serving Keras model")
+        return keras_model
+
+    logger.info(f"✅ NumPy/Keras parity check passed (max abs error {max_error:.3g})")
+    return numpy_model
+
+
+class AffineScaler:
+    """Precomputed per-feature affine transform ``x * coef + offset``.
+
+    Built once from a fitted sklearn scaler so the request path does plain NumPy
+    arithmetic without sklearn's input validation. When ``folded`` is set the transform
+    has been folded into the model's first layer and ``transform`` is a pass-through.
+    """
+
+    def __init__(self, coef: np.ndarray, offset: np.ndarray, source: str, folded: bool = False):
+        self.coef = np.asarray(coef, dtype=np.float64)
+        self.offset = np.asarray(offset, dtype=np.float64)
+        self.source = source
+        self.folded = folded
+
+    @classmethod
+    def from_sklearn(cls, scaler) -> "AffineScaler":
+        name = type(scaler).__name__
+        n = len(FEATURE_NAMES)
+        if name == "StandardScaler":
+            mean = scaler.mean_ if getattr(scaler, "with_mean", True) and scaler.mean_ is not None else np.zeros(n)
+            scale = scaler.scale_ if getattr(scaler, "with_std", True) and scaler.scale_ is not None else np.ones(n)
+            coef = 1.0 / scale
+            offset = -mean / scale
+        elif name == "MinMaxScaler":
+            coef, offset = scaler.scale_, scaler.min_
+        elif name == "RobustScaler":
+            center = scaler.center_ if scaler.center_ is not None else np.zeros(n)
+            scale = scaler.scale_ if scaler.scale_ is not None else np.ones(n)
+            coef = 1.0 / scale
+            offset = -center / scale
+        elif name == "MaxAbsScaler":
+            coef, offset = 1.0 / scaler.scale_, np.zeros(n)
+        else:
+            raise ValueError(f"Cannot extract affine parameters from {name}")
+        return cls(coef, offset, name)
+
+    def transform(self, X) -> np.ndarray:
+        if self.folded:
+            return X
+        return np.asarray(X, dtype=np.float64) * self.coef + self.offset
+
+
+def fuse_scaler(raw_scaler, loaded_model):
+    """Replace the sklearn scaler with its affine form, folding it into the model when possible.
+
+    The affine form is checked against ``raw_scaler.transform`` on reference inputs and
+    the folded model against the unfolded one; on any mismatch the unfused pieces are kept.
+    Returns ``(scaler, model)`` to serve.
+    """
+    try:
+        affine = AffineScaler.from_sklearn(raw_scaler)
+    except (ValueError, AttributeError) as e:
+        logger.warning(f"⚠️  Keeping sklearn scaler on the request path: {e}")
+        return raw_scaler, loaded_model
+
+    reference = reference_inputs()
+    expected = raw_scaler.transform(reference)
+    if not np.allclose(affine.transform(reference), expected, rtol=1e-9, atol=1e-9):
+        logger.error("❌ Fused scaler does not match scaler_X.transform; keeping sklearn scaler")
+        return raw_scaler, loaded_model
+    logger.info(f"✅ Scaler fused into precomputed affine transform ({affine.source})")
+
+    if not (SCALER_FOLD and isinstance(loaded_model, NumpyDenseModel)):
+        return affine, loaded_model
+
+    folded_model = loaded_model.fold_input_affine(affine.coef, affine.offset)
+    unfolded_output = np.ravel(loaded_model.predict(expected))
+    folded_output = np.ravel(folded_model.predict(reference))
+    max_error = float(np.max(np.abs(folded_output - unfolded_output)))
+    tolerance = MODEL_PARITY_TOLERANCE * max(1.0, float(np.max(np.abs(unfolded_output))))
+    if max_error > tolerance:
+        logger.error(f"❌ Folded scaler changes model output (max abs error {max_error:.6g}); not folding")
+        return affine, loaded_model
+
+    logger.info(f"✅ Scaler folded into first Dense layer (max abs error {max_error:.3g})")
+    return AffineScaler(affine.coef, affine.offset, affine.source, folded=True), folded_model
+
+
+# Reduced-precision variants
+def precision_reference_inputs() -> np.ndarray:
+    """Reference set for the precision gate: dataset rows within the FarmInput ranges, else synthetic"""
+    path = PRECISION_REFERENCE_PATH
+    if path.exists():
+        try:
+            with open(path, newline="") as f:
+                reader = csv.reader(f)
+                header = [name.strip().lower() for name in next(reader)]
+                columns = [header.index(name) for name in FEATURE_NAMES]
+                # Incomplete rows (empty cells) become NaN and are dropped with the out-of-range ones
+                rows = np.array(
+                    [[float(row[i]) if row[i].strip() else np.nan for i in columns] for row in reader if row],
+                    dtype=np.float64
+                ).reshape(-1, len(FEATURE_NAMES))
+            rows = rows[~out_of_range_mask(rows).any(axis=1)]
+            if len(rows):
+                return rows
+        except (OSError, ValueError, IndexError, StopIteration) as e:
+            logger.warning(f"⚠️  Unusable precision reference set {path}: {e}; using synthetic inputs")
+    return reference_inputs(2048, seed=1)
+
+
+def quantize_model(base: NumpyDenseModel, precision: str, scaler) -> QuantizedDenseModel:
+    """Quantized copy of base; the int8 input scales come from the FarmInput ranges as the model sees them"""
+    lower, upper = feature_bounds()
+    bounds = np.vstack([lower, upper])
+    if not getattr(scaler, "folded", False):
+        bounds = scaler.transform(bounds)
+    return QuantizedDenseModel(base, precision, np.abs(bounds).max(axis=0))
+
+
+def compare_precision(reference_model, variant, scaler, inputs: np.ndarray) -> Dict:
+    """Error of variant against reference_model on inputs, relative to the output scale"""
+    scaled = scaler.transform(inputs)
+    expected = np.ravel(reference_model.predict(scaled, batch_size=len(scaled), verbose=0)).astype(np.float64)
+    actual = np.ravel(variant.predict(scaled, batch_size=len(scaled), verbose=0)).astype(np.float64)
+    error = np.abs(np.maximum(actual, 0) - np.maximum(expected, 0))
+    max_error = float(error.max())
+    return {
+        "rows": len(inputs),
+        "max_abs_error": round(max_error, 4),
+        "mean_abs_error": round(float(error.mean()), 4),
+        "relative_max_error": round(max_error / max(1.0, float(np.abs(expected).max())), 6),
+    }
+
+
+def select_precision(loaded_model, loaded_scaler, selected_model: Path) -> tuple:
+    """Apply MODEL_PRECISION behind the accuracy gate.
+
+    Returns ``(model, gate)``: the quantized variant when its error against the float32
+    model is within MODEL_PRECISION_TOLERANCE, else the float32 model. gate is None when
+    float32 was requested.
+    """
+    if MODEL_PRECISION == "float32":
+        return loaded_model, None
+    if MODEL_PRECISION not in MODEL_PRECISIONS:
+        raise ValueError(f"Unknown MODEL_PRECISION '{MODEL_PRECISION}'. Use one of {', '.join(MODEL_PRECISIONS)}.")
+
+    # Quantized variants run on the NumPy path; with the Keras backend they are built from
+    # the same H5 weights and gated against the Keras model
+    base = loaded_model if isinstance(loaded_model, NumpyDenseModel) else NumpyDenseModel.from_h5(selected_model)
+    variant = quantize_model(base, MODEL_PRECISION, loaded_scaler)
+    gate = compare_precision(loaded_model, variant, loaded_scaler, precision_reference_inputs())
+    gate.update({
+        "precision": MODEL_PRECISION,
+        "tolerance": MODEL_PRECISION_TOLERANCE,
+        "passed": gate["relative_max_error"] <= MODEL_PRECISION_TOLERANCE,
+        # Stored shrinks; resident does not, since kernels are widened for BLAS at build
+        "weight_bytes": {
+            "float32_stored": base.weight_nbytes(),
+            "stored": variant.weight_nbytes(),
+            "float32_resident": base.runtime_nbytes(),
+            "resident": variant.runtime_nbytes(),
+        },
+    })
+    if not gate["passed"]:
+        logger.error(
+            f"❌ {MODEL_PRECISION} model failed the accuracy gate (relative max error "
+            f"{gate['relative_max_error']:.4g} > {MODEL_PRECISION_TOLERANCE}); serving float32"
+        )
+        return loaded_model, gate
+    logger.info(
+        f"✅ Serving {MODEL_PRECISION} model: max abs error {gate['max_abs_error']:.3g} over {gate['rows']} "
+        f"reference rows, stored weights {base.weight_nbytes()} -> {variant.weight_nbytes()} bytes, "
+        f"resident {base.runtime_nbytes()} -> {variant.runtime_nbytes()} bytes"
+    )
+    return variant, gate
+
+
+# Uncertainty estimation
+UNCERTAINTY_MODES = ("off", "mc_dropout", "ensemble")
+
+
+class DenseEnsemble:
+    """Ensemble of NumpyDenseModels with the same architecture, scored in one batched pass.
+
+    Member kernels are stacked to (K, in, out), so the K predictions of every row come from
+    one batched matmul per layer over the input broadcast to (K, N, in).
+    """
+
+    def __init__(self, members: List[NumpyDenseModel]):
+        architecture = [(kernel.shape, activation) for _, kernel, _, activation in members[0].layers]
+        for member in members[1:]:
+            if [(kernel.shape, activation) for _, kernel, _, activation in member.layers] != architecture:
+                raise ValueError("Ensemble members must share the served model's layer shapes and activations")
+        self.size = len(members)
+        self.kernels = [np.stack([m.layers[i][1] for m in members]) for i in range(len(architecture))]
+        self.biases = [np.stack([m.layers[i][2] for m in members])[:, None, :] for i in range(len(architecture))]
+        self._activations = members[0]._activations
+
+    def predict_samples(self, x, samples: int, rng: Optional[np.random.Generator] = None) -> np.ndarray:
+        """(samples, N, outputs) predictions from the first ``samples`` members"""
+        x = np.asarray(x, dtype=np.float32)
+        h = np.broadcast_to(x, (samples,) + x.shape)
+        for kernel, bias, activation in zip(self.kernels, self.biases, self._activations):
+            h = activation(np.matmul(h, kernel[:samples]) + bias[:samples])
+        return h
+
+
+class UncertaintyEstimator:
+    """Draws K predictions per row for predictive intervals.
+
+    ``sampler(x_scaled, samples, rng)`` returns (K, N, outputs): MC-dropout passes of the
+    served model, or the members of a DenseEnsemble.
+    """
+
+    def __init__(self, mode: str, sampler, samples: int, coverage: float):
+        self.mode = mode
+        self.sampler = sampler
+        self.samples = samples
+        self.coverage = coverage
+        self.quantiles = ((1 - coverage) / 2, (1 + coverage) / 2)
+
+    def sample(self, x_scaled: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+        """(K, N) non-negative predictions, clamped like predict_array"""
+        output = np.asarray(self.sampler(x_scaled, self.samples, rng), dtype=np.float64)
+        return np.maximum(output.reshape(self.samples, len(x_scaled)), 0)
+
+    def summary(self) -> Dict:
+        return {"mode": self.mode, "samples": self.samples, "coverage": self.coverage}
+
+
+def keras_mc_dropout_sampler(keras_model):
+    """MC-dropout sampler for a Keras model: one call with training=True on the tiled input"""
+    def sample(x, samples, rng=None):
+        tiled = np.tile(np.asarray(x, dtype=np.float32), (samples, 1))
+        return np.asarray(keras_model(tiled, training=True)).reshape(samples, len(x), -1)
+    return sample
+
+
+def build_uncertainty(loaded_model, loaded_scaler, selected_model: Path) -> Optional[UncertaintyEstimator]:
+    """Build the UNCERTAINTY_MODE estimator for the loaded model, or None when off or unusable"""
+    if UNCERTAINTY_MODE == "off":
+        return None
+    if UNCERTAINTY_MODE not in UNCERTAINTY_MODES:
+        raise ValueError(f"Unknown UNCERTAINTY_MODE '{UNCERTAINTY_MODE}'. Use one of {', '.join(UNCERTAINTY_MODES)}.")
+
+    try:
+        if UNCERTAINTY_MODE == "mc_dropout":
+            if isinstance(loaded_model, NumpyDenseModel):
+                has_dropout = any(rate > 0 for rate in loaded_model.dropout_rates)
+                sampler = loaded_model.predict_samples
+            else:
+                has_dropout = any(type(layer).__name__ == "Dropout" for layer in loaded_model.layers)
+                sampler = keras_mc_dropout_sampler(loaded_model)
+            if not has_dropout:
+                raise ValueError("the model has no dropout layers")
+            samples = UNCERTAINTY_SAMPLES
+        else:
+            if not UNCERTAINTY_ENSEMBLE_PATHS:
+                raise ValueError("UNCERTAINTY_ENSEMBLE_PATHS lists no ensemble members")
+            members = [NumpyDenseModel.from_h5(path) for path in [selected_model] + UNCERTAINTY_ENSEMBLE_PATHS]
+            if isinstance(loaded_scaler, AffineScaler) and loaded_scaler.folded:
+                # Members take the same inputs as the served model, whose first layer absorbed the scaler
+                members = [m.fold_input_affine(loaded_scaler.coef, loaded_scaler.offset) for m in members]
+            ensemble = DenseEnsemble(members)
+            sampler = ensemble.predict_samples
+            samples = min(UNCERTAINTY_SAMPLES, ensemble.size)
+    except Exception as e:
+        logger.error(f"❌ Uncertainty estimation ({UNCERTAINTY_MODE}) disabled: {e}")
+        return None
+
+    logger.info(f"✅ Uncertainty estimation: {UNCERTAINTY_MODE}, {samples} samples per row, {UNCERTAINTY_INTERVAL:.0%} intervals")
+    return UncertaintyEstimator(UNCERTAINTY_MODE, sampler, samples, UNCERTAINTY_INTERVAL)
+
+
+# Compiled model artifacts
+def source_files_hash(*paths: Path) -> str:
+    """SHA-256 over the artifact format version and the contents of the given files"""
+    digest = hashlib.sha256(f"artifact-v{ARTIFACT_FORMAT_VERSION}".encode())
+    for path in paths:
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def artifact_path_for(source_hash: str) -> Path:
+    return ARTIFACT_CACHE_DIR / f"compiled_{source_hash[:16]}.npz"
+
+
+def save_model_artifact(path: Path, numpy_model: NumpyDenseModel, scaler: AffineScaler, metadata: Dict):
+    """Write an uncompressed .npz holding the layer weights, scaler params and metadata"""
+    arrays = {"scaler_coef": scaler.coef, "scaler_offset": scaler.offset}
+    for i, (_, kernel, bias, _) in enumerate(numpy_model.layers):
+        arrays[f"kernel_{i}"] = kernel
+        arrays[f"bias_{i}"] = bias
+    metadata = {
+        **metadata,
+        "format_version": ARTIFACT_FORMAT_VERSION,
+        "layers": [{"name": name, "activation": act} for name, _, _, act in numpy_model.layers],
+        "dropout_rates": numpy_model.dropout_rates,
+        "input_dim": numpy_model.input_shape[1],
+        "scaler_source": scaler.source,
+        "created": datetime.now().isoformat(),
+    }
+    arrays["metadata"] = np.array(json.dumps(metadata))
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+
+def load_model_artifact(path: Path) -> tuple:
+    """Load a compiled artifact into ``(model, scaler, metadata)`` without Keras or sklearn"""
+    with np.load(str(path), allow_pickle=False) as data:
+        metadata = json.loads(str(data["metadata"]))
+        if metadata.get("format_version") != ARTIFACT_FORMAT_VERSION:
+            raise ValueError(f"Unsupported artifact format {metadata.get('format_version')}")
+        layers = [
+            (layer["name"], data[f"kernel_{i}"], data[f"bias_{i}"], layer["activation"])
+            for i, layer in enumerate(metadata["layers"])
+        ]
+        scaler = AffineScaler(data["scaler_coef"], data["scaler_offset"], metadata["scaler_source"])
+
+    loaded_model = NumpyDenseModel(layers, metadata["input_dim"], metadata["dropout_rates"])
+    if SCALER_FOLD:
+        loaded_model = loaded_model.fold_input_affine(scaler.coef, scaler.offset)
+        scaler = AffineScaler(scaler.coef, scaler.offset, scaler.source, folded=True)
+    return loaded_model, scaler, metadata
+
+
+def compile_model_artifact(path: Path, selected_model: Path, served_model, served_scaler, source_hash: str) -> bool:
+    """Compile the served model + scaler into an artifact, verified against the served output"""
+    if not isinstance(served_scaler, AffineScaler):
+        logger.info("Skipping artifact compile: scaler has no affine form")
+        return False
+    try:
+        numpy_model = NumpyDenseModel.from_h5(selected_model)
+        scaler = AffineScaler(served_scaler.coef, served_scaler.offset, served_scaler.source)
+
+        reference = reference_inputs()
+        artifact_output = np.ravel(numpy_model.predict(scaler.transform(reference)))
+        served_output = np.ravel(served_model.predict(served_scaler.transform(reference), batch_size=len(reference), verbose=0))
+        max_error = float(np.max(np.abs(artifact_output - served_output)))
+        tolerance = MODEL_PARITY_TOLERANCE * max(1.0, float(np.max(np.abs(served_output))))
+        if max_error > tolerance:
+            logger.error(f"❌ Compiled artifact does not match served model (max abs error {max_error:.6g}); not caching")
+            return False
+
+        save_model_artifact(path, numpy_model, scaler, {
+            "source_hash": source_hash,
+            "model_file": str(selected_model),
+            "max_abs_error": max_error,
+        })
+        logger.info(f"✅ Compiled model artifact written to {path}")
+        return True
+    except Exception as e:
+        logger.warning(f"⚠️  Could not compile model artifact: {e}")
+        return False
+
+
+# Utility functions
+def resolve_scaler_path() -> Path:
+    """Locate the scaler_X pickle, falling back to common locations"""
+    scaler_path = Path(SCALER_X_PATH)
+    if not scaler_path.exists():
+        fallbacks = [MODELS_DIR / "scaler_X.pkl", BASE_DIR / "scaler_X.pkl"]
+        scaler_path = next((p for p in fallbacks if p.exists()), None)
+        if scaler_path is None:
+            raise FileNotFoundError(f"Scaler X file '{SCALER_X_PATH}' not found. Checked fallbacks: {fallbacks}")
+    return scaler_path
+
+
+def load_keras_model(selected_model: Path):
+    """Load a Keras model file, trying several strategies for version compatibility"""
+    model = None
+    logger.info(f"Attempting to load Keras model from: {selected_model}")
+    
+    if import_keras() is None:
+        raise RuntimeError("TensorFlow/Keras not properly installed. Please install: pip install tensorflow>=2.16.0")
+    
+    import h5py
+
+    # Try several load strategies for compatibility
+    load_errors = []
+    
+    # Strategy 1: Standard load with keras
+    try:
+        model = keras.models.load_model(str(selected_model), compile=False)
+        logger.info("✅ Keras model loaded successfully (keras.models.load_model)")
+    except Exception as e1:
+        load_errors.append(f"Standard load: {str(e1)}")
+        logger.warning(f"keras.models.load_model failed: {e1}")
+        
+        # Strategy 2: Try with tf.keras if tf is available
+        if tf is not None:
+            try:
+                model = tf.keras.models.load_model(str(selected_model), compile=False)
+                logger.info("✅ Keras model loaded successfully (tf.keras.models.load_model)")
+            except Exception as e2:
+                load_errors.append(f"TF Keras load: {str(e2)}")
+                logger.warning(f"tf.keras.models.load_model failed: {e2}")
+                
+                # Strategy 3: Manual reconstruction from H5 file (for batch_shape compatibility)
+                try:
+                    logger.info("Attempting manual model reconstruction from H5 file...")
+                    with h5py.File(str(selected_model), 'r') as f:
+                        # Load model config
+                        if 'model_config' in f.attrs:
+                            config = json.loads(f.attrs['model_config'])
+                            
+                            # Fix batch_shape -> input_shape in config
+                            if 'config' in config and 'layers' in config['config']:
+                                for layer in config['config']['layers']:
+                                    if 'config' in layer and 'batch_shape' in layer['config']:
+                                        batch_shape = layer['config']['batch_shape']
+                                        # Convert batch_shape to input_shape (remove batch dimension)
+                                        if batch_shape and len(batch_shape) > 1:
+                                            layer['config']['input_shape'] = batch_shape[1:]
+                                        del layer['config']['batch_shape']
+                            
+                            # Reconstruct model from modified config
+                            model = tf.keras.models.model_from_json(json.dumps(config))
+                            
+                            # Load weights
+                            model.load_weights(str(selected_model))
+                            logger.info("✅ Model reconstructed successfully with compatibility fixes")
+                        else:
+                            raise ValueError("No model_config found in H5 file")
+                            
+                except Exception as e3:
+                    load_errors.append(f"Manual reconstruction: {str(e3)}")
+                    logger.error("All attempts to load the Keras model failed")
+                    raise RuntimeError("; ".join(load_errors))
+        else:
+            logger.error("TensorFlow not available, skipping tf.keras strategies")
+            raise RuntimeError("; ".join(load_errors))
+
+    return model
+
+
+class ModelBundle:
+    """A loaded model and its scaler, served together and replaced as a unit on reload"""
+
+    def __init__(self, model, scaler, source_hash: str, model_file: Path, loaded_from: str):
+        self.model = model
+        self.scaler = scaler
+        self.source_hash = source_hash
+        self.model_file = model_file
+        self.loaded_from = loaded_from
+        self.backend = "numpy" if isinstance(model, NumpyDenseModel) else "keras"
+        self.precision = getattr(model, "precision", "float32")
+        backend = self.backend if self.precision == "float32" else f"{self.backend} {self.precision}"
+        self.version = f"{MODEL_VERSION} ({model_file.name}, {backend} backend, {source_hash[:12]})"
+        # Result of the MODEL_PRECISION accuracy gate, when a reduced precision was requested
+        self.precision_gate: Optional[Dict] = None
+        # UNCERTAINTY_MODE sampler for predictive intervals, None when off
+        self.uncertainty: Optional[UncertaintyEstimator] = None
+        self.loaded_at = datetime.now().isoformat()
+
+
+def resolve_model_sources() -> tuple:
+    """Locate the model file and scaler pickle to load"""
+    # Prepare list of candidate model files
+    model_candidates = []
+    if isinstance(MODEL_PATH, (str,)):
+        model_candidates = [Path(MODEL_PATH)]
+    else:
+        model_candidates = [MODEL_PATH]
+
+    # If the candidate doesn't exist, check common alternatives in MODELS_DIR and BASE_DIR
+    if not model_candidates[0].exists():
+        alt = [
+            MODELS_DIR / "sequence_model_fixed.h5", 
+            MODELS_DIR / "sequence_model_compatible.h5",
+            MODELS_DIR / "sequence_model.h5", 
+            MODELS_DIR / "sequence_model.keras", 
+            MODELS_DIR / "sequence_model",
+            BASE_DIR / "sequence_model_fixed.h5", 
+            BASE_DIR / "sequence_model.h5", 
+            BASE_DIR / "sequence_model.keras", 
+            BASE_DIR / "sequence_model"
+        ]
+        model_candidates = [p for p in alt if p.exists()]
+
+    if not model_candidates:
+        raise FileNotFoundError(f"Model file not found. Checked: {MODELS_DIR / 'sequence_model.h5'}, {MODELS_DIR / 'sequence_model.keras'}, {BASE_DIR / 'sequence_model.h5'}; or set MODEL_PATH env var.")
+
+    return model_candidates[0], resolve_scaler_path()
+
+
+def build_model_bundle() -> ModelBundle:
+    """Load the trained model and scaler into a new ModelBundle without touching the served one"""
+    selected_model, scaler_path = resolve_model_sources()
+    source_hash = source_files_hash(selected_model, scaler_path)
+    artifact_path = artifact_path_for(source_hash) if MODEL_ARTIFACT_CACHE else None
+
+    loaded_model = loaded_scaler = None
+    loaded_from = "source"
+    if artifact_path is not None and artifact_path.exists():
+        try:
+            loaded_model, loaded_scaler, _ = load_model_artifact(artifact_path)
+            loaded_from = "artifact"
+            logger.info(f"✅ Loaded compiled model artifact {artifact_path.name} (Keras and sklearn skipped)")
+        except Exception as e:
+            logger.warning(f"⚠️  Ignoring unreadable model artifact {artifact_path}: {e}")
+
+    if loaded_from == "source":
+        if MODEL_BACKEND == "numpy":
+            logger.info(f"Loading NumPy inference model from: {selected_model}")
+            loaded_model = NumpyDenseModel.from_h5(selected_model)
+            logger.info(f"✅ NumPy model loaded ({len(loaded_model.layers)} dense layers, no TensorFlow)")
+        elif MODEL_BACKEND == "keras":
+            loaded_model = load_keras_model(selected_model)
+        else:
+            raise ValueError(f"Unknown MODEL_BACKEND '{MODEL_BACKEND}'. Use 'keras' or 'numpy'.")
+
+        # Load scaler for X (features only - target is not scaled)
+        loaded_scaler = joblib.load(str(scaler_path))
+        logger.info("✅ Scaler loaded successfully")
+
+        if MODEL_BACKEND == "numpy" and MODEL_PARITY_CHECK:
+            loaded_model = check_numpy_parity(loaded_model, selected_model, loaded_scaler)
+
+        # Take sklearn off the hot path: precomputed affine transform, folded into the
+        # first Dense layer on the NumPy backend
+        loaded_scaler, loaded_model = fuse_scaler(loaded_scaler, loaded_model)
+
+        if artifact_path is not None and selected_model.suffix == ".h5":
+            compile_model_artifact(artifact_path, selected_model, loaded_model, loaded_scaler, source_hash)
+
+    # The artifact holds float32 weights; reduced-precision variants are derived on load
+    loaded_model, precision_gate = select_precision(loaded_model, loaded_scaler, selected_model)
+
+    # Sanity test the model with a sample prediction (non-invasive)
+    try:
+        logger.info("Testing model with sample input...")
+        test_input = np.array([[2291.0, 258.6, 17.5, 27.0, 59.4, 481.8, 236.3]])
+        test_scaled = loaded_scaler.transform(test_input)
+        test_prediction = loaded_model.predict(test_scaled, verbose=0)
+        test_output = float(np.ravel(test_prediction)[0])
+        logger.info(f"✅ Model test successful. Sample prediction: {test_output:.2f}")
+    except Exception as e:
+        logger.warning(f"Model loaded but sample prediction test failed: {e}")
+
+    bundle = ModelBundle(loaded_model, loaded_scaler, source_hash, selected_model, loaded_from)
+    bundle.precision_gate = precision_gate
+    bundle.uncertainty = build_uncertainty(loaded_model, loaded_scaler, selected_model)
+    return bundle
+
+
+def activate_model(bundle: Optional[ModelBundle]):
+    """Atomically switch the served model; in-flight requests keep the bundle they started with"""
+    global active_model, model, scaler_X
+    active_model = bundle
+    model = bundle.model if bundle is not None else None
+    scaler_X = bundle.scaler if bundle is not None else None
+    # Cached responses belong to the previous model
+    prediction_cache.clear()
+    optimization_cache.clear()
+
+
+def load_model():
+    """Load the trained model and scalers - SPECIFICALLY sequence_model.h5"""
+    global last_load_error
+    try:
+        logger.info("Loading model and scalers...")
+        activate_model(build_model_bundle())
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ Error loading model: {str(e)}")
+        import traceback
+        tb = traceback.format_exc()
+        logger.error(f"Full traceback: {tb}")
+
+        # Reset global variables to ensure clean state
+        activate_model(None)
+        # Record the error for /health diagnostics
+        try:
+            last_load_error = tb
+        except Exception:
+            last_load_error = str(e)
+        return False
+
+
+def warmup_model(batch_sizes: List[int], rounds: int, bundle: Optional[ModelBundle] = None) -> Dict[int, float]:
+    """Run representative batch sizes through the inference path; returns best ms per size"""
+    timings = {}
+    for batch_size in batch_sizes:
+        sample = reference_inputs(batch_size, seed=batch_size)
+        best = None
+        for _ in range(rounds):
+            started = time.perf_counter()
+            predict_array(sample, bundle)
+            elapsed_ms = (time.perf_counter() - started) * 1000.0
+            best = elapsed_ms if best is None else min(best, elapsed_ms)
+        if best is not None:
+            timings[batch_size] = best
+            logger.info(f"Warmup batch_size={batch_size}: {best:.2f} ms")
+    return timings
+
+
+def load_and_warm_model() -> bool:
+    """Load the model and warm it up, moving model_state through loading/warming/ready/failed"""
+    global model_state, model_load_seconds, model_warmup_seconds
+    model_state = "loading"
+    load_rules_engine()
+    started = time.perf_counter()
+    if not load_model():
+        model_state = "failed"
+        logger.error("CRITICAL: Model failed to load. API will not function properly.")
+        return False
+    model_load_seconds = time.perf_counter() - started
+
+    model_state = "warming"
+    started = time.perf_counter()
+    try:
+        warmup_model(WARMUP_BATCH_SIZES, WARMUP_ROUNDS)
+    except Exception as e:
+        logger.warning(f"Model warmup failed: {e}")
+    model_warmup_seconds = time.perf_counter() - started
+
+    model_state = "ready"
+    logger.info(f"✅ Model ready (load {model_load_seconds:.2f}s, warmup {model_warmup_seconds:.2f}s)")
+    return True
+
+
+def share_model_memory(bundle: ModelBundle):
+    """Mark the bundle's weight arrays read-only so forked workers keep sharing their pages"""
+    arrays = []
+    if isinstance(bundle.model, NumpyDenseModel):
+        arrays.extend(bundle.model.runtime_arrays())
+    if isinstance(bundle.scaler, AffineScaler):
+        arrays.extend((bundle.scaler.coef, bundle.scaler.offset))
+    for array in arrays:
+        array.setflags(write=False)
+    shared_bytes = sum(array.nbytes for array in arrays)
+    logger.info(f"✅ {len(arrays)} weight arrays ({shared_bytes / 1024:.1f} KiB) frozen for sharing across workers")
+
+
+def preload_model() -> bool:
+    """Load and warm the model once in a pre-fork master (see gunicorn.conf.py).
+
+    Workers forked afterwards share the weights copy-on-write and skip loading in their
+    lifespan. Only TensorFlow-free bundles are preloaded (NumPy backend, or a compiled
+    artifact): TensorFlow's runtime is not fork-safe, so otherwise each worker loads its own.
+    """
+    global model_preloaded
+    if MODEL_BACKEND != "numpy":
+        try:
+            selected_model, scaler_path = resolve_model_sources()
+            artifact_ready = MODEL_ARTIFACT_CACHE and artifact_path_for(source_files_hash(selected_model, scaler_path)).exists()
+        except Exception as e:
+            logger.warning(f"⚠️  Could not resolve model sources for preload: {e}")
+            artifact_ready = False
+        if not artifact_ready:
+            logger.warning("⚠️  Not preloading: the Keras backend needs TensorFlow, which is not fork-safe. "
+                           "Each worker will load its own model; build the artifact cache or set MODEL_BACKEND=numpy.")
+            return False
+
+    if not load_and_warm_model():
+        return False
+    share_model_memory(active_model)
+    model_preloaded = True
+    return True
+
+
+def ensure_model_ready():
+    """Raise 503 unless the model is loaded and warmed up"""
+    if model_state in ("loading", "warming"):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Model is {model_state}. Please retry shortly.",
+            headers={"Retry-After": str(RETRY_AFTER_S)}
+        )
+    if model is None or scaler_X is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Model not loaded. Please check server logs and ensure sequence_model.h5 is available."
+        )
+    require_rules()
+
+
+# Hot reload
+reload_lock = asyncio.Lock()
+last_reload: Dict = {}
+last_reload_signal_id: Optional[str] = None
+
+
+def validate_model_bundle(bundle: ModelBundle) -> Dict:
+    """Sanity batch for a candidate bundle: finite predictions of the right shape"""
+    reference = reference_inputs(256, seed=1)
+    output = predict_array(reference, bundle)
+    if output.shape != (len(reference),) or not np.all(np.isfinite(output)):
+        raise ValueError("Candidate model produced invalid predictions on the sanity batch")
+    result = {"rows": len(reference), "mean_prediction": round(float(output.mean()), 3)}
+    if active_model is not None:
+        current = predict_array(reference, active_model)
+        result["max_abs_change_vs_active"] = round(float(np.max(np.abs(output - current))), 3)
+    return result
+
+
+def prepare_model_bundle() -> tuple:
+    """Build, warm up and validate a new bundle off the request path"""
+    bundle = build_model_bundle()
+    warmup_model(WARMUP_BATCH_SIZES, WARMUP_ROUNDS, bundle)
+    return bundle, validate_model_bundle(bundle)
+
+
+async def reload_model(force: bool = False, reason: str = "admin") -> Dict:
+    """Load, warm and validate the current model files, then swap them in atomically"""
+    global last_reload, model_state
+    if model_state in ("loading", "warming"):
+        return {"status": "busy", "detail": f"Initial model load is still {model_state}"}
+
+    async with reload_lock:
+        started = time.perf_counter()
+        result = {"reason": reason, "timestamp": datetime.now().isoformat()}
+        try:
+            if not force and active_model is not None:
+                selected_model, scaler_path = await asyncio.to_thread(resolve_model_sources)
+                source_hash = await asyncio.to_thread(source_files_hash, selected_model, scaler_path)
+                if source_hash == active_model.source_hash:
+                    result.update(status="unchanged", model_version=active_model.version)
+                    last_reload = result
+                    return result
+
+            bundle, validation = await asyncio.to_thread(prepare_model_bundle)
+            previous_version = active_model.version if active_model is not None else None
+            activate_model(bundle)
+            model_state = "ready"
+            result.update(
+                status="reloaded",
+                model_version=bundle.version,
+                previous_version=previous_version,
+                validation=validation,
+            )
+            logger.info(f"✅ Model reloaded ({reason}): {bundle.version}")
+        except Exception as e:
+            logger.error(f"❌ Model reload failed ({reason}), keeping current model: {e}")
+            result.update(status="failed", error=str(e))
+        result["seconds"] = round(time.perf_counter() - started, 3)
+        last_reload = result
+        return result
+
+
+def model_files_signature() -> tuple:
+    """(name, size, mtime) of every model/scaler file, used to detect changes"""
+    paths = set()
+    if MODELS_DIR.exists():
+        paths.update(p for p in MODELS_DIR.iterdir() if p.is_file() and not p.name.startswith("."))
+    for path in (Path(MODEL_PATH), Path(SCALER_X_PATH)):
+        if path.exists():
+            paths.add(path)
+    signature = []
+    for path in sorted(paths):
+        stat = path.stat()
+        signature.append((str(path), stat.st_size, stat.st_mtime_ns))
+    return tuple(signature)
+
+
+async def watch_model_files(interval: float):
+    """Poll the model files and reload once a change has been stable for one interval"""
+    logger.info(f"Watching {MODELS_DIR} for model changes every {interval:g}s")
+    last_seen = await asyncio.to_thread(model_files_signature)
+    pending = None
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            current = await asyncio.to_thread(model_files_signature)
+        except OSError as e:
+            logger.warning(f"Model watcher could not scan files: {e}")
+            continue
+        if current == last_seen:
+            pending = None
+        elif current == pending:
+            # Unchanged since the previous poll, so the files are fully written
+            await reload_model(reason="file_watcher")
+            last_seen = current
+            pending = None
+        else:
+            pending = current
+
+
+def read_reload_signal() -> Optional[Dict]:
+    """The latest reload request shared between workers, or None"""
+    try:
+        return json.loads(RELOAD_SIGNAL_PATH.read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def write_reload_signal(force: bool) -> str:
+    """Ask the other workers to reload; written atomically so pollers never see half a file"""
+    signal = {"id": secrets.token_hex(8), "force": force, "pid": os.getpid(), "timestamp": datetime.now().isoformat()}
+    tmp_path = RELOAD_SIGNAL_PATH.with_name(f"{RELOAD_SIGNAL_PATH.name}.{os.getpid()}.tmp")
+    tmp_path.write_text(json.dumps(signal))
+    os.replace(tmp_path, RELOAD_SIGNAL_PATH)
+    return signal["id"]
+
+
+async def watch_reload_signal(interval: float):
+    """Reload this worker whenever another worker has handled /admin/reload"""
+    global last_reload_signal_id
+    first_poll = True
+    while True:
+        signal = await asyncio.to_thread(read_reload_signal)
+        if signal is not None and signal.get("id") != last_reload_signal_id:
+            last_reload_signal_id = signal.get("id")
+            # A worker respawned after a reload starts from the master's preloaded model; a
+            # non-forced reload catches it up only if the files differ
+            force = bool(signal.get("force")) and not first_poll
+            await reload_model(force=force, reason=f"admin via worker {signal.get('pid')}")
+        first_poll = False
+        await asyncio.sleep(interval)
+
+
+def require_admin(x_admin_token: Optional[str]):
+    """Reject admin requests unless ADMIN_TOKEN is configured and matches"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin endpoints are disabled. Set ADMIN_TOKEN to enable them."
+        )
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or missing X-Admin-Token header"
+        )
+
+
+RULE_OPERATORS = {
+    "<": np.less,
+    "<=": np.less_equal,
+    ">": np.greater,
+    ">=": np.greater_equal,
+}
+# Rules may test the model output as well as the inputs
+RULE_COLUMNS = FEATURE_NAMES + ["prediction"]
+
+
+class RulesEngine:
+    """Recommendation and confidence rules compiled from a declarative table (rules.json).
+
+    Every band ("temperature < 18") and confidence limit becomes one bit. A batch is
+    evaluated with one vectorized comparison per operator into an (N, n_bits) matrix that is
+    packed into a uint64 bitmask per farm. Each distinct bitmask is resolved once to its
+    message codes, message texts and confidence score, and the result is memoized.
+    """
+
+    MAX_BITS = 64
+    MAX_RESOLVED = 65536
+
+    def __init__(self, config: Dict, source: str = "<config>"):
+        self.source = source
+        farm_size = config["farm_size"]
+        self.farm_size_column = FEATURE_NAMES.index(farm_size["feature"])
+        self.farm_size_thresholds = np.asarray(farm_size["thresholds"], dtype=np.float64)
+        self.farm_size_categories = np.asarray(farm_size["categories"])
+        if len(self.farm_size_categories) != len(self.farm_size_thresholds) + 1:
+            raise ValueError(f"{source}: farm_size needs one more category than thresholds")
+        if np.any(np.diff(self.farm_size_thresholds) <= 0):
+            raise ValueError(f"{source}: farm_size thresholds must be increasing")
+
+        # Per-bit condition arrays: value column, operator, threshold and optional baseline
+        # (threshold = column[baseline] * rate * value)
+        columns, operators, values, baseline_columns, baseline_rates = [], [], [], [], []
+
+        def add_bit(column: str, op: str, value: float, baseline: Optional[Dict] = None) -> int:
+            if column not in RULE_COLUMNS:
+                raise ValueError(f"{source}: unknown rule feature '{column}'")
+            if op not in RULE_OPERATORS:
+                raise ValueError(f"{source}: unknown operator '{op}' (use one of {', '.join(RULE_OPERATORS)})")
+            columns.append(RULE_COLUMNS.index(column))
+            operators.append(op)
+            values.append(float(value))
+            if baseline is not None:
+                if baseline["feature"] not in FEATURE_NAMES:
+                    raise ValueError(f"{source}: unknown baseline feature '{baseline['feature']}'")
+                baseline_columns.append(FEATURE_NAMES.index(baseline["feature"]))
+                baseline_rates.append(float(baseline.get("rate", 1.0)))
+            else:
+                baseline_columns.append(-1)
+                baseline_rates.append(1.0)
+            return len(columns) - 1
+
+        # Message table: bands then the "otherwise" message of each rule, in file order
+        self.messages: List[str] = []
+        self.rules = []
+        for rule in config["recommendations"]:
+            bands = []
+            for band in rule["bands"]:
+                bit = add_bit(rule["feature"], band["op"], band["value"], rule.get("baseline"))
+                self.messages.append(band["message"])
+                bands.append((bit, len(self.messages) - 1))
+            otherwise = -1
+            if rule.get("otherwise") is not None:
+                self.messages.append(rule["otherwise"])
+                otherwise = len(self.messages) - 1
+            self.rules.append({
+                "name": rule["name"],
+                "optimal_range": rule.get("optimal_range"),
+                "guidance": rule.get("guidance"),
+                "bands": bands,
+                "otherwise": otherwise,
+            })
+
+        # Confidence penalties: the multiplier applies when any of the rule's bits is set
+        self.penalties = []
+        for rule in config["confidence"]:
+            mask = 0
+            if "below" in rule:
+                mask |= 1 << add_bit(rule["feature"], "<", rule["below"])
+            if "above" in rule:
+                mask |= 1 << add_bit(rule["feature"], ">", rule["above"])
+            if not mask:
+                raise ValueError(f"{source}: confidence rule for '{rule['feature']}' needs 'below' and/or 'above'")
+            self.penalties.append((mask, float(rule["multiplier"])))
+
+        if len(columns) > self.MAX_BITS:
+            raise ValueError(f"{source}: {len(columns)} rule conditions; at most {self.MAX_BITS} are supported")
+        self.n_bits = len(columns)
+        self.columns = np.asarray(columns, dtype=np.intp)
+        self.values = np.asarray(values, dtype=np.float64)
+        self.baseline_columns = np.asarray(baseline_columns, dtype=np.intp)
+        self.baseline_rates = np.asarray(baseline_rates, dtype=np.float64)
+        self.scaled = np.flatnonzero(self.baseline_columns >= 0)
+        self.operator_groups = [
+            (RULE_OPERATORS[op], np.flatnonzero(np.asarray(operators) == op))
+            for op in RULE_OPERATORS if op in operators
+        ]
+        self.uses_prediction = bool(np.any(self.columns == len(FEATURE_NAMES)))
+        self._resolved: Dict[int, tuple] = {}
+
+    @classmethod
+    def from_file(cls, path: Path) -> "RulesEngine":
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f), source=str(path))
+
+    def bitmasks(self, features: np.ndarray, predictions: Optional[np.ndarray] = None) -> np.ndarray:
+        """Evaluate every condition for an (N, 7) batch and pack the results into uint64 bitmasks"""
+        n = len(features)
+        if predictions is None:
+            predictions = np.zeros(n)
+        table = np.column_stack([features, np.asarray(predictions, dtype=np.float64).reshape(n)])
+        observed = table[:, self.columns]
+        thresholds = np.broadcast_to(self.values, observed.shape)
+        if len(self.scaled):
+            thresholds = thresholds.copy()
+            # Same operation order as "expected = chickens * 0.8; prediction < expected * 0.7"
+            thresholds[:, self.scaled] = (
+                table[:, self.baseline_columns[self.scaled]] * self.baseline_rates[self.scaled]
+            ) * self.values[self.scaled]
+        hits = np.empty(observed.shape, dtype=bool)
+        for compare, bits in self.operator_groups:
+            hits[:, bits] = compare(observed[:, bits], thresholds[:, bits])
+        packed = np.packbits(hits, axis=1, bitorder="little")
+        padded = np.zeros((n, 8), dtype=np.uint8)
+        padded[:, :packed.shape[1]] = packed
+        return padded.view("<u8").reshape(n)
+
+    def resolve(self, mask: int) -> tuple:
+        """(codes, messages, confidence) for one bitmask, memoized"""
+        resolved = self._resolved.get(mask)
+        if resolved is None:
+            codes = []
+            for rule in self.rules:
+                code = next((code for bit, code in rule["bands"] if mask >> bit & 1), rule["otherwise"])
+                codes.append(code)
+            score = 1.0
+            for penalty_mask, multiplier in self.penalties:
+                if mask & penalty_mask:
+                    score *= multiplier
+            resolved = (
+                tuple(codes),
+                [self.messages[code] for code in codes if code >= 0],
+                round(score, 3),
+            )
+            if len(self._resolved) >= self.MAX_RESOLVED:
+                self._resolved.clear()
+            self._resolved[mask] = resolved
+        return resolved
+
+    def evaluate(self, features: np.ndarray, predictions: Optional[np.ndarray] = None) -> tuple:
+        """Evaluate a batch: (codes (N, n_rules) with -1 = none, confidence (N,), message lists)"""
+        masks = self.bitmasks(features, predictions)
+        unique, inverse = np.unique(masks, return_inverse=True)
+        resolved = [self.resolve(int(mask)) for mask in unique.tolist()]
+        codes = np.array([r[0] for r in resolved], dtype=np.int64).reshape(len(resolved), len(self.rules))[inverse]
+        confidence = np.array([r[2] for r in resolved], dtype=np.float64)[inverse]
+        messages = [resolved[i][1] for i in inverse.tolist()]
+        return codes, confidence, messages
+
+    def farm_size_codes(self, features: np.ndarray) -> np.ndarray:
+        """Index into farm_size_categories for each row of an (N, 7) batch"""
+        return np.searchsorted(self.farm_size_thresholds, features[:, self.farm_size_column], side="right")
+
+    def optimal_ranges(self) -> Dict[str, str]:
+        return {rule["name"]: rule["optimal_range"] for rule in self.rules if rule["optimal_range"]}
+
+    def summary(self) -> Dict:
+        return {
+            "source": self.source,
+            "recommendation_rules": len(self.rules),
+            "confidence_rules": len(self.penalties),
+            "conditions": self.n_bits,
+            "messages": len(self.messages),
+            "resolved_bitmasks": len(self._resolved),
+        }
+
+
+def load_rules(path: Path = None) -> RulesEngine:
+    """Compile the rules table at RULES_PATH"""
+    path = path or RULES_PATH
+    engine = RulesEngine.from_file(path)
+    logger.info(f"✅ Rules compiled from {path}: {engine.n_bits} conditions, {len(engine.messages)} messages")
+    return engine
+
+
+# The compiled rules are loaded on the startup path with the model (load_and_warm_model), so
+# a bad rules file fails readiness instead of the import. None until loaded; the compile
+# error, if any, is kept for /health.
+rules_engine: Optional[RulesEngine] = None
+rules_load_error: Optional[str] = None
+
+
+def load_rules_engine() -> bool:
+    """Compile RULES_PATH into rules_engine; on failure keep the previous engine and record the error"""
+    global rules_engine, rules_load_error
+    try:
+        rules_engine = load_rules()
+        rules_load_error = None
+        return True
+    except Exception as e:
+        rules_load_error = f"{RULES_PATH}: {type(e).__name__}: {e}"
+        logger.error(f"❌ Could not compile rules from {RULES_PATH}: {e}")
+        return False
+
+
+def require_rules():
+    """Raise 503 unless the rules table is compiled"""
+    if rules_engine is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Recommendation rules not loaded: {rules_load_error or 'still loading'}"
+        )
+
+
+def get_farm_size_category(num_chickens: float) -> str:
+    """Categorize farm size based on number of chickens"""
+    index = int(np.searchsorted(rules_engine.farm_size_thresholds, num_chickens, side="right"))
+    return str(rules_engine.farm_size_categories[index])
+
+
+def farm_size_categories(num_chickens: np.ndarray) -> np.ndarray:
+    """Vectorized get_farm_size_category over an array of chicken counts"""
+    return rules_engine.farm_size_categories[
+        np.searchsorted(rules_engine.farm_size_thresholds, num_chickens, side="right")
+    ]
+
+
+def generate_recommendations(input_data: FarmInput, prediction: float) -> List[str]:
+    """Generate optimization recommendations based on input parameters"""
+    _, _, messages = rules_engine.evaluate(farms_to_array([input_data]), np.array([prediction]))
+    return list(messages[0])
+
+
+def calculate_confidence(input_data: FarmInput) -> float:
+    """Calculate a confidence score based on input parameter quality"""
+    _, confidence, _ = rules_engine.evaluate(farms_to_array([input_data]))
+    return float(confidence[0])
+
+
+# Metrics: a minimal in-process Prometheus registry (text exposition format 0.0.4).
+# Observations are a bisect plus a locked increment, cheap enough to leave on everywhere.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STAGE_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096, 16384, 65536)
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class CounterChild:
+    def __init__(self):
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self.lock:
+            self.value += amount
+
+
+class HistogramChild:
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+
+class Metric:
+    """One metric family; ``labels(...)`` returns (and caches) the child for a label set"""
+
+    def __init__(self, name: str, documentation: str, kind: str, labelnames: tuple = (), buckets: tuple = None):
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self.children: Dict[tuple, object] = {}
+        self.lock = threading.Lock()
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.get(values)
+                if child is None:
+                    child = HistogramChild(self.buckets) if self.kind == "histogram" else CounterChild()
+                    self.children[values] = child
+        return child
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in list(self.children.items()):
+            if self.kind == "histogram":
+                with child.lock:
+                    counts, total, count = list(child.counts), child.sum, child.count
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    le = "+Inf" if bound == float("inf") else repr(float(bound))
+                    labels = format_labels(self.labelnames, values, 'le="' + le + '"')
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                lines.append(f"{self.name}_sum{format_labels(self.labelnames, values)} {total!r}")
+                lines.append(f"{self.name}_count{format_labels(self.labelnames, values)} {count}")
+            else:
+                lines.append(f"{self.name}{format_labels(self.labelnames, values)} {child.value!r}")
+        return lines
+
+
+class MetricsRegistry:
+    """Counters and histograms plus gauges read from callbacks at scrape time"""
+
+    def __init__(self):
+        self.metrics: List[Metric] = []
+        self.gauges = []
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Metric:
+        metric = Metric(name, documentation, "counter", labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Metric:
+        metric = Metric(name, documentation, "histogram", labelnames, tuple(buckets))
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, documentation: str, callback, labelnames: tuple = ()):
+        """callback() returns a number, or a list of (label values, number) when labelnames is set"""
+        self.gauges.append((name, documentation, callback, labelnames))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for name, documentation, callback, labelnames in self.gauges:
+            try:
+                samples = callback()
+            except Exception as e:
+                logger.warning(f"⚠️  Metrics gauge {name} failed: {e}")
+                continue
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} gauge")
+            if not labelnames:
+                samples = [((), samples)]
+            for values, value in samples:
+                if value is not None:
+                    lines.append(f"{name}{format_labels(labelnames, values)} {float(value)!r}")
+        return "\n".join(lines) + "\n"
+
+
+def process_rss_bytes() -> Optional[int]:
+    """Resident set size from /proc (Linux), falling back to the peak RSS from getrusage"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        try:
+            import resource
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        except ImportError:
+            return None
+
+
+metrics = MetricsRegistry()
+HTTP_REQUESTS = metrics.counter(
+    "http_requests_total", "HTTP requests by route and status", ("method", "endpoint", "status")
+)
+HTTP_LATENCY = metrics.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "endpoint")
+)
+STAGE_LATENCY = metrics.histogram(
+    "inference_stage_duration_seconds",
+    "Time per pipeline stage (validation, scale, predict, rules, serialize)",
+    ("stage",), STAGE_BUCKETS
+)
+MODEL_BATCH_ROWS = metrics.histogram(
+    "model_batch_rows", "Rows per predict_array call", buckets=BATCH_SIZE_BUCKETS
+).labels()
+ERRORS = metrics.counter("errors_total", "Errors by exception type", ("type",))
+STAGE_VALIDATION = STAGE_LATENCY.labels("validation")
+STAGE_SCALE = STAGE_LATENCY.labels("scale")
+STAGE_PREDICT = STAGE_LATENCY.labels("predict")
+STAGE_RULES = STAGE_LATENCY.labels("rules")
+STAGE_SERIALIZE = STAGE_LATENCY.labels("serialize")
+
+metrics.gauge("model_load_duration_seconds", "Duration of the last model load", lambda: model_load_seconds)
+metrics.gauge("model_warmup_duration_seconds", "Duration of the last warmup", lambda: model_warmup_seconds)
+metrics.gauge(
+    "model_state", "1 for the current model lifecycle state",
+    lambda: [((state,), 1 if model_state == state else 0) for state in ("loading", "warming", "ready", "failed")],
+    ("state",)
+)
+metrics.gauge("process_resident_memory_bytes", "Resident memory size in bytes", process_rss_bytes)
+metrics.gauge("process_cpu_seconds_total", "Process CPU time in seconds", time.process_time)
+
+
+def record_error(exc: BaseException):
+    ERRORS.labels(type(exc).__name__).inc()
+
+
+def observe_validation(request: Request):
+    """Record time from the last body chunk to handler entry (JSON decode + Pydantic validation)"""
+    received_at = request.scope.get("body_received_at")
+    if received_at is not None:
+        STAGE_VALIDATION.observe(time.perf_counter() - received_at)
+
+
+class MetricsMiddleware:
+    """ASGI middleware counting requests and timing them per route template.
+
+    Also stamps ``body_received_at`` into the scope when the last body chunk arrives, so
+    handlers can attribute the time until they run to request validation.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.route_paths: Dict[object, str] = {}
+
+    def endpoint_label(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        path = self.route_paths.get(endpoint)
+        if path is None:
+            path = next((route.path for route in app.routes if getattr(route, "endpoint", None) is endpoint), "unmatched")
+            self.route_paths[endpoint] = path
+        return path
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status_code = 500
+
+        async def timed_receive():
+            message = await receive()
+            if message["type"] == "http.request" and not message.get("more_body", False):
+                scope["body_received_at"] = time.perf_counter()
+            return message
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, timed_receive, send_with_status)
+        except Exception as e:
+            record_error(e)
+            raise
+        finally:
+            endpoint = self.endpoint_label(scope)
+            HTTP_REQUESTS.labels(scope["method"], endpoint, str(status_code)).inc()
+            HTTP_LATENCY.labels(scope["method"], endpoint).observe(time.perf_counter() - start)
+
+
+app.add_middleware(MetricsMiddleware)
+
+
+# Request profiling. The middleware is only installed when PROFILE_SAMPLE_RATE > 0 or
+# PROFILE_ON_DEMAND is set, so there is no cost when profiling is off.
+request_profile: contextvars.ContextVar = contextvars.ContextVar("request_profile", default=None)
+PROFILE_ID_PATTERN = re.compile(r"^\d{8}T\d{12}-[0-9a-f]{6}$")
+# cProfile hooks the event loop thread, so only one request is profiled at a time
+profile_in_progress = False
+
+
+class RequestProfile:
+    """cProfile of one request: the handler on the event loop plus its inference jobs.
+
+    Inference jobs run on executor threads, which the event loop profiler cannot see, so
+    InferenceExecutor wraps them with ``wrap()`` to profile each job in its worker thread;
+    the per-thread stats are merged into one summary.
+    """
+
+    def __init__(self, method: str, path: str, trace_tensorflow: bool = False):
+        # Timestamp prefix (to the microsecond) so ids sort chronologically for rotation
+        self.id = f"{datetime.now():%Y%m%dT%H%M%S%f}-{secrets.token_hex(3)}"
+        self.method = method
+        self.path = path
+        self.trace_tensorflow = trace_tensorflow
+        self.notes: List[str] = []
+        self.profiler = cProfile.Profile()
+        self.worker_profiles = []
+        self.lock = threading.Lock()
+        self.elapsed = 0.0
+
+    def wrap(self, fn):
+        def profiled(*args):
+            profiler = cProfile.Profile()
+            try:
+                return profiler.runcall(fn, *args)
+            finally:
+                with self.lock:
+                    self.worker_profiles.append(profiler)
+        return profiled
+
+    def start(self):
+        if self.trace_tensorflow:
+            self.start_tensorflow_trace()
+        self.started = time.perf_counter()
+        self.profiler.enable()
+
+    def stop(self):
+        self.profiler.disable()
+        self.elapsed = time.perf_counter() - self.started
+        if self.trace_tensorflow:
+            self.stop_tensorflow_trace()
+
+    def start_tensorflow_trace(self):
+        if active_model is None or active_model.backend != "keras":
+            self.notes.append("TensorFlow trace skipped: the Keras backend is not active")
+            self.trace_tensorflow = False
+            return
+        try:
+            import tensorflow as _tf
+            _tf.profiler.experimental.start(str(PROFILE_DIR / f"{self.id}-tf"))
+        except Exception as e:
+            self.notes.append(f"TensorFlow trace unavailable: {e}")
+            self.trace_tensorflow = False
+
+    def stop_tensorflow_trace(self):
+        try:
+            import tensorflow as _tf
+            _tf.profiler.experimental.stop()
+            self.notes.append(f"TensorFlow trace written to {PROFILE_DIR / (self.id + '-tf')}")
+        except Exception as e:
+            self.notes.append(f"TensorFlow trace failed: {e}")
+
+    def stats(self) -> pstats.Stats:
+        stats = pstats.Stats(self.profiler, stream=io.StringIO())
+        for profiler in self.worker_profiles:
+            stats.add(profiler)
+        return stats
+
+    def summary(self) -> str:
+        stream = io.StringIO()
+        stream.write(f"{self.method} {self.path}  profile {self.id}  {self.elapsed * 1000:.2f} ms wall, "
+                     f"{len(self.worker_profiles)} inference job(s)\n")
+        for note in self.notes:
+            stream.write(f"{note}\n")
+        stats = self.stats()
+        stats.stream = stream
+        # Self time finds the hot functions; cumulative time shows which call path they sit under
+        stats.sort_stats("tottime").print_stats(PROFILE_TOP_N)
+        stats.sort_stats("cumulative").print_stats(PROFILE_TOP_N)
+        return stream.getvalue()
+
+    def save(self):
+        """Write <id>.txt (top hotspots) and <id>.prof (pstats dump), then rotate old profiles"""
+        PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+        (PROFILE_DIR / f"{self.id}.txt").write_text(self.summary(), encoding="utf-8")
+        self.stats().dump_stats(str(PROFILE_DIR / f"{self.id}.prof"))
+        for old in sorted(PROFILE_DIR.glob("*.txt"), reverse=True)[PROFILE_KEEP:]:
+            for path in (old, old.with_suffix(".prof")):
+                path.unlink(missing_ok=True)
+            shutil.rmtree(PROFILE_DIR / f"{old.stem}-tf", ignore_errors=True)
+        logger.info(f"✅ Profiled {self.method} {self.path} in {self.elapsed * 1000:.2f} ms -> {PROFILE_DIR / self.id}.txt")
+
+
+def list_profiles() -> List[str]:
+    """Saved profile ids, newest first"""
+    if not PROFILE_DIR.exists():
+        return []
+    return [path.stem for path in sorted(PROFILE_DIR.glob("*.txt"), reverse=True)]
+
+
+class ProfilingMiddleware:
+    """Profile a sampled fraction of prediction requests, or one request on admin demand.
+
+    On-demand profiling needs ``X-Profile: 1`` (or ``X-Profile: tf`` to add a TensorFlow
+    trace) together with a valid ``X-Admin-Token``. Profiled responses carry an
+    ``X-Profile-Id`` header naming the saved summary.
+
+    Limitation: cProfile runs on the event-loop thread for the whole request, so any other
+    coroutine that runs meanwhile (other requests' validation, serialization, the batcher) is
+    attributed to the profiled request. Inference jobs are profiled per worker thread and are
+    not affected. The summary notes how many other requests overlapped the profile; profile
+    on an otherwise idle server for a clean attribution.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        # HTTP requests in flight and started, to report overlap with a profile
+        self.in_flight = 0
+        self.started = 0
+
+    def requested(self, scope) -> Optional[str]:
+        headers = dict(scope["headers"])
+        header = headers.get(b"x-profile")
+        if header is not None and PROFILE_ON_DEMAND and ADMIN_TOKEN:
+            token = headers.get(b"x-admin-token", b"").decode("latin-1")
+            if token and hmac.compare_digest(token, ADMIN_TOKEN):
+                return "tf" if header.strip().lower() == b"tf" else "cprofile"
+            logger.warning(f"⚠️  Ignoring X-Profile on {scope['path']}: invalid or missing X-Admin-Token")
+        if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+            return "cprofile"
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        self.in_flight += 1
+        self.started += 1
+        try:
+            await self.handle(scope, receive, send)
+        finally:
+            self.in_flight -= 1
+
+    async def handle(self, scope, receive, send):
+        global profile_in_progress
+        if not scope["path"].startswith(PROFILE_PATH_PREFIXES) or profile_in_progress:
+            await self.app(scope, receive, send)
+            return
+        mode = self.requested(scope)
+        if mode is None:
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope["method"], scope["path"], trace_tensorflow=(mode == "tf"))
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", profile.id.encode())]
+            await send(message)
+
+        profile_in_progress = True
+        token = request_profile.set(profile)
+        already_running, started_before = self.in_flight - 1, self.started
+        profile.start()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            profile.stop()
+            request_profile.reset(token)
+            profile_in_progress = False
+            overlapping = already_running + self.started - started_before
+            if overlapping:
+                profile.notes.append(
+                    f"{overlapping} other request(s) overlapped this profile; their event-loop time is "
+                    f"included in it (inference jobs are profiled separately and are not)"
+                )
+            try:
+                await asyncio.to_thread(profile.save)
+            except Exception as e:
+                logger.error(f"❌ Failed to save profile {profile.id}: {e}")
+
+
+PROFILING_ENABLED = PROFILE_SAMPLE_RATE > 0 or PROFILE_ON_DEMAND
+if PROFILING_ENABLED:
+    app.add_middleware(ProfilingMiddleware)
+
+
+def farms_to_array(farms: List[FarmInput]) -> np.ndarray:
+    """Stack farm inputs into an (N, 7) feature matrix in model column order"""
+    return np.array([
+        (
+            farm.amount_of_chicken,
+            farm.amount_of_feeding,
+            farm.ammonia,
+            farm.temperature,
+            farm.humidity,
+            farm.light_intensity,
+            farm.noise,
+        )
+        for farm in farms
+    ], dtype=np.float64).reshape(-1, len(FEATURE_NAMES))
+
+
+def predict_array(input_array: np.ndarray, bundle: Optional[ModelBundle] = None,
+                  chunk_size: Optional[int] = None) -> np.ndarray:
+    """Scale and predict an (N, 7) matrix with one scaler and one model call per chunk"""
+    # Read the active bundle once so a concurrent reload can't mix model and scaler versions
+    bundle = bundle or active_model
+    chunk_size = max(1, chunk_size or BATCH_CHUNK_SIZE)
+    MODEL_BATCH_ROWS.observe(len(input_array))
+    outputs = []
+    for start in range(0, len(input_array), chunk_size):
+        chunk = input_array[start:start + chunk_size]
+        started = time.perf_counter()
+        chunk_scaled = bundle.scaler.transform(chunk)
+        scaled = time.perf_counter()
+        # batch_size=len(chunk) keeps Keras from re-splitting the chunk into 32-row batches
+        chunk_output = bundle.model.predict(chunk_scaled, batch_size=len(chunk_scaled), verbose=0)
+        STAGE_SCALE.observe(scaled - started)
+        STAGE_PREDICT.observe(time.perf_counter() - scaled)
+        outputs.append(np.ravel(chunk_output))
+
+    if not outputs:
+        return np.empty(0, dtype=np.float64)
+    # Model outputs actual values (no inverse transform needed); clamp to non-negative
+    return np.maximum(np.concatenate(outputs).astype(np.float64), 0)
+
+
+UNCERTAINTY_OVERHEAD = metrics.histogram(
+    "uncertainty_overhead_seconds", "Extra inference time per request spent sampling prediction intervals", ("mode",)
+)
+UNCERTAINTY_SAMPLED_ROWS = metrics.counter(
+    "uncertainty_sampled_rows_total", "Rows scored for prediction intervals (K samples per prediction)", ("mode",)
+)
+metrics.gauge(
+    "uncertainty_samples", "Samples per prediction (K) of the served uncertainty estimator, 0 when off",
+    lambda: active_model.uncertainty.samples if active_model is not None and active_model.uncertainty else 0
+)
+
+
+def predict_with_uncertainty(input_array: np.ndarray, bundle: Optional[ModelBundle] = None,
+                             chunk_size: Optional[int] = None) -> tuple:
+    """predict_array plus a predictive interval per row from the bundle's uncertainty estimator.
+
+    Each chunk's K samples are scored as one (K * rows, 7) batch. Returns
+    ``(predictions, {"lower", "upper", "std"})``; the sampling time is the overhead
+    reported in uncertainty_overhead_seconds.
+    """
+    bundle = bundle or active_model
+    chunk_size = max(1, chunk_size or BATCH_CHUNK_SIZE)
+    predictions = predict_array(input_array, bundle, chunk_size)
+    estimator = bundle.uncertainty
+    started = time.perf_counter()
+    rng = np.random.default_rng()
+    bounds, spreads = [], []
+    for start in range(0, len(input_array), chunk_size):
+        chunk = input_array[start:start + chunk_size]
+        sampled = estimator.sample(bundle.scaler.transform(chunk), rng)
+        bounds.append(np.quantile(sampled, estimator.quantiles, axis=0))
+        spreads.append(sampled.std(axis=0))
+    UNCERTAINTY_OVERHEAD.labels(estimator.mode).observe(time.perf_counter() - started)
+    UNCERTAINTY_SAMPLED_ROWS.labels(estimator.mode).inc(len(input_array) * estimator.samples)
+
+    if not bounds:
+        empty = np.empty(0, dtype=np.float64)
+        return predictions, {"lower": empty, "upper": empty, "std": empty}
+    lower, upper = np.concatenate(bounds, axis=1)
+    return predictions, {"lower": lower, "upper": upper, "std": np.concatenate(spreads)}
+
+
+def interval_confidence(predictions: np.ndarray, uncertainty: Dict[str, np.ndarray]) -> np.ndarray:
+    """Confidence in (0, 1] from the interval width relative to the prediction: 1 / (1 + width / |y|)"""
+    width = uncertainty["upper"] - uncertainty["lower"]
+    return 1.0 / (1.0 + width / np.maximum(np.abs(predictions), 1.0))
+
+
+def encode_json(content) -> str:
+    """JSON text for WebSocket frames, via orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+    return json.dumps(content, ensure_ascii=False, allow_nan=False)
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse encoded with orjson when it is installed"""
+
+    def render(self, content) -> bytes:
+        started = time.perf_counter()
+        if orjson is not None:
+            body = orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY)
+        else:
+            body = super().render(content)
+        STAGE_SERIALIZE.observe(time.perf_counter() - started)
+        return body
+
+
+def prediction_response_dicts(farms: List[FarmInput], features: np.ndarray, predictions: np.ndarray,
+                              timestamp: str, model_version: str,
+                              uncertainty: Optional[Dict[str, np.ndarray]] = None) -> List[Dict]:
+    """Assemble PredictionResponse-shaped dicts for a batch of farms.
+
+    Recommendations, confidence and farm size are evaluated for the whole batch at once by
+    the rules engine. With ``uncertainty`` (from predict_with_uncertainty) each dict also gets
+    the prediction interval, and confidence comes from the interval width instead of the rules.
+    Endpoints return these through FastJSONResponse, which bypasses FastAPI's response_model
+    re-validation; response_model is kept for the OpenAPI schema.
+    """
+    started = time.perf_counter()
+    _, confidence, messages = rules_engine.evaluate(features, predictions)
+    categories = rules_engine.farm_size_categories[rules_engine.farm_size_codes(features)].tolist()
+    STAGE_RULES.observe(time.perf_counter() - started)
+    if uncertainty is not None:
+        confidence = np.round(interval_confidence(np.asarray(predictions, dtype=np.float64), uncertainty), 4)
+        extras = [
+            {"prediction_interval": [round(lower, 2), round(upper, 2)], "prediction_std": round(std, 2)}
+            for lower, upper, std in zip(
+                uncertainty["lower"].tolist(), uncertainty["upper"].tolist(), uncertainty["std"].tolist()
+            )
+        ]
+    else:
+        # Same keys either way, matching the PredictionResponse schema
+        extras = [{"prediction_interval": None, "prediction_std": None}] * len(farms)
+    return [
+        {
+            "predicted_egg_production": round(prediction, 2),
+            "confidence_score": score,
+            "farm_size_category": category,
+            "recommendations": list(recommendations),
+            "timestamp": timestamp,
+            "model_version": model_version,
+            "input_data": dict(farm_data),
+            **extra,
+        }
+        for farm_data, prediction, score, category, recommendations, extra in zip(
+            farms, np.asarray(predictions, dtype=np.float64).tolist(), confidence.tolist(), categories, messages, extras
+        )
+    ]
+
+
+# Inference executor
+class InferenceOverloadedError(RuntimeError):
+    """Raised when the inference queue is full and the request is shed"""
+
+
+class InferenceDeadlineError(TimeoutError):
+    """Raised when a request's deadline passes before its inference completes"""
+
+
+def request_deadline(timeout_header: Optional[float]) -> float:
+    """Absolute monotonic deadline for a request, honouring a shorter client timeout"""
+    timeout = INFERENCE_TIMEOUT_S
+    if timeout_header is not None and timeout_header > 0:
+        timeout = min(timeout, timeout_header)
+    return time.monotonic() + timeout
+
+
+class InferenceExecutor:
+    """Run blocking inference on a dedicated thread pool with a bounded admission queue.
+
+    At most ``queue_size`` jobs may be queued or running. Jobs whose deadline has
+    already passed when a worker picks them up are dropped without running, and
+    callers stop waiting once their deadline expires. A job keeps its slot until it
+    actually finishes, so abandoned jobs that are still running count against the queue.
+    """
+
+    def __init__(self, max_workers: int, queue_size: int):
+        self.max_workers = max_workers
+        self.queue_size = queue_size
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="inference")
+        # Jobs queued or running; released by the future's done callback on a worker thread
+        self.pending = 0
+        self.pending_lock = threading.Lock()
+        self.shed = 0
+        self.expired = 0
+
+    async def run(self, fn, *args, deadline: float):
+        if self.pending >= self.queue_size:
+            self.shed += 1
+            raise InferenceOverloadedError(f"Inference queue full ({self.pending}/{self.queue_size} jobs)")
+
+        if PROFILING_ENABLED:
+            profile = request_profile.get()
+            if profile is not None:
+                fn = profile.wrap(fn)
+
+        def job():
+            if time.monotonic() >= deadline:
+                raise InferenceDeadlineError("Request deadline passed before inference started")
+            return fn(*args)
+
+        with self.pending_lock:
+            self.pending += 1
+        try:
+            future = self.pool.submit(job)
+        except RuntimeError:
+            self.release()
+            raise
+        future.add_done_callback(self.release)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout=max(0.0, deadline - time.monotonic()))
+        except (asyncio.TimeoutError, InferenceDeadlineError):
+            # Drop the job if it has not started yet; a running job finishes but is ignored
+            future.cancel()
+            self.expired += 1
+            raise InferenceDeadlineError("Request deadline exceeded during inference")
+
+    def release(self, future=None):
+        with self.pending_lock:
+            self.pending -= 1
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict:
+        return {
+            "workers": self.max_workers,
+            "queue_size": self.queue_size,
+            "pending": self.pending,
+            "shed": self.shed,
+            "expired": self.expired,
+        }
+
+
+inference_executor = InferenceExecutor(INFERENCE_WORKERS, INFERENCE_QUEUE_SIZE)
+
+
+# Prediction cache
+def parse_cache_resolution(spec: str) -> np.ndarray:
+    """Per-feature quantization steps from a "name=step,..." spec over the defaults"""
+    resolution = dict(DEFAULT_CACHE_RESOLUTION)
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        name, _, value = part.partition("=")
+        name = name.strip()
+        if name not in resolution:
+            raise ValueError(f"Unknown feature '{name}' in PREDICTION_CACHE_RESOLUTION")
+        if float(value) <= 0:
+            raise ValueError(f"Cache resolution for '{name}' must be positive")
+        resolution[name] = float(value)
+    return np.array([resolution[name] for name in FEATURE_NAMES], dtype=np.float64)
+
+
+class PredictionCache:
+    """Fixed-capacity LRU cache with per-entry TTL, keyed on quantized feature rows"""
+
+    def __init__(self, max_size: int, ttl_s: float, resolution: np.ndarray):
+        self.max_size = max_size
+        self.ttl_s = ttl_s
+        self.resolution = resolution
+        self.entries: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.flushes = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def key_for(self, row: np.ndarray, namespace: str) -> tuple:
+        return (namespace,) + tuple(np.rint(row / self.resolution).astype(np.int64).tolist())
+
+    def get(self, key: tuple):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        value, expires_at = entry
+        if time.monotonic() >= expires_at:
+            del self.entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: tuple, value):
+        self.entries[key] = (value, time.monotonic() + self.ttl_s)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        if self.entries:
+            self.flushes += 1
+        self.entries.clear()
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "ttl_s": self.ttl_s,
+            "resolution": dict(zip(FEATURE_NAMES, self.resolution.tolist())),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "flushes": self.flushes,
+        }
+
+
+prediction_cache = PredictionCache(
+    PREDICTION_CACHE_SIZE,
+    PREDICTION_CACHE_TTL_S,
+    parse_cache_resolution(os.environ.get("PREDICTION_CACHE_RESOLUTION", "")),
+)
+
+
+# Micro-batching
+class RollingStats:
+    """Summary statistics over the most recent samples of a measurement"""
+
+    def __init__(self, window: int = 2048):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value: float):
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def summary(self) -> Dict:
+        recent = np.array(self.samples, dtype=np.float64)
+        if recent.size:
+            p50, p95, p99 = (round(float(v), 3) for v in np.percentile(recent, [50, 95, 99]))
+        else:
+            p50 = p95 = p99 = 0.0
+        return {
+            "count": self.count,
+            "mean": round(self.total / self.count, 3) if self.count else 0.0,
+            "max": round(self.max, 3),
+            "p50": p50,
+            "p95": p95,
+            "p99": p99,
+        }
+
+
+class MicroBatcher:
+    """Coalesce concurrent single-row predictions into batched model calls.
+
+    Callers ``await submit(row)`` and get their own prediction back. A background
+    task drains the queue into batches of at most ``max_batch_size`` rows. The wait
+    window is adaptive: when the previous batch held a single row (light traffic) the
+    batch is dispatched as soon as the queue is drained, otherwise the task waits up
+    to ``max_wait_ms`` for more rows to arrive. Batches run on the inference executor,
+    so collection continues while earlier batches are being inferred.
+    """
+
+    def __init__(self, max_batch_size: int, max_wait_ms: float, max_queue_rows: int = 0):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_queue_rows = max_queue_rows
+        self.queue: Optional[asyncio.Queue] = None
+        self.task: Optional[asyncio.Task] = None
+        self.inflight = set()
+        self.last_batch_size = 1
+        self.batch_sizes = RollingStats()
+        self.queue_wait_ms = RollingStats()
+        self.batch_size_counts: Dict[int, int] = {}
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    def start(self):
+        if self.running:
+            return
+        self.queue = asyncio.Queue(maxsize=self.max_queue_rows)
+        self.task = asyncio.create_task(self._run())
+        logger.info(f"✅ Micro-batcher started (max_batch_size={self.max_batch_size}, max_wait_ms={self.max_wait * 1000:g})")
+
+    async def stop(self):
+        if self.task is None:
+            return
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+        # Fail anything still queued so callers don't hang on shutdown
+        for task in list(self.inflight):
+            task.cancel()
+        while self.queue is not None and not self.queue.empty():
+            _, future, _, _ = self.queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("Micro-batcher stopped"))
+
+    async def submit(self, row: np.ndarray, deadline: float) -> tuple:
+        """Queue one feature row and wait for its ``(prediction, model_version)``"""
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((row, future, time.perf_counter(), deadline))
+        except asyncio.QueueFull:
+            inference_executor.shed += 1
+            raise InferenceOverloadedError(f"Micro-batch queue full ({self.queue.qsize()} rows)")
+        try:
+            return await asyncio.wait_for(future, timeout=max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            raise InferenceDeadlineError("Request deadline exceeded while waiting for micro-batch")
+
+    async def _collect(self) -> list:
+        items = [await self.queue.get()]
+        while len(items) < self.max_batch_size and not self.queue.empty():
+            items.append(self.queue.get_nowait())
+
+        if self.last_batch_size > 1 and len(items) < self.max_batch_size and self.max_wait > 0:
+            deadline = time.perf_counter() + self.max_wait
+            while len(items) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    items.append(await asyncio.wait_for(self.queue.get(), timeout=remaining))
+                except asyncio.TimeoutError:
+                    break
+        return items
+
+    async def _run(self):
+        while True:
+            items = await self._collect()
+            dispatched_at = time.perf_counter()
+            self.last_batch_size = len(items)
+            self.batch_sizes.add(len(items))
+            self.batch_size_counts[len(items)] = self.batch_size_counts.get(len(items), 0) + 1
+            for _, _, enqueued_at, _ in items:
+                self.queue_wait_ms.add((dispatched_at - enqueued_at) * 1000.0)
+
+            task = asyncio.create_task(self._dispatch(items))
+            self.inflight.add(task)
+            task.add_done_callback(self.inflight.discard)
+
+    async def _dispatch(self, items: list):
+        # Drop rows whose caller has already given up
+        now = time.monotonic()
+        live = [item for item in items if not item[1].done() and item[3] > now]
+        if not live:
+            return
+
+        bundle = active_model
+        try:
+            batch_output = await inference_executor.run(
+                predict_array,
+                np.vstack([row for row, _, _, _ in live]),
+                bundle,
+                deadline=max(item[3] for item in live),
+            )
+        except Exception as e:
+            for _, future, _, _ in live:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future, _, _), prediction in zip(live, batch_output.tolist()):
+            if not future.done():
+                future.set_result((prediction, bundle.version))
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.running,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "queue_depth": self.queue.qsize() if self.queue is not None else 0,
+            "batch_size": self.batch_sizes.summary(),
+            "batch_size_counts": dict(sorted(self.batch_size_counts.items())),
+            "queue_wait_ms": self.queue_wait_ms.summary(),
+        }
+
+
+batcher = MicroBatcher(MICRO_BATCH_MAX_SIZE, MICRO_BATCH_MAX_WAIT_MS, MICRO_BATCH_MAX_SIZE * INFERENCE_QUEUE_SIZE)
+
+
+# Binary batch scoring
+BINARY_RAW_TYPES = ("application/octet-stream",)
+BINARY_NPY_TYPES = ("application/x-npy", "application/npy")
+BINARY_ARROW_TYPES = ("application/vnd.apache.arrow.stream",)
+# Bytes allowed beyond the row data itself (.npy header, Arrow schema and batch metadata)
+BINARY_HEADER_ALLOWANCE = 1 << 20
+
+
+def max_binary_body_bytes(content_type: str) -> int:
+    """Largest body that can hold MAX_BINARY_BATCH_SIZE rows in the given format"""
+    if content_type in BINARY_RAW_TYPES:
+        return MAX_BINARY_BATCH_SIZE * len(FEATURE_NAMES) * 4
+    # .npy and Arrow may carry float64 values
+    return MAX_BINARY_BATCH_SIZE * len(FEATURE_NAMES) * 8 + BINARY_HEADER_ALLOWANCE
+
+
+async def read_body_capped(request: Request, limit: int) -> bytes:
+    """Read the request body, rejecting it with 413 as soon as it exceeds ``limit`` bytes"""
+    too_large = HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"Request body exceeds {limit} bytes (limit {MAX_BINARY_BATCH_SIZE} rows)"
+    )
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > limit:
+        raise too_large
+    chunks, size = [], 0
+    async for piece in request.stream():
+        size += len(piece)
+        if size > limit:
+            raise too_large
+        chunks.append(piece)
+    return b"".join(chunks)
+
+
+def decode_npy(body: bytes) -> np.ndarray:
+    """Wrap a .npy payload without copying the data section"""
+    stream = io.BytesIO(body)
+    version = np.lib.format.read_magic(stream)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(stream)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(stream)
+    if dtype.hasobject:
+        raise ValueError("Object arrays are not accepted")
+    count = int(np.prod(shape)) if shape else 1
+    array = np.frombuffer(body, dtype=dtype, count=count, offset=stream.tell())
+    return array.reshape(shape, order="F" if fortran_order else "C")
+
+
+def decode_arrow(body: bytes) -> np.ndarray:
+    """Read an Arrow IPC stream with one column per feature into an (N, 7) matrix"""
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="Arrow input requires pyarrow. Please install: pip install pyarrow"
+        )
+    table = pa.ipc.open_stream(pa.py_buffer(body)).read_all()
+    missing = [name for name in FEATURE_NAMES if name not in table.column_names]
+    if missing:
+        raise ValueError(f"Arrow table is missing columns: {', '.join(missing)}")
+    columns = []
+    for name in FEATURE_NAMES:
+        column = table.column(name)
+        if column.null_count:
+            raise ValueError(f"Column '{name}' contains nulls")
+        if not (pa.types.is_floating(column.type) or pa.types.is_integer(column.type)):
+            raise ValueError(f"Column '{name}' must be numeric, got {column.type}")
+        # Null-free single-chunk columns are views of the IPC buffer; chunked ones are joined once
+        array = column.chunk(0) if column.num_chunks == 1 else column.combine_chunks()
+        columns.append(array.to_numpy(zero_copy_only=True))
+    # One copy into row-major order at the columns' own precision (float64 stays float64);
+    # the model casts once at its boundary, as for .npy input
+    matrix = np.empty((table.num_rows, len(FEATURE_NAMES)), dtype=np.result_type(np.float32, *columns))
+    for j, values in enumerate(columns):
+        matrix[:, j] = values
+    return matrix
+
+
+def encode_arrow(predictions: np.ndarray) -> bytes:
+    import pyarrow as pa
+    batch = pa.record_batch([pa.array(predictions)], names=["predicted_egg_production"])
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, batch.schema) as writer:
+        writer.write_batch(batch)
+    return sink.getvalue().to_pybytes()
+
+
+def decode_binary_batch(content_type: str, body: bytes) -> tuple:
+    """Decode a binary batch into an (N, 7) matrix; returns ``(matrix, format)``"""
+    if content_type in BINARY_RAW_TYPES:
+        width = len(FEATURE_NAMES) * 4
+        if len(body) % width:
+            raise ValueError(f"Raw float32 body must be a multiple of {width} bytes (7 little-endian float32 per row)")
+        return np.frombuffer(body, dtype="<f4").reshape(-1, len(FEATURE_NAMES)), "raw"
+    if content_type in BINARY_NPY_TYPES:
+        matrix = decode_npy(body)
+        if matrix.ndim != 2 or matrix.shape[1] != len(FEATURE_NAMES):
+            raise ValueError(f"Expected an (N, {len(FEATURE_NAMES)}) array, got shape {matrix.shape}")
+        if matrix.dtype.kind != "f":
+            raise ValueError(f"Expected a float array, got {matrix.dtype}")
+        return matrix, "npy"
+    if content_type in BINARY_ARROW_TYPES:
+        return decode_arrow(body), "arrow"
+    raise HTTPException(
+        status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+        detail=f"Unsupported content type '{content_type}'. Use application/octet-stream, application/x-npy or application/vnd.apache.arrow.stream."
+    )
+
+
+def range_error_response(matrix: np.ndarray) -> Optional[JSONResponse]:
+    """422 listing (up to 20) rows outside the FarmInput ranges, or None if all rows are valid"""
+    out_of_range = out_of_range_mask(matrix)
+    bad_rows = np.flatnonzero(out_of_range.any(axis=1))
+    if not bad_rows.size:
+        return None
+    return JSONResponse(
+        status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        content={
+            "detail": f"{bad_rows.size} rows have values outside the FarmInput ranges",
+            "errors": [
+                {"row": int(i), "fields": [FEATURE_NAMES[j] for j in np.flatnonzero(out_of_range[i])]}
+                for i in bad_rows[:20]
+            ],
+        }
+    )
+
+
+def encode_binary_predictions(predictions: np.ndarray, binary_format: str) -> tuple:
+    """Encode predictions in the request's binary format; returns ``(body, media_type)``"""
+    predictions = predictions.astype(np.float32)
+    if binary_format == "raw":
+        return predictions.astype("<f4").tobytes(), BINARY_RAW_TYPES[0]
+    if binary_format == "npy":
+        out = io.BytesIO()
+        np.save(out, predictions, allow_pickle=False)
+        return out.getvalue(), BINARY_NPY_TYPES[0]
+    return encode_arrow(predictions), BINARY_ARROW_TYPES[0]
+
+
+# Streaming bulk scoring
+STREAM_INPUT_TYPES = {
+    "text/csv": "csv",
+    "application/csv": "csv",
+    "application/x-ndjson": "ndjson",
+    "application/ndjson": "ndjson",
+    "application/jsonl": "ndjson",
+    "application/x-jsonlines": "ndjson",
+}
+STREAM_OUTPUT_MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+STREAM_CSV_COLUMNS = ["row", "id", "predicted_egg_production", "farm_size_category", "error"]
+
+
+class BodyStreamingResponse(StreamingResponse):
+    """StreamingResponse whose generator reads the request body while responding.
+
+    Starlette's StreamingResponse watches ``receive`` for a disconnect in parallel, which
+    would swallow the request body messages. Here the generator owns ``receive`` and a
+    disconnect surfaces as ClientDisconnect from ``request.stream()``.
+    """
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+async def iter_body_lines(request: Request, max_line_bytes: Optional[int] = None) -> AsyncIterator[Optional[bytes]]:
+    """Yield raw lines from the request body as it arrives.
+
+    Decoding is left to the caller so a bad line fails only its own row. A line longer
+    than ``max_line_bytes`` (default STREAM_MAX_LINE_BYTES) is yielded once as None and
+    the rest of it is discarded up to the next newline, so memory stays bounded.
+    """
+    max_line_bytes = max_line_bytes or STREAM_MAX_LINE_BYTES
+    buffer = b""
+    skipping = False
+    async for piece in request.stream():
+        buffer += piece
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if skipping:
+                # Tail of an overlong line already reported
+                skipping = False
+                continue
+            yield None if len(line) > max_line_bytes else line.rstrip(b"\r")
+        if len(buffer) > max_line_bytes:
+            if not skipping:
+                yield None
+                skipping = True
+            buffer = b""
+    if buffer and not skipping:
+        yield None if len(buffer) > max_line_bytes else buffer.rstrip(b"\r")
+
+
+class StreamHeaderError(ValueError):
+    """Raised when a CSV header lacks required feature columns"""
+
+
+class StreamRowParser:
+    """Parse CSV (header row required, quoted newlines unsupported) or NDJSON lines.
+
+    Column names are matched case-insensitively, so the training CSV headers work as-is.
+    An optional ``id`` column/key is passed through to the output.
+    """
+
+    def __init__(self, input_format: str):
+        self.input_format = input_format
+        self.columns = None
+        self.id_index = None
+
+    @property
+    def awaiting_header(self) -> bool:
+        return self.input_format == "csv" and self.columns is None
+
+    def parse(self, line: str) -> tuple:
+        """Return ``(values, row_id)`` for a data line, or ``(None, None)`` for the CSV header"""
+        if self.input_format == "ndjson":
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError("Each NDJSON line must be a JSON object")
+            missing = [name for name in FEATURE_NAMES if name not in record]
+            if missing:
+                raise ValueError(f"Missing fields: {', '.join(missing)}")
+            return [float(record[name]) for name in FEATURE_NAMES], record.get("id")
+
+        fields = next(csv.reader([line]))
+        if self.columns is None:
+            header = [name.strip().lower() for name in fields]
+            missing = [name for name in FEATURE_NAMES if name not in header]
+            if missing:
+                raise StreamHeaderError(f"CSV header is missing columns: {', '.join(missing)}")
+            self.columns = [header.index(name) for name in FEATURE_NAMES]
+            self.id_index = header.index("id") if "id" in header else None
+            return None, None
+        values = [float(fields[index]) for index in self.columns]
+        return values, fields[self.id_index] if self.id_index is not None else None
+
+
+def format_stream_record(record: Dict, output_format: str) -> str:
+    if output_format == "ndjson":
+        return json.dumps(record) + "\n"
+    out = io.StringIO()
+    csv.writer(out, lineterminator="\n").writerow([record.get(column, "") for column in STREAM_CSV_COLUMNS])
+    return out.getvalue()
+
+
+async def score_stream_chunk(rows: list, bundle: ModelBundle, farm_id: Optional[str] = None) -> List[Dict]:
+    """Validate a chunk of parsed rows with vectorized bounds checks and score the valid ones"""
+    started = time.perf_counter()
+    # rows: list of (row_number, row_id, values, parse_error); values is None for unparseable rows
+    parsed = np.array([values is not None for _, _, values, _ in rows], dtype=bool)
+    values = np.array(
+        [values if values is not None else [np.nan] * len(FEATURE_NAMES) for _, _, values, _ in rows],
+        dtype=np.float64
+    ).reshape(-1, len(FEATURE_NAMES))
+    out_of_range = out_of_range_mask(values)
+    valid = parsed & ~out_of_range.any(axis=1)
+
+    predictions = np.empty(0)
+    inference_error = None
+    if valid.any():
+        while True:
+            try:
+                predictions = await inference_executor.run(
+                    predict_array, values[valid], bundle, deadline=request_deadline(None)
+                )
+                break
+            except InferenceOverloadedError:
+                # Back off instead of failing a stream that is already under way
+                await asyncio.sleep(RETRY_AFTER_S)
+            except Exception as e:
+                # Deadline or model failure: this chunk's rows get the error, the stream goes on
+                record_error(e)
+                logger.error(f"Stream chunk inference failed: {e}")
+                inference_error = str(e) or type(e).__name__
+                break
+    if inference_error is None and valid.any():
+        categories = farm_size_categories(values[valid, 0])
+        prediction_history.record(
+            "/batch_predict/stream", farm_id, values[valid], predictions, bundle.version, time.perf_counter() - started
+        )
+
+    records = []
+    valid_index = 0
+    for i, (row_number, row_id, _, parse_error) in enumerate(rows):
+        record = {"row": row_number}
+        if row_id is not None:
+            record["id"] = row_id
+        if valid[i] and inference_error is not None:
+            record["error"] = f"Inference failed: {inference_error}"
+        elif valid[i]:
+            record["predicted_egg_production"] = round(float(predictions[valid_index]), 2)
+            record["farm_size_category"] = str(categories[valid_index])
+            valid_index += 1
+        elif parse_error is not None:
+            record["error"] = f"Unparseable row: {parse_error}"
+        else:
+            bad_fields = [FEATURE_NAMES[j] for j in np.flatnonzero(out_of_range[i])]
+            record["error"] = f"Out of range: {', '.join(bad_fields)}"
+        records.append(record)
+    return records
+
+
+async def stream_scores(request: Request, input_format: str, output_format: str, bundle: ModelBundle,
+                        farm_id: Optional[str] = None) -> AsyncIterator[str]:
+    """Parse, score and emit results chunk by chunk so memory stays bounded"""
+    if output_format == "csv":
+        yield ",".join(STREAM_CSV_COLUMNS) + "\n"
+
+    parser = StreamRowParser(input_format)
+    pending = []
+    row_number = 0
+    try:
+        async for line in iter_body_lines(request):
+            if line is not None and not line.strip():
+                continue
+            parse_error = None
+            try:
+                if line is None:
+                    raise ValueError(f"line longer than {STREAM_MAX_LINE_BYTES} bytes")
+                # UnicodeDecodeError is a ValueError: a non-UTF-8 line fails only its row
+                values, row_id = parser.parse(line.decode("utf-8"))
+                if values is None:
+                    continue
+            except StreamHeaderError as e:
+                # Unusable CSV header: nothing after it can be scored
+                yield format_stream_record({"row": 0, "error": str(e)}, output_format)
+                return
+            except (ValueError, TypeError, IndexError) as e:
+                if parser.awaiting_header:
+                    yield format_stream_record({"row": 0, "error": f"Unreadable CSV header: {e}"}, output_format)
+                    return
+                # Reported inline, in row order, with the rest of its chunk
+                values, row_id, parse_error = None, None, e
+
+            row_number += 1
+            pending.append((row_number, row_id, values, parse_error))
+            if len(pending) >= STREAM_CHUNK_SIZE:
+                for record in await score_stream_chunk(pending, bundle, farm_id):
+                    yield format_stream_record(record, output_format)
+                pending = []
+    except ClientDisconnect:
+        logger.info(f"Client disconnected from stream after {row_number} rows")
+        return
+
+    if pending:
+        for record in await score_stream_chunk(pending, bundle, farm_id):
+            yield format_stream_record(record, output_format)
+
+
+# WebSocket ingestion for sensor gateways
+websocket_connections = 0
+WEBSOCKET_FRAMES = metrics.counter("websocket_frames_total", "WebSocket frames by direction", ("direction",))
+WEBSOCKET_FRAMES_IN = WEBSOCKET_FRAMES.labels("in")
+WEBSOCKET_FRAMES_OUT = WEBSOCKET_FRAMES.labels("out")
+metrics.gauge("websocket_connections", "Open /ws/predict connections", lambda: websocket_connections)
+
+
+async def score_gateway_reading(reading, farm_id: Optional[str] = None) -> Dict:
+    """Validate and score one gateway reading; always returns a response frame tagged with its id"""
+    started = time.perf_counter()
+    if not isinstance(reading, dict):
+        return {"id": None, "error": "Each reading must be a JSON object"}
+    reading_id = reading.get("id")
+    try:
+        farm_data = FarmInput.model_validate(reading)
+    except ValidationError as e:
+        return {"id": reading_id, "error": "Invalid reading", "details": json.loads(e.json(include_url=False))}
+
+    input_array = farms_to_array([farm_data])
+    deadline = request_deadline(None)
+    while True:
+        try:
+            ensure_model_ready()
+            if batcher.running:
+                prediction, model_version = await batcher.submit(input_array[0], deadline)
+            else:
+                bundle = active_model
+                prediction = (await inference_executor.run(predict_array, input_array, bundle, deadline=deadline))[0]
+                model_version = bundle.version
+            break
+        except InferenceOverloadedError:
+            # Wait for capacity rather than failing readings the gateway has already sent
+            if time.monotonic() + RETRY_AFTER_S >= deadline:
+                return {"id": reading_id, "error": "Server busy, reading dropped"}
+            await asyncio.sleep(RETRY_AFTER_S)
+        except InferenceDeadlineError as e:
+            return {"id": reading_id, "error": str(e)}
+        except HTTPException as e:
+            return {"id": reading_id, "error": e.detail}
+
+    prediction_history.record(
+        "/ws/predict", farm_id, input_array, np.array([prediction]), model_version, time.perf_counter() - started
+    )
+    response = prediction_response_dicts(
+        [farm_data], input_array, np.array([prediction]), datetime.now().isoformat(), model_version
+    )[0]
+    del response["input_data"]
+    return {"id": reading_id, **response}
+
+
+def decode_gateway_frame(message: str) -> list:
+    """A frame holds one reading object or a list of readings"""
+    payload = json.loads(message)
+    return payload if isinstance(payload, list) else [payload]
+
+
+# Per-farm rolling-window feature store
+class FarmWindow:
+    """Fixed-size ring buffer of one farm's readings with O(1) rolling aggregates.
+
+    The running sum gives the mean (re-summed once per wrap to cancel float drift), the
+    EWMA is updated in place, and min/max come from one monotonic deque per feature whose
+    front is always the extreme of the current window.
+    """
+
+    def __init__(self, size: int, alpha: float):
+        n = len(FEATURE_NAMES)
+        self.size = size
+        self.alpha = alpha
+        self.values = np.zeros((size, n), dtype=np.float64)
+        self.timestamps = np.zeros(size, dtype=np.float64)
+        self.count = 0
+        self.seq = 0
+        self.sums = np.zeros(n, dtype=np.float64)
+        self.ewma = np.zeros(n, dtype=np.float64)
+        self.mins = [deque() for _ in range(n)]
+        self.maxs = [deque() for _ in range(n)]
+        self.last_seen = time.monotonic()
+
+    def add(self, row: np.ndarray, timestamp: float):
+        slot = self.seq % self.size
+        if self.count == self.size:
+            self.sums -= self.values[slot]
+        else:
+            self.count += 1
+        self.values[slot] = row
+        self.timestamps[slot] = timestamp
+        self.sums += row
+        self.ewma = row.copy() if self.seq == 0 else self.ewma + self.alpha * (row - self.ewma)
+
+        # Deque entries are (seq, value); the one reading that left the window has seq == expired
+        expired = self.seq - self.size
+        for lows, highs, value in zip(self.mins, self.maxs, row.tolist()):
+            while lows and lows[-1][1] >= value:
+                lows.pop()
+            lows.append((self.seq, value))
+            if lows[0][0] <= expired:
+                lows.popleft()
+            while highs and highs[-1][1] <= value:
+                highs.pop()
+            highs.append((self.seq, value))
+            if highs[0][0] <= expired:
+                highs.popleft()
+
+        self.seq += 1
+        if slot == self.size - 1:
+            self.sums = self.values[:self.count].sum(axis=0)
+        self.last_seen = time.monotonic()
+
+    def latest(self) -> np.ndarray:
+        return self.values[(self.seq - 1) % self.size]
+
+    def mean(self) -> np.ndarray:
+        return self.sums / self.count
+
+    def minimum(self) -> np.ndarray:
+        return np.array([lows[0][1] for lows in self.mins])
+
+    def maximum(self) -> np.ndarray:
+        return np.array([highs[0][1] for highs in self.maxs])
+
+    def history(self) -> tuple:
+        """(timestamps, values) of the window in arrival order"""
+        if self.count < self.size:
+            return self.timestamps[:self.count], self.values[:self.count]
+        start = self.seq % self.size
+        order = np.r_[start:self.size, 0:start]
+        return self.timestamps[order], self.values[order]
+
+    def basis(self, name: str) -> np.ndarray:
+        """Feature row to predict from: the latest reading, the window mean or the EWMA"""
+        return {"latest": self.latest, "mean": self.mean, "ewma": lambda: self.ewma}[name]()
+
+    def nbytes(self) -> int:
+        # Deques hold at most `size` (seq, value) tuples per feature, ~100 bytes each when full
+        return self.values.nbytes + self.timestamps.nbytes + 2 * len(FEATURE_NAMES) * self.size * 100
+
+
+class FeatureStore:
+    """Per-farm FarmWindows in least-recently-updated order, with idle and capacity eviction"""
+
+    def __init__(self, window: int, max_farms: int, idle_s: float, alpha: float):
+        self.window = window
+        self.max_farms = max_farms
+        self.idle_s = idle_s
+        self.alpha = alpha
+        self.farms: "OrderedDict[str, FarmWindow]" = OrderedDict()
+        self.evictions = 0
+
+    def evict_idle(self):
+        if self.idle_s <= 0:
+            return
+        cutoff = time.monotonic() - self.idle_s
+        while self.farms and next(iter(self.farms.values())).last_seen < cutoff:
+            self.farms.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, farm_id: str) -> Optional[FarmWindow]:
+        self.evict_idle()
+        return self.farms.get(farm_id)
+
+    def ingest(self, farm_id: str, reading: FarmReading) -> tuple:
+        """Merge a (possibly partial) reading over the farm's latest values, validate and store it.
+
+        Returns ``(window, farm_data)``; raises ValidationError when the merged reading is
+        not a valid FarmInput (e.g. a new farm's first reading is incomplete).
+        """
+        self.evict_idle()
+        window = self.farms.get(farm_id)
+        values = dict(zip(FEATURE_NAMES, window.latest().tolist())) if window is not None else {}
+        values.update(reading.model_dump(exclude_none=True, exclude={"timestamp"}))
+        farm_data = FarmInput.model_validate(values)
+
+        if window is None:
+            if len(self.farms) >= self.max_farms:
+                self.farms.popitem(last=False)
+                self.evictions += 1
+            window = FarmWindow(self.window, self.alpha)
+            self.farms[farm_id] = window
+        else:
+            self.farms.move_to_end(farm_id)
+        window.add(farms_to_array([farm_data])[0], reading.timestamp if reading.timestamp is not None else time.time())
+        return window, farm_data
+
+    def remove(self, farm_id: str) -> bool:
+        return self.farms.pop(farm_id, None) is not None
+
+    def stats(self) -> Dict:
+        self.evict_idle()
+        return {
+            "farms": len(self.farms),
+            "max_farms": self.max_farms,
+            "window": self.window,
+            "ewma_alpha": self.alpha,
+            "idle_eviction_s": self.idle_s,
+            "evictions": self.evictions,
+            "approx_bytes": sum(window.nbytes() for window in self.farms.values()),
+        }
+
+
+feature_store = FeatureStore(FEATURE_STORE_WINDOW, FEATURE_STORE_MAX_FARMS, FEATURE_STORE_IDLE_S, FEATURE_STORE_EWMA_ALPHA)
+feature_store_worker_warning_logged = False
+
+
+def warn_feature_store_workers():
+    """Log once per worker that /farms is being served by a multi-worker deployment"""
+    global feature_store_worker_warning_logged
+    if SERVING_WORKERS > 1 and not feature_store_worker_warning_logged:
+        feature_store_worker_warning_logged = True
+        logger.warning(
+            f"⚠️  /farms served by {SERVING_WORKERS} workers: each keeps its own feature store, so readings "
+            f"sent to one worker are not visible to the others. Run with WEB_CONCURRENCY=1 for /farms."
+        )
+metrics.gauge("feature_store_farms", "Farms held in the rolling-window feature store", lambda: len(feature_store.farms))
+
+
+def features_dict(row: np.ndarray) -> Dict[str, float]:
+    return {name: round(value, 4) for name, value in zip(FEATURE_NAMES, row.tolist())}
+
+
+async def predict_farm_window(farm_id: str, window: FarmWindow, basis: str, deadline: float) -> Dict:
+    """Score one farm's window (latest reading, mean or EWMA) through the micro-batcher"""
+    started = time.perf_counter()
+    row = window.basis(basis).reshape(1, -1)
+    uncertainty = None
+    if active_model.uncertainty is not None:
+        bundle = active_model
+        predictions, uncertainty = await inference_executor.run(predict_with_uncertainty, row, bundle, deadline=deadline)
+        prediction, model_version = predictions[0], bundle.version
+    elif batcher.running:
+        prediction, model_version = await batcher.submit(row[0], deadline)
+    else:
+        bundle = active_model
+        prediction = (await inference_executor.run(predict_array, row, bundle, deadline=deadline))[0]
+        model_version = bundle.version
+    prediction_history.record(
+        "/farms/{farm_id}/predict", farm_id, row, np.array([prediction]), model_version, time.perf_counter() - started
+    )
+    farm_data = FarmInput.model_construct(**dict(zip(FEATURE_NAMES, row[0].tolist())))
+    return prediction_response_dicts(
+        [farm_data], row, np.array([prediction]), datetime.now().isoformat(), model_version, uncertainty
+    )[0]
+
+
+# What-if setpoint optimization
+optimization_cache = PredictionCache(OPTIMIZE_CACHE_SIZE, OPTIMIZE_CACHE_TTL_S, prediction_cache.resolution)
+
+
+# With one or two controls refinement rounds add more than a finer initial grid would
+OPTIMIZE_MAX_GRID_POINTS = 101
+
+
+def grid_points_per_control(n_controls: int) -> int:
+    """Largest per-axis resolution whose full grid fits in OPTIMIZE_MAX_CANDIDATES (3 to 101)"""
+    points = int(OPTIMIZE_MAX_CANDIDATES ** (1.0 / n_controls) + 1e-9)
+    return min(OPTIMIZE_MAX_GRID_POINTS, max(3, points))
+
+
+def optimize_setpoints(base_row: np.ndarray, controls: List[str], bounds: Dict[str, tuple],
+                       refine_rounds: int, top_k: int, bundle: ModelBundle) -> Dict:
+    """Grid search over the control features, zooming in around the best point each round.
+
+    Every round builds the full grid of candidate rows (non-control features fixed at the
+    farm's current values) and scores it with a single scaler+model call. The next round
+    searches one grid step either side of the best point, so resolution improves by
+    (points - 1) / 2 per round. Runs on the inference executor.
+    """
+    lower, upper = feature_bounds()
+    columns = np.array([FEATURE_NAMES.index(name) for name in controls])
+    search_low = np.array([bounds.get(name, (lower[i], upper[i]))[0] for name, i in zip(controls, columns)])
+    search_high = np.array([bounds.get(name, (lower[i], upper[i]))[1] for name, i in zip(controls, columns)])
+    points = grid_points_per_control(len(controls))
+
+    low, high = search_low.copy(), search_high.copy()
+    initial_step = (search_high - search_low) / (points - 1)
+    candidates, scores = [], []
+    baseline = None
+    for round_index in range(refine_rounds + 1):
+        axes = [np.linspace(lo, hi, points) for lo, hi in zip(low, high)]
+        grid = np.stack(np.meshgrid(*axes, indexing="ij"), axis=-1).reshape(-1, len(controls))
+        # The first round also carries the unchanged row, so the baseline costs no extra call
+        matrix = np.repeat(base_row.reshape(1, -1), len(grid) + (baseline is None), axis=0)
+        matrix[:len(grid), columns] = grid
+        predictions = predict_array(matrix, bundle, chunk_size=len(matrix))
+        if baseline is None:
+            baseline = float(predictions[-1])
+            predictions = predictions[:-1]
+        candidates.append(grid)
+        scores.append(predictions)
+
+        best = grid[int(np.argmax(predictions))]
+        step = (high - low) / (points - 1)
+        low = np.maximum(best - step, search_low)
+        high = np.minimum(best + step, search_high)
+
+    candidates = np.concatenate(candidates)
+    scores = np.concatenate(scores)
+    # Return distinct alternatives: after each pick, drop candidates within one initial
+    # grid step of it, so refined neighbours of the best point don't fill the list
+    units = candidates / initial_step
+    remaining = np.ones(len(candidates), dtype=bool)
+    best = []
+    while len(best) < top_k and remaining.any():
+        index = int(np.argmax(np.where(remaining, scores, -np.inf)))
+        remaining &= np.abs(units - units[index]).max(axis=1) >= 1.0 - 1e-9
+        values = np.round(candidates[index], 4)
+        gain = float(scores[index]) - baseline
+        best.append({
+            "setpoints": dict(zip(controls, values.tolist())),
+            "changes": dict(zip(controls, np.round(values - base_row[columns], 4).tolist())),
+            "predicted_egg_production": round(float(scores[index]), 2),
+            "gain": round(gain, 2),
+            "gain_pct": round(100.0 * gain / baseline, 2) if baseline > 0 else None,
+        })
+
+    return {
+        "baseline_prediction": round(baseline, 2),
+        "improved": bool(best) and best[0]["gain"] > 0,
+        "best": best,
+        "controls": list(controls),
+        "search": {
+            "grid_points_per_control": points,
+            "rounds": refine_rounds + 1,
+            "candidates_evaluated": int(len(candidates)),
+            "bounds": {name: [round(float(lo), 4), round(float(hi), 4)]
+                       for name, lo, hi in zip(controls, search_low, search_high)},
+        },
+    }
+
 
+# Prediction history (write-behind SQLite log)
+HISTORY_COLUMNS = ["ts", "farm_id", "endpoint", "model_version", "latency_ms"] + FEATURE_NAMES + ["prediction"]
+HISTORY_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS predictions (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    farm_id TEXT,
+    endpoint TEXT NOT NULL,
+    model_version TEXT,
+    latency_ms REAL,
+    {", ".join(f"{name} REAL NOT NULL" for name in FEATURE_NAMES)},
+    prediction REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS predictions_farm_ts ON predictions (farm_id, ts);
+CREATE INDEX IF NOT EXISTS predictions_ts ON predictions (ts);
+"""
+HISTORY_INSERT = (
+    f"INSERT INTO predictions ({', '.join(HISTORY_COLUMNS)}) "
+    f"VALUES ({', '.join('?' for _ in HISTORY_COLUMNS)})"
+)
+HISTORY_ROWS = metrics.counter("prediction_history_rows_total", "Prediction history rows by outcome", ("outcome",))
+HISTORY_WRITTEN = HISTORY_ROWS.labels("written")
+HISTORY_DROPPED = HISTORY_ROWS.labels("dropped")
+HISTORY_PURGED = HISTORY_ROWS.labels("purged")
 
-class BatchPredictionResponse(BaseModel):
-    """Response for batch predictions"""
-    predictions: List[PredictionResponse]
-    total_predictions: int
-    timestamp: str
 
+class PredictionHistory:
+    """Write-behind prediction log in a SQLite database in WAL mode.
 
-# Utility functions
-def load_model():
-    """Load the trained model and scalers - SPECIFICALLY sequence_model.h5"""
-    global model, scaler_X, last_load_error
-    try:
-        logger.info("Loading model and scalers...")
+    record() only appends the request's feature and prediction arrays to an in-memory
+    queue; a writer thread drains it in batches of up to ``batch_size`` rows, one
+    transaction per batch, so disk writes never sit on the request path. With more than
+    ``queue_rows`` rows pending, new records are dropped and counted instead of blocking.
+    Queries open their own read-only connections, which WAL lets run alongside the writer.
+    """
 
-        # Prepare list of candidate model files
-        model_candidates = []
-        if isinstance(MODEL_PATH, (str,)):
-            model_candidates = [Path(MODEL_PATH)]
-        else:
-            model_candidates = [MODEL_PATH]
-
-        # If the candidate doesn't exist, check common alternatives in MODELS_DIR and BASE_DIR
-        if not model_candidates[0].exists():
-            alt = [
-                MODELS_DIR / "sequence_model_fixed.h5", 
-                MODELS_DIR / "sequence_model_compatible.h5",
-                MODELS_DIR / "sequence_model.h5", 
-                MODELS_DIR / "sequence_model.keras", 
-                MODELS_DIR / "sequence_model",
-                BASE_DIR / "sequence_model_fixed.h5", 
-                BASE_DIR / "sequence_model.h5", 
-                BASE_DIR / "sequence_model.keras", 
-                BASE_DIR / "sequence_model"
-            ]
-            model_candidates = [p for p in alt if p.exists()]
-
-        if not model_candidates:
-            raise FileNotFoundError(f"Model file not found. Checked: {MODELS_DIR / 'sequence_model.h5'}, {MODELS_DIR / 'sequence_model.keras'}, {BASE_DIR / 'sequence_model.h5'}; or set MODEL_PATH env var.")
-
-        selected_model = model_candidates[0]
-        logger.info(f"Attempting to load Keras model from: {selected_model}")
-        
-        if keras is None:
-            raise RuntimeError("TensorFlow/Keras not properly installed. Please install: pip install tensorflow>=2.16.0")
-        
-        import h5py
+    def __init__(self, path: Path, batch_size: int, flush_interval_s: float, queue_rows: int, retention_days: float):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval_s = flush_interval_s
+        self.queue_rows = queue_rows
+        self.retention_s = retention_days * 86400
+        self.pending: deque = deque()
+        self.pending_rows = 0
+        self.condition = threading.Condition()
+        self.thread: Optional[threading.Thread] = None
+        self.stopping = False
+        self.written = 0
+        self.dropped = 0
+        self.purged = 0
+        self.batches = 0
+        self.last_error: Optional[str] = None
 
-        # Try several load strategies for compatibility
-        load_errors = []
-        
-        # Strategy 1: Standard load with keras
+    @property
+    def running(self) -> bool:
+        return self.thread is not None
+
+    def connect(self, read_only: bool = False) -> sqlite3.Connection:
+        # timeout doubles as the busy timeout when several gunicorn workers share the file
+        conn = sqlite3.connect(str(self.path), timeout=5.0)
+        if read_only:
+            conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    def start(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self.connect()
         try:
-            model = keras.models.load_model(str(selected_model), compile=False)
-            logger.info("✅ Keras model loaded successfully (keras.models.load_model)")
-        except Exception as e1:
-            load_errors.append(f"Standard load: {str(e1)}")
-            logger.warning(f"keras.models.load_model failed: {e1}")
-            
-            # Strategy 2: Try with tf.keras if tf is available
-            if tf is not None:
-                try:
-                    model = tf.keras.models.load_model(str(selected_model), compile=False)
-                    logger.info("✅ Keras model loaded successfully (tf.keras.models.load_model)")
-                except Exception as e2:
-                    load_errors.append(f"TF Keras load: {str(e2)}")
-                    logger.warning(f"tf.keras.models.load_model failed: {e2}")
-                    
-                    # Strategy 3: Manual reconstruction from H5 file (for batch_shape compatibility)
-                    try:
-                        logger.info("Attempting manual model reconstruction from H5 file...")
-                        with h5py.File(str(selected_model), 'r') as f:
-                            # Load model config
-                            if 'model_config' in f.attrs:
-                                import json
-                                config = json.loads(f.attrs['model_config'])
-                                
-                                # Fix batch_shape -> input_shape in config
-                                if 'config' in config and 'layers' in config['config']:
-                                    for layer in config['config']['layers']:
-                                        if 'config' in layer and 'batch_shape' in layer['config']:
-                                            batch_shape = layer['config']['batch_shape']
-                                            # Convert batch_shape to input_shape (remove batch dimension)
-                                            if batch_shape and len(batch_shape) > 1:
-                                                layer['config']['input_shape'] = batch_shape[1:]
-                                            del layer['config']['batch_shape']
-                                
-                                # Reconstruct model from modified config
-                                model = tf.keras.models.model_from_json(json.dumps(config))
-                                
-                                # Load weights
-                                model.load_weights(str(selected_model))
-                                logger.info("✅ Model reconstructed successfully with compatibility fixes")
-                            else:
-                                raise ValueError("No model_config found in H5 file")
-                                
-                    except Exception as e3:
-                        load_errors.append(f"Manual reconstruction: {str(e3)}")
-                        logger.error("All attempts to load the Keras model failed")
-                        raise RuntimeError("; ".join(load_errors))
-            else:
-                logger.error("TensorFlow not available, skipping tf.keras strategies")
-                raise RuntimeError("; ".join(load_errors))
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.executescript(HISTORY_SCHEMA)
+        finally:
+            conn.close()
+        self.stopping = False
+        self.thread = threading.Thread(target=self.run, name="prediction-history", daemon=True)
+        self.thread.start()
+        logger.info(f"✅ Recording prediction history to {self.path}")
 
-        # Load scaler for X (features only - target is not scaled)
-        scaler_path = Path(SCALER_X_PATH)
-        if not scaler_path.exists():
-            fallbacks = [MODELS_DIR / "scaler_X.pkl", BASE_DIR / "scaler_X.pkl"]
-            scaler_path = next((p for p in fallbacks if p.exists()), None)
-            if scaler_path is None:
-                raise FileNotFoundError(f"Scaler X file '{SCALER_X_PATH}' not found. Checked fallbacks: {fallbacks}")
-
-        scaler_X = joblib.load(str(scaler_path))
-        logger.info("✅ Scaler loaded successfully")
+    def stop(self, timeout: float = 5.0):
+        """Flush what is queued and stop the writer thread"""
+        if self.thread is None:
+            return
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+        self.thread.join(timeout)
+        self.thread = None
+
+    def record(self, endpoint: str, farm_id: Optional[str], features: np.ndarray, predictions: np.ndarray,
+               model_version: str, latency_s: float):
+        """Queue one request's predictions; never blocks on disk"""
+        rows = len(predictions)
+        if self.thread is None or rows == 0:
+            return
+        with self.condition:
+            if self.pending_rows + rows > self.queue_rows:
+                self.dropped += rows
+                HISTORY_DROPPED.inc(rows)
+                return
+            self.pending.append((time.time(), farm_id, endpoint, model_version, latency_s * 1000, features, predictions))
+            self.pending_rows += rows
+            if self.pending_rows >= self.batch_size:
+                self.condition.notify()
 
-        # Sanity test the model with a sample prediction (non-invasive)
+    def run(self):
+        conn = self.connect()
+        conn.execute("PRAGMA synchronous = NORMAL")
+        next_purge = time.monotonic()
         try:
-            logger.info("Testing model with sample input...")
-            test_input = np.array([[2291.0, 258.6, 17.5, 27.0, 59.4, 481.8, 236.3]])
-            test_scaled = scaler_X.transform(test_input)
-            test_prediction = model.predict(test_scaled, verbose=0)
-            test_output = float(np.ravel(test_prediction)[0])
-            logger.info(f"✅ Model test successful. Sample prediction: {test_output:.2f}")
-        except Exception as e:
-            logger.warning(f"Model loaded but sample prediction test failed: {e}")
+            while True:
+                with self.condition:
+                    if self.pending_rows < self.batch_size and not self.stopping:
+                        self.condition.wait(self.flush_interval_s)
+                    batch, rows = [], 0
+                    while self.pending and rows < self.batch_size:
+                        item = self.pending.popleft()
+                        batch.append(item)
+                        rows += len(item[-1])
+                    self.pending_rows -= rows
+                    finished = self.stopping and not self.pending
+                if batch:
+                    self.write(conn, batch)
+                if self.retention_s > 0 and time.monotonic() >= next_purge:
+                    self.purge(conn)
+                    next_purge = time.monotonic() + HISTORY_PURGE_INTERVAL_S
+                if finished:
+                    break
+        finally:
+            conn.close()
 
-        return True
-        
-    except Exception as e:
-        logger.error(f"❌ Error loading model: {str(e)}")
-        import traceback
-        tb = traceback.format_exc()
-        logger.error(f"Full traceback: {tb}")
+    def write(self, conn: sqlite3.Connection, batch: list):
+        rows = []
+        for recorded_at, farm_id, endpoint, model_version, latency_ms, features, predictions in batch:
+            values = np.column_stack([
+                np.asarray(features, dtype=np.float64).reshape(len(predictions), -1),
+                np.asarray(predictions, dtype=np.float64),
+            ]).tolist()
+            prefix = (recorded_at, farm_id, endpoint, model_version, round(latency_ms, 3))
+            rows.extend(prefix + tuple(row) for row in values)
+        try:
+            with conn:
+                conn.executemany(HISTORY_INSERT, rows)
+        except sqlite3.Error as e:
+            self.dropped += len(rows)
+            HISTORY_DROPPED.inc(len(rows))
+            self.last_error = str(e)
+            logger.error(f"❌ Prediction history write failed, {len(rows)} rows dropped: {e}")
+            return
+        self.written += len(rows)
+        self.batches += 1
+        HISTORY_WRITTEN.inc(len(rows))
 
-        # Reset global variables to ensure clean state
-        model = None
-        scaler_X = None
-        # Record the error for /health diagnostics
+    def purge(self, conn: sqlite3.Connection):
+        """Delete rows older than the retention period"""
         try:
-            last_load_error = tb
-        except Exception:
-            last_load_error = str(e)
-        return False
+            with conn:
+                deleted = conn.execute("DELETE FROM predictions WHERE ts < ?", (time.time() - self.retention_s,)).rowcount
+        except sqlite3.Error as e:
+            self.last_error = str(e)
+            logger.warning(f"⚠️ Prediction history retention purge failed: {e}")
+            return
+        if deleted:
+            self.purged += deleted
+            HISTORY_PURGED.inc(deleted)
+            logger.info(f"✅ Purged {deleted} prediction history rows past retention")
 
+    def query(self, farm_id: Optional[str], start: Optional[float], end: Optional[float], limit: int,
+              cursor: Optional[tuple] = None, descending: bool = True) -> list:
+        """One page of rows, ordered by (ts, id) and continuing after ``cursor``"""
+        clauses, params = [], []
+        if farm_id is not None:
+            clauses.append("farm_id = ?")
+            params.append(farm_id)
+        if start is not None:
+            clauses.append("ts >= ?")
+            params.append(start)
+        if end is not None:
+            clauses.append("ts < ?")
+            params.append(end)
+        if cursor is not None:
+            clauses.append("(ts, id) < (?, ?)" if descending else "(ts, id) > (?, ?)")
+            params.extend(cursor)
+        order = "DESC" if descending else "ASC"
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        sql = f"SELECT id, {', '.join(HISTORY_COLUMNS)} FROM predictions{where} ORDER BY ts {order}, id {order} LIMIT ?"
+        conn = self.connect(read_only=True)
+        try:
+            return conn.execute(sql, params + [limit]).fetchall()
+        finally:
+            conn.close()
 
-def get_farm_size_category(num_chickens: float) -> str:
-    """Categorize farm size based on number of chickens"""
-    if num_chickens < 500:
-        return "Small Farm"
-    elif num_chickens < 2000:
-        return "Medium Farm"
-    elif num_chickens < 5000:
-        return "Large Farm"
-    else:
-        return "Industrial Farm"
+    def stats(self) -> Dict:
+        summary = {
+            "enabled": HISTORY_ENABLED,
+            "running": self.running,
+            "path": str(self.path),
+            "pending_rows": self.pending_rows,
+            "written": self.written,
+            "dropped": self.dropped,
+            "purged": self.purged,
+            "batches": self.batches,
+            "retention_days": self.retention_s / 86400,
+            "last_error": self.last_error,
+        }
+        if self.running:
+            conn = self.connect(read_only=True)
+            try:
+                rows, oldest, newest = conn.execute("SELECT COUNT(*), MIN(ts), MAX(ts) FROM predictions").fetchone()
+            finally:
+                conn.close()
+            summary.update({
+                "rows": rows,
+                "oldest": datetime.fromtimestamp(oldest).isoformat() if oldest is not None else None,
+                "newest": datetime.fromtimestamp(newest).isoformat() if newest is not None else None,
+            })
+        return summary
 
 
-def generate_recommendations(input_data: FarmInput, prediction: float) -> List[str]:
-    """Generate optimization recommendations based on input parameters"""
-    recommendations = []
-    
-    # Temperature recommendations (Optimal: 18-28°C)
-    if input_data.temperature < 18:
-        recommendations.append("🌡️ Temperature is low. Consider heating to maintain optimal range (18-28°C)")
-    elif input_data.temperature > 28:
-        recommendations.append("🌡️ Temperature is high. Consider cooling to prevent heat stress")
-    else:
-        recommendations.append("✅ Temperature is optimal")
-    
-    # Humidity recommendations (Optimal: 50-70%)
-    if input_data.humidity < 50:
-        recommendations.append("💧 Humidity is low. Increase humidity to 50-70% for better production")
-    elif input_data.humidity > 70:
-        recommendations.append("💧 Humidity is high. Reduce to prevent respiratory issues")
-    else:
-        recommendations.append("✅ Humidity is optimal")
-    
-    # Ammonia recommendations (Optimal: <25 ppm)
-    if input_data.ammonia > 25:
-        recommendations.append("🌫️ High ammonia levels detected. Improve ventilation immediately")
-    elif input_data.ammonia > 15:
-        recommendations.append("⚠️ Ammonia levels are elevated. Monitor ventilation")
-    else:
-        recommendations.append("✅ Ammonia levels are safe")
-    
-    # Light intensity recommendations (Optimal: 200-500 lux)
-    if input_data.light_intensity < 200:
-        recommendations.append("💡 Light intensity is low. Increase to 250-400 lux for optimal egg production")
-    elif input_data.light_intensity > 500:
-        recommendations.append("💡 Light intensity is high. Reduce to prevent stress")
-    else:
-        recommendations.append("✅ Light intensity is optimal")
-    
-    # Amount of feeding recommendations (Optimal: 200-300)
-    if input_data.amount_of_feeding < 150:
-        recommendations.append("🥗 Feeding amount is low. Increase to ensure adequate nutrition")
-    elif input_data.amount_of_feeding > 350:
-        recommendations.append("🥗 Feeding amount is high. Monitor to prevent overfeeding")
-    else:
-        recommendations.append("✅ Feeding amount is optimal")
-    
-    # Noise recommendations (Optimal: <200)
-    if input_data.noise > 300:
-        recommendations.append("🔊 Noise level is high. Reduce noise to minimize stress on chickens")
-    elif input_data.noise > 200:
-        recommendations.append("🔊 Noise level is elevated. Consider soundproofing measures")
-    else:
-        recommendations.append("✅ Noise level is optimal")
-    
-    # Production prediction feedback
-    expected_production = input_data.amount_of_chicken * 0.8  # ~80% production rate
-    if prediction < expected_production * 0.7:
-        recommendations.append("📉 Predicted production is below expected. Check environmental conditions")
-    elif prediction >= expected_production * 0.9:
-        recommendations.append("🎉 Excellent! Predicted production is high. Maintain current conditions")
-    
-    return recommendations
+prediction_history = PredictionHistory(
+    HISTORY_DB_PATH, HISTORY_BATCH_SIZE, HISTORY_FLUSH_INTERVAL_S, HISTORY_QUEUE_ROWS, HISTORY_RETENTION_DAYS
+)
+metrics.gauge("prediction_history_pending_rows", "Predictions queued for the history store", lambda: prediction_history.pending_rows)
 
 
-def calculate_confidence(input_data: FarmInput) -> float:
-    """Calculate a confidence score based on input parameter quality"""
-    score = 1.0
-    
-    # Penalize extreme values
-    if input_data.temperature < 15 or input_data.temperature > 32:
-        score *= 0.85
-    if input_data.humidity < 40 or input_data.humidity > 80:
-        score *= 0.9
-    if input_data.ammonia > 30:
-        score *= 0.8
-    if input_data.light_intensity < 100 or input_data.light_intensity > 800:
-        score *= 0.9
-    if input_data.amount_of_feeding < 100 or input_data.amount_of_feeding > 500:
-        score *= 0.85
-    if input_data.noise > 400:
-        score *= 0.85
-    
-    return round(score, 3)
+def history_record(row: tuple) -> Dict:
+    record_id, ts, farm_id, endpoint, model_version, latency_ms, *values = row
+    return {
+        "id": record_id,
+        "timestamp": datetime.fromtimestamp(ts).isoformat(),
+        "farm_id": farm_id,
+        "endpoint": endpoint,
+        "model_version": model_version,
+        "latency_ms": latency_ms,
+        "input_data": dict(zip(FEATURE_NAMES, values[:-1])),
+        "predicted_egg_production": round(values[-1], 2),
+    }
+
+
+def encode_history_cursor(row: tuple) -> str:
+    return f"{row[1]!r}:{row[0]}"
+
+
+def decode_history_cursor(cursor: str) -> tuple:
+    try:
+        ts, record_id = cursor.split(":")
+        return float(ts), int(record_id)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid cursor '{cursor}'")
+
+
+def require_history():
+    if not prediction_history.running:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Prediction history is disabled. Set HISTORY_ENABLED=1 to record predictions."
+        )
+
+
+HISTORY_CSV_COLUMNS = ["id", "timestamp", "farm_id", "endpoint", "model_version", "latency_ms"] + FEATURE_NAMES + ["predicted_egg_production"]
+
+
+async def stream_history(farm_id: Optional[str], start: Optional[float], end: Optional[float],
+                         output_format: str) -> AsyncIterator[str]:
+    """Oldest-first export, one keyset page at a time so memory stays bounded"""
+    if output_format == "csv":
+        yield ",".join(HISTORY_CSV_COLUMNS) + "\n"
+    cursor = None
+    while True:
+        rows = await asyncio.to_thread(
+            prediction_history.query, farm_id, start, end, HISTORY_PAGE_SIZE, cursor, False
+        )
+        if not rows:
+            return
+        if output_format == "csv":
+            out = io.StringIO()
+            writer = csv.writer(out, lineterminator="\n")
+            for row in rows:
+                record = history_record(row)
+                input_data = record.pop("input_data")
+                writer.writerow([input_data.get(c, record.get(c)) for c in HISTORY_CSV_COLUMNS])
+            yield out.getvalue()
+        else:
+            yield "".join(encode_json(history_record(row)) + "\n" for row in rows)
+        if len(rows) < HISTORY_PAGE_SIZE:
+            return
+        cursor = (rows[-1][1], rows[-1][0])
 
 
 # API Endpoints
@@ -420,7 +3770,8 @@ async def root():
             "predict": "/predict",
             "batch_predict": "/batch_predict",
             "model_info": "/model/info",
-            "recommendations": "/recommendations"
+            "recommendations": "/recommendations",
+            "optimize": "/optimize"
         }
     }
 
@@ -429,17 +3780,50 @@ async def root():
 async def health_check():
     """Health check endpoint"""
     return HealthResponse(
-        status="healthy" if (model is not None and scaler_X is not None) else "unhealthy",
+        status="healthy" if (model is not None and scaler_X is not None and rules_engine is not None) else "unhealthy",
+        model_state=model_state,
+        model_version=active_model.version if active_model is not None else None,
         model_loaded=model is not None,
         scaler_X_loaded=scaler_X is not None,
+        rules_loaded=rules_engine is not None,
         last_error=last_load_error,
+        rules_error=rules_load_error,
         timestamp=datetime.now().isoformat(),
         version="1.0.0"
     )
 
 
+@app.get("/health/live", tags=["Health"])
+async def liveness():
+    """Liveness probe: the process is up and the event loop is responsive"""
+    return {"status": "alive", "timestamp": datetime.now().isoformat()}
+
+
+@app.get("/health/ready", tags=["Health"])
+async def readiness():
+    """Readiness probe: 200 only once the model is loaded and warmed up"""
+    ready = model_state == "ready" and model is not None and scaler_X is not None and rules_engine is not None
+    return JSONResponse(
+        status_code=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={
+            "status": "ready" if ready else "not_ready",
+            "model_state": model_state,
+            "load_seconds": model_load_seconds,
+            "warmup_seconds": model_warmup_seconds,
+            "last_error": last_load_error if model_state == "failed" else None,
+            "rules_error": rules_load_error,
+            "timestamp": datetime.now().isoformat(),
+        }
+    )
+
+
 @app.post("/predict", response_model=PredictionResponse, tags=["Prediction"])
-async def predict(farm_data: FarmInput):
+async def predict(
+    farm_data: FarmInput,
+    request: Request,
+    x_request_timeout: Optional[float] = Header(None, description="Client timeout in seconds; inference is dropped once it passes"),
+    x_farm_id: Optional[str] = Header(None, max_length=128, description="Farm the predictions are recorded under in /history"),
+):
     """
     Predict egg production for a single farm
     
@@ -458,50 +3842,62 @@ async def predict(farm_data: FarmInput):
     - Confidence score
     - Recommendations for optimization
     """
-    if model is None or scaler_X is None:
-        raise HTTPException(
-            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-            detail="Model not loaded. Please check server logs and ensure sequence_model.h5 is available."
-        )
+    started = time.perf_counter()
+    observe_validation(request)
+    ensure_model_ready()
     
     try:
-        # Prepare input data in correct order
-        input_array = np.array([[
-            farm_data.amount_of_chicken,
-            farm_data.amount_of_feeding,
-            farm_data.ammonia,
-            farm_data.temperature,
-            farm_data.humidity,
-            farm_data.light_intensity,
-            farm_data.noise
-        ]])
-        
-        # Scale input
-        input_scaled = scaler_X.transform(input_array)
-        
-        # Make prediction (model outputs actual values, no inverse transform needed)
-        prediction_output = model.predict(input_scaled, verbose=0)
-        
-        # Extract prediction value
-        prediction = float(prediction_output[0][0])
-        prediction = max(0, prediction)  # Ensure non-negative
-        
-        # Generate metadata
-        farm_category = get_farm_size_category(farm_data.amount_of_chicken)
-        confidence = calculate_confidence(farm_data)
-        recommendations = generate_recommendations(farm_data, prediction)
-        
-        return PredictionResponse(
-            predicted_egg_production=round(prediction, 2),
-            confidence_score=confidence,
-            farm_size_category=farm_category,
-            recommendations=recommendations,
-            timestamp=datetime.now().isoformat(),
-            model_version="Keras Neural Network v1.0 (sequence_model.h5)",
-            input_data=farm_data.dict()
+        # Prepare input data in correct order, scale and predict. With micro-batching
+        # enabled the row is coalesced with concurrent requests into one model call.
+        # Inference runs on the bounded executor so it never blocks the event loop.
+        input_array = farms_to_array([farm_data])
+        cache_key = None
+        if prediction_cache.enabled:
+            # Key includes the model hash so entries never outlive the model that produced them
+            cache_key = prediction_cache.key_for(input_array[0], active_model.source_hash)
+            cached = prediction_cache.get(cache_key)
+            if cached is not None:
+                prediction_history.record(
+                    "/predict", x_farm_id, input_array, np.array([cached["predicted_egg_production"]]),
+                    cached["model_version"], time.perf_counter() - started
+                )
+                return FastJSONResponse({
+                    **cached,
+                    "timestamp": datetime.now().isoformat(),
+                    "input_data": dict(farm_data),
+                })
+
+        deadline = request_deadline(x_request_timeout)
+        uncertainty = None
+        if active_model.uncertainty is not None:
+            # Interval sampling skips the batcher: the row's K samples are already one batch
+            bundle = active_model
+            predictions, uncertainty = await inference_executor.run(
+                predict_with_uncertainty, input_array, bundle, deadline=deadline
+            )
+            prediction, model_version = predictions[0], bundle.version
+        # Profiled requests skip the batcher so their inference is attributed to them
+        elif batcher.running and request_profile.get() is None:
+            prediction, model_version = await batcher.submit(input_array[0], deadline)
+        else:
+            bundle = active_model
+            prediction = (await inference_executor.run(predict_array, input_array, bundle, deadline=deadline))[0]
+            model_version = bundle.version
+
+        response = prediction_response_dicts(
+            [farm_data], input_array, np.array([prediction]), datetime.now().isoformat(), model_version, uncertainty
+        )[0]
+        if cache_key is not None:
+            prediction_cache.put(cache_key, response)
+        prediction_history.record(
+            "/predict", x_farm_id, input_array, np.array([prediction]), model_version, time.perf_counter() - started
         )
+        return FastJSONResponse(response)
     
+    except (InferenceOverloadedError, InferenceDeadlineError):
+        raise
     except Exception as e:
+        record_error(e)
         logger.error(f"Prediction error: {str(e)}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -510,63 +3906,56 @@ async def predict(farm_data: FarmInput):
 
 
 @app.post("/batch_predict", response_model=BatchPredictionResponse, tags=["Prediction"])
-async def batch_predict(batch_data: BatchPredictionInput):
+async def batch_predict(
+    batch_data: BatchPredictionInput,
+    request: Request,
+    x_request_timeout: Optional[float] = Header(None, description="Client timeout in seconds; inference is dropped once it passes"),
+    x_farm_id: Optional[str] = Header(None, max_length=128, description="Farm the predictions are recorded under in /history"),
+):
     """
-    Predict egg production for multiple farms (max 100)
+    Predict egg production for multiple farms (max MAX_BATCH_SIZE, default 10000)
     
-    Accepts a list of farm inputs and returns predictions for each.
+    Accepts a list of farm inputs and returns predictions for each. All farms are
+    stacked into a single feature matrix and scaled/predicted in chunks of
+    BATCH_CHUNK_SIZE rows.
     """
-    if model is None or scaler_X is None:
-        raise HTTPException(
-            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-            detail="Model not loaded. Please check server logs and ensure sequence_model.h5 is available."
-        )
+    started = time.perf_counter()
+    observe_validation(request)
+    ensure_model_ready()
     
     try:
-        predictions = []
-        
-        for farm_data in batch_data.farms:
-            # Prepare input data
-            input_array = np.array([[
-                farm_data.amount_of_chicken,
-                farm_data.amount_of_feeding,
-                farm_data.ammonia,
-                farm_data.temperature,
-                farm_data.humidity,
-                farm_data.light_intensity,
-                farm_data.noise
-            ]])
-            
-            # Scale input
-            input_scaled = scaler_X.transform(input_array)
-            
-            # Make prediction (model outputs actual values, no inverse transform needed)
-            prediction_output = model.predict(input_scaled, verbose=0)
-            prediction = float(prediction_output[0][0])
-            prediction = max(0, prediction)
-            
-            # Generate metadata
-            farm_category = get_farm_size_category(farm_data.amount_of_chicken)
-            confidence = calculate_confidence(farm_data)
-            recommendations = generate_recommendations(farm_data, prediction)
-            
-            predictions.append(PredictionResponse(
-                predicted_egg_production=round(prediction, 2),
-                confidence_score=confidence,
-                farm_size_category=farm_category,
-                recommendations=recommendations,
-                timestamp=datetime.now().isoformat(),
-                model_version="Keras Neural Network v1.0 (sequence_model.h5)",
-                input_data=farm_data.dict()
-            ))
-        
-        return BatchPredictionResponse(
-            predictions=predictions,
-            total_predictions=len(predictions),
-            timestamp=datetime.now().isoformat()
+        # Stack every farm into one (N, 7) matrix so the whole batch is scaled and
+        # inferred in a handful of chunked calls instead of once per farm
+        # Pin the served bundle so the whole batch uses one model version even across a reload
+        bundle = active_model
+        input_array = farms_to_array(batch_data.farms)
+        deadline = request_deadline(x_request_timeout)
+        uncertainty = None
+        if bundle.uncertainty is not None:
+            batch_output, uncertainty = await inference_executor.run(
+                predict_with_uncertainty, input_array, bundle, deadline=deadline
+            )
+        else:
+            batch_output = await inference_executor.run(predict_array, input_array, bundle, deadline=deadline)
+
+        timestamp = datetime.now().isoformat()
+        predictions = prediction_response_dicts(
+            batch_data.farms, input_array, batch_output, timestamp, bundle.version, uncertainty
+        )
+        prediction_history.record(
+            "/batch_predict", x_farm_id, input_array, batch_output, bundle.version, time.perf_counter() - started
         )
+        
+        return FastJSONResponse({
+            "predictions": predictions,
+            "total_predictions": len(predictions),
+            "timestamp": timestamp,
+        })
     
+    except (InferenceOverloadedError, InferenceDeadlineError):
+        raise
     except Exception as e:
+        record_error(e)
         logger.error(f"Batch prediction error: {str(e)}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -574,6 +3963,555 @@ async def batch_predict(batch_data: BatchPredictionInput):
         )
 
 
+@app.post(
+    "/batch_predict/stream",
+    tags=["Prediction"],
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "text/csv": {"schema": {"type": "string"}},
+                "application/x-ndjson": {"schema": {"type": "string"}},
+            },
+        }
+    },
+)
+async def batch_predict_stream(
+    request: Request,
+    output: Optional[str] = None,
+    x_farm_id: Optional[str] = Header(None, max_length=128, description="Farm the predictions are recorded under in /history"),
+):
+    """
+    Score a large CSV or NDJSON upload, streaming results back as they are produced
+
+    The body is parsed and scored in chunks of STREAM_CHUNK_SIZE rows, so memory stays
+    constant regardless of upload size. CSV needs a header row containing the seven
+    feature columns (case-insensitive); NDJSON lines are FarmInput objects. An optional
+    `id` column/key is echoed back. Bad rows (unparseable, non-UTF-8, out of range or
+    longer than STREAM_MAX_LINE_BYTES) and rows of a chunk whose inference fails produce
+    an inline `error` record instead of failing the stream. Output defaults to the input format; override with
+    `output=csv|ndjson`.
+    """
+    ensure_model_ready()
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    input_format = STREAM_INPUT_TYPES.get(content_type)
+    if input_format is None:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail=f"Unsupported content type '{content_type}'. Use text/csv or application/x-ndjson."
+        )
+    output_format = output or input_format
+    if output_format not in STREAM_OUTPUT_MEDIA_TYPES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="output must be 'csv' or 'ndjson'"
+        )
+
+    return BodyStreamingResponse(
+        stream_scores(request, input_format, output_format, active_model, x_farm_id),
+        media_type=STREAM_OUTPUT_MEDIA_TYPES[output_format]
+    )
+
+
+@app.post(
+    "/batch_predict/binary",
+    tags=["Prediction"],
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/octet-stream": {"schema": {"type": "string", "format": "binary"}},
+                "application/x-npy": {"schema": {"type": "string", "format": "binary"}},
+                "application/vnd.apache.arrow.stream": {"schema": {"type": "string", "format": "binary"}},
+            },
+        }
+    },
+)
+async def batch_predict_binary(
+    request: Request,
+    x_request_timeout: Optional[float] = Header(None, description="Client timeout in seconds; inference is dropped once it passes"),
+    x_farm_id: Optional[str] = Header(None, max_length=128, description="Farm the predictions are recorded under in /history"),
+):
+    """
+    Predict egg production for a binary feature matrix (machine-to-machine)
+
+    Accepts raw little-endian float32 rows (`application/octet-stream`), a `.npy` array
+    (`application/x-npy`) or an Arrow IPC stream (`application/vnd.apache.arrow.stream`),
+    each with the seven features in `/predict` order (Arrow: one column per feature name).
+    Payloads are wrapped without copying, validated with vectorized bounds checks against
+    the FarmInput ranges, and predictions are returned as float32 in the same format.
+    """
+    started = time.perf_counter()
+    ensure_model_ready()
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    # Bound the upload before buffering it; the row check below covers narrower dtypes
+    body = await read_body_capped(request, max_binary_body_bytes(content_type))
+    try:
+        matrix, binary_format = decode_binary_batch(content_type, body)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid binary payload: {e}")
+
+    if len(matrix) > MAX_BINARY_BATCH_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Binary batch has {len(matrix)} rows; the limit is {MAX_BINARY_BATCH_SIZE}"
+        )
+    range_error = range_error_response(matrix)
+    if range_error is not None:
+        return range_error
+
+    bundle = active_model
+    predictions = await inference_executor.run(
+        predict_array, matrix, bundle, deadline=request_deadline(x_request_timeout)
+    )
+    prediction_history.record(
+        "/batch_predict/binary", x_farm_id, matrix, predictions, bundle.version, time.perf_counter() - started
+    )
+    payload, media_type = encode_binary_predictions(predictions, binary_format)
+    return Response(
+        content=payload,
+        media_type=media_type,
+        headers={"X-Rows": str(len(predictions)), "X-Model-Version": bundle.version}
+    )
+
+
+@app.post("/batch_predict/columnar", response_model=ColumnarBatchResponse, tags=["Prediction"])
+async def batch_predict_columnar(
+    batch_data: ColumnarBatchInput,
+    request: Request,
+    x_request_timeout: Optional[float] = Header(None, description="Client timeout in seconds; inference is dropped once it passes"),
+    x_farm_id: Optional[str] = Header(None, max_length=128, description="Farm the predictions are recorded under in /history"),
+):
+    """
+    Predict egg production for a columnar batch (one array per feature, max
+    MAX_COLUMNAR_BATCH_SIZE rows, default MAX_BATCH_SIZE; use /batch_predict/binary for more)
+
+    Validation is a single vectorized bounds check against the FarmInput ranges. The
+    response holds parallel arrays of predictions, confidence scores, farm size category
+    codes and recommendation codes, plus one shared lookup table for the message texts,
+    instead of a full PredictionResponse per farm.
+    """
+    started = time.perf_counter()
+    observe_validation(request)
+    ensure_model_ready()
+    matrix = np.column_stack([np.asarray(getattr(batch_data, name), dtype=np.float64) for name in FEATURE_NAMES])
+    range_error = range_error_response(matrix)
+    if range_error is not None:
+        return range_error
+
+    bundle = active_model
+    predictions = await inference_executor.run(
+        predict_array, matrix, bundle, deadline=request_deadline(x_request_timeout)
+    )
+    prediction_history.record(
+        "/batch_predict/columnar", x_farm_id, matrix, predictions, bundle.version, time.perf_counter() - started
+    )
+    rules_started = time.perf_counter()
+    codes, confidence, _ = rules_engine.evaluate(matrix, predictions)
+    STAGE_RULES.observe(time.perf_counter() - rules_started)
+    return FastJSONResponse({
+        "predictions": np.round(predictions, 2).tolist(),
+        "confidence_scores": confidence.tolist(),
+        "farm_size_categories": rules_engine.farm_size_codes(matrix).tolist(),
+        "recommendation_codes": [[code for code in row if code >= 0] for row in codes.tolist()],
+        "lookup": {
+            "farm_size_categories": rules_engine.farm_size_categories.tolist(),
+            "recommendations": rules_engine.messages,
+        },
+        "total_predictions": len(predictions),
+        "timestamp": datetime.now().isoformat(),
+        "model_version": bundle.version,
+    })
+
+
+@app.websocket("/ws/predict")
+async def websocket_predict(websocket: WebSocket):
+    """
+    Persistent prediction stream for sensor gateways
+
+    The gateway sends text frames holding one reading or a list of readings; each reading
+    is a FarmInput object plus a client-side "id" (e.g. the house). Every reading gets its
+    own response frame tagged with that id: the PredictionResponse fields without
+    input_data, or {"id", "error"}. Readings from all connections share the /predict
+    micro-batcher, and responses may arrive out of order. An X-Farm-Id header on the
+    handshake records the connection's predictions under that farm in /history.
+
+    Backpressure: at most WS_MAX_IN_FLIGHT readings per connection are scored or waiting to
+    be sent. Beyond that the server stops reading the socket until results drain, which
+    slows a gateway that sends faster than the model (or its own reader) keeps up.
+    """
+    global websocket_connections
+    farm_id = websocket.headers.get("x-farm-id")
+    await websocket.accept()
+    websocket_connections += 1
+    in_flight = asyncio.Semaphore(WS_MAX_IN_FLIGHT)
+    outgoing: asyncio.Queue = asyncio.Queue()
+    scoring = set()
+
+    async def send_frames():
+        while True:
+            frame = await outgoing.get()
+            await websocket.send_text(encode_json(frame))
+            WEBSOCKET_FRAMES_OUT.inc()
+            in_flight.release()
+
+    async def score(reading):
+        try:
+            frame = await score_gateway_reading(reading, farm_id)
+        except Exception as e:
+            record_error(e)
+            logger.error(f"WebSocket scoring error: {e}")
+            frame = {"id": reading.get("id") if isinstance(reading, dict) else None, "error": "Prediction failed"}
+        await outgoing.put(frame)
+
+    async def acquire_slot():
+        """Wait for an in-flight slot; released once the response frame is sent"""
+        if not in_flight.locked():
+            await in_flight.acquire()
+            return
+        acquire = asyncio.ensure_future(in_flight.acquire())
+        await asyncio.wait({acquire, sender}, return_when=asyncio.FIRST_COMPLETED)
+        if not acquire.done():
+            # The sender died (client gone), so no slot will ever be released
+            acquire.cancel()
+            raise WebSocketDisconnect(code=1006)
+
+    sender = asyncio.create_task(send_frames())
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(code=message.get("code", 1000))
+            WEBSOCKET_FRAMES_IN.inc()
+            try:
+                text = message.get("text")
+                readings = decode_gateway_frame(text if text is not None else message.get("bytes", b"").decode())
+            except ValueError as e:
+                await acquire_slot()
+                await outgoing.put({"id": None, "error": f"Invalid JSON frame: {e}"})
+                continue
+            for reading in readings:
+                await acquire_slot()
+                task = asyncio.create_task(score(reading))
+                scoring.add(task)
+                task.add_done_callback(scoring.discard)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        websocket_connections -= 1
+        for task in list(scoring) + [sender]:
+            task.cancel()
+
+
+@app.post("/farms/{farm_id}/readings", response_model=FarmReadingResponse, tags=["Farms"])
+async def ingest_farm_reading(
+    farm_id: str,
+    reading: FarmReading,
+    predict: bool = False,
+    basis: Literal["latest", "mean", "ewma"] = "latest",
+    x_request_timeout: Optional[float] = Header(None, description="Client timeout in seconds; inference is dropped once it passes"),
+):
+    """
+    Add a reading to a farm's rolling window
+
+    Omitted features keep the farm's previous value, so gateways only need to send what
+    changed; a farm's first reading must be complete. With ``predict=true`` the response
+    also carries a prediction from the updated window (see ``/farms/{farm_id}/predict``).
+    """
+    warn_feature_store_workers()
+    try:
+        window, _ = feature_store.ingest(farm_id, reading)
+    except ValidationError as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=json.loads(e.json(include_url=False)))
+
+    response = {"farm_id": farm_id, "readings": window.count, "total_readings": window.seq, "prediction": None}
+    if predict:
+        ensure_model_ready()
+        response["prediction"] = await predict_farm_window(farm_id, window, basis, request_deadline(x_request_timeout))
+    return FastJSONResponse(response)
+
+
+@app.get("/farms/{farm_id}/predict", response_model=PredictionResponse, tags=["Farms"])
+async def predict_farm(
+    farm_id: str,
+    basis: Literal["latest", "mean", "ewma"] = "latest",
+    x_request_timeout: Optional[float] = Header(None, description="Client timeout in seconds; inference is dropped once it passes"),
+):
+    """
+    Predict from a farm's stored window without resending its readings
+
+    ``basis`` picks the feature row: the latest reading, the window mean, or the EWMA
+    (smoothed recent trend). input_data in the response is that row.
+    """
+    warn_feature_store_workers()
+    ensure_model_ready()
+    window = feature_store.get(farm_id)
+    if window is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"No readings stored for farm '{farm_id}'")
+    return FastJSONResponse(await predict_farm_window(farm_id, window, basis, request_deadline(x_request_timeout)))
+
+
+@app.get("/farms/{farm_id}/window", tags=["Farms"])
+async def farm_window(farm_id: str, history: bool = False):
+    """Rolling aggregates (latest, mean, min, max, EWMA) of a farm's window, optionally with the raw readings"""
+    warn_feature_store_workers()
+    window = feature_store.get(farm_id)
+    if window is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"No readings stored for farm '{farm_id}'")
+    timestamps, values = window.history()
+    response = {
+        "farm_id": farm_id,
+        "readings": window.count,
+        "window_size": window.size,
+        "total_readings": window.seq,
+        "first_timestamp": float(timestamps[0]),
+        "last_timestamp": float(timestamps[-1]),
+        "latest": features_dict(window.latest()),
+        "mean": features_dict(window.mean()),
+        "min": features_dict(window.minimum()),
+        "max": features_dict(window.maximum()),
+        "ewma": features_dict(window.ewma),
+        "ewma_alpha": window.alpha,
+    }
+    if history:
+        response["history"] = {"timestamp": timestamps.tolist(), **{name: values[:, j].tolist() for j, name in enumerate(FEATURE_NAMES)}}
+    return FastJSONResponse(response)
+
+
+@app.delete("/farms/{farm_id}", tags=["Farms"])
+async def delete_farm(farm_id: str):
+    """Drop a farm's stored window"""
+    warn_feature_store_workers()
+    if not feature_store.remove(farm_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"No readings stored for farm '{farm_id}'")
+    return {"farm_id": farm_id, "deleted": True}
+
+
+@app.get("/farms", tags=["Farms"])
+async def farms_stats():
+    """Feature store size, limits and eviction count (of this worker's store)"""
+    warn_feature_store_workers()
+    return {**feature_store.stats(), "pid": os.getpid(), "workers": SERVING_WORKERS}
+
+
+@app.get("/history", tags=["History"])
+async def prediction_history_page(
+    farm_id: Optional[str] = None,
+    start: Optional[datetime] = Query(None, description="Earliest prediction time (inclusive), ISO 8601 or Unix seconds"),
+    end: Optional[datetime] = Query(None, description="Latest prediction time (exclusive)"),
+    limit: int = Query(100, ge=1, le=HISTORY_PAGE_SIZE),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+):
+    """
+    Recorded predictions, newest first, one page at a time
+
+    Filter by farm (the X-Farm-Id sent with the prediction, or the /farms path id) and
+    time range; both use indexes. Pass ``next_cursor`` back as ``cursor`` for the next
+    page. Predictions reach the history within HISTORY_FLUSH_INTERVAL_S of being served.
+    """
+    require_history()
+    rows = await asyncio.to_thread(
+        prediction_history.query,
+        farm_id,
+        start.timestamp() if start is not None else None,
+        end.timestamp() if end is not None else None,
+        limit,
+        decode_history_cursor(cursor) if cursor is not None else None,
+    )
+    return FastJSONResponse({
+        "records": [history_record(row) for row in rows],
+        "count": len(rows),
+        "next_cursor": encode_history_cursor(rows[-1]) if len(rows) == limit else None,
+    })
+
+
+@app.get("/history/export", tags=["History"])
+async def prediction_history_export(
+    farm_id: Optional[str] = None,
+    start: Optional[datetime] = Query(None, description="Earliest prediction time (inclusive), ISO 8601 or Unix seconds"),
+    end: Optional[datetime] = Query(None, description="Latest prediction time (exclusive)"),
+    format: Literal["ndjson", "csv"] = "ndjson",
+):
+    """Stream every matching prediction, oldest first, as NDJSON or CSV"""
+    require_history()
+    return StreamingResponse(
+        stream_history(
+            farm_id,
+            start.timestamp() if start is not None else None,
+            end.timestamp() if end is not None else None,
+            format,
+        ),
+        media_type=STREAM_OUTPUT_MEDIA_TYPES[format],
+    )
+
+
+@app.get("/history/stats", tags=["History"])
+async def prediction_history_stats():
+    """Prediction history writer counters and stored row range"""
+    return await asyncio.to_thread(prediction_history.stats)
+
+
+@app.post("/optimize", response_model=OptimizationResponse, tags=["Recommendations"])
+async def optimize(
+    optimization: OptimizationInput,
+    x_request_timeout: Optional[float] = Header(None, description="Client timeout in seconds; inference is dropped once it passes"),
+):
+    """
+    Find the setpoints of the controllable features with the largest predicted gain
+
+    Searches ``controls`` (temperature, light intensity, feeding and humidity by default)
+    within the FarmInput ranges, or the narrower ``bounds`` given, keeping the other
+    features at the farm's current values. Each round scores a dense grid of candidates
+    in one model call; ``refine_rounds`` zoom in around the best point found so far.
+
+    **Returns:**
+    - The prediction at the current conditions
+    - The ``top_k`` best setpoints with their change from the current values and predicted gain
+    """
+    ensure_model_ready()
+    bundle = active_model
+    base_row = farms_to_array([optimization.farm])[0]
+    cache_key = None
+    if optimization_cache.enabled:
+        namespace = (
+            bundle.source_hash,
+            tuple(optimization.controls),
+            tuple(sorted(optimization.bounds.items())),
+            optimization.refine_rounds,
+            optimization.top_k,
+        )
+        cache_key = optimization_cache.key_for(base_row, namespace)
+        cached = optimization_cache.get(cache_key)
+        if cached is not None:
+            return FastJSONResponse({
+                **cached,
+                "cached": True,
+                "timestamp": datetime.now().isoformat(),
+                "input_data": dict(optimization.farm),
+            })
+
+    try:
+        result = await inference_executor.run(
+            optimize_setpoints, base_row, optimization.controls, optimization.bounds,
+            optimization.refine_rounds, optimization.top_k, bundle,
+            deadline=request_deadline(x_request_timeout),
+        )
+    except (InferenceOverloadedError, InferenceDeadlineError):
+        raise
+    except Exception as e:
+        record_error(e)
+        logger.error(f"Optimization error: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Optimization failed: {str(e)}"
+        )
+
+    result["model_version"] = bundle.version
+    if cache_key is not None:
+        optimization_cache.put(cache_key, result)
+    return FastJSONResponse({
+        **result,
+        "cached": False,
+        "timestamp": datetime.now().isoformat(),
+        "input_data": dict(optimization.farm),
+    })
+
+
+@app.get("/batcher/stats", tags=["Model"])
+async def batcher_stats():
+    """Micro-batching statistics: batch-size and queue-wait distributions"""
+    return {**batcher.stats(), "executor": inference_executor.stats()}
+
+
+@app.post("/admin/reload", tags=["Admin"])
+async def admin_reload(
+    force: bool = False,
+    x_admin_token: Optional[str] = Header(None, description="Must match the ADMIN_TOKEN environment variable"),
+):
+    """
+    Hot-reload the model and scaler from disk without downtime
+
+    The new pair is loaded, warmed up and validated in the background, then swapped in
+    atomically; in-flight requests finish on the previous version. Unchanged files are
+    skipped unless `force=true`. Under gunicorn, this worker reloads first and the other
+    workers follow within RELOAD_SIGNAL_INTERVAL_S.
+    """
+    global last_reload_signal_id
+    require_admin(x_admin_token)
+    result = await reload_model(force=force, reason="admin")
+    if SERVING_WORKERS > 1 and result["status"] in ("reloaded", "unchanged"):
+        try:
+            last_reload_signal_id = await asyncio.to_thread(write_reload_signal, force)
+            result["other_workers"] = f"{SERVING_WORKERS - 1} signalled, reloading within {RELOAD_SIGNAL_INTERVAL_S:g}s"
+        except OSError as e:
+            logger.error(f"❌ Could not signal the other workers to reload: {e}")
+            result["other_workers"] = f"not signalled: {e}"
+    status_code = {
+        "failed": status.HTTP_500_INTERNAL_SERVER_ERROR,
+        "busy": status.HTTP_409_CONFLICT,
+    }.get(result["status"], status.HTTP_200_OK)
+    return JSONResponse(status_code=status_code, content=result)
+
+
+@app.get("/admin/reload", tags=["Admin"])
+async def admin_reload_status(
+    x_admin_token: Optional[str] = Header(None, description="Must match the ADMIN_TOKEN environment variable"),
+):
+    """Result of the most recent model reload"""
+    require_admin(x_admin_token)
+    return {
+        "model_version": active_model.version if active_model is not None else None,
+        "watch_interval_s": MODEL_WATCH_INTERVAL_S,
+        "last_reload": last_reload or None,
+        "pid": os.getpid(),
+        "workers": SERVING_WORKERS,
+    }
+
+
+@app.get("/admin/profiles", tags=["Admin"])
+async def admin_profiles(
+    x_admin_token: Optional[str] = Header(None, description="Must match the ADMIN_TOKEN environment variable"),
+):
+    """Profiling settings and saved request profiles (newest first).
+
+    Event-loop time of requests that overlapped a profiled one is attributed to it; such
+    profiles say so in their summary.
+    """
+    require_admin(x_admin_token)
+    return {
+        "sample_rate": PROFILE_SAMPLE_RATE,
+        "on_demand": PROFILE_ON_DEMAND,
+        "directory": str(PROFILE_DIR),
+        "keep": PROFILE_KEEP,
+        "profiles": list_profiles(),
+    }
+
+
+@app.get("/admin/profiles/{profile_id}", tags=["Admin"], response_class=Response)
+async def admin_profile(
+    profile_id: str,
+    x_admin_token: Optional[str] = Header(None, description="Must match the ADMIN_TOKEN environment variable"),
+):
+    """Top hotspots (self and cumulative time) of one saved request profile"""
+    require_admin(x_admin_token)
+    path = PROFILE_DIR / f"{profile_id}.txt"
+    if not PROFILE_ID_PATTERN.match(profile_id) or not path.exists():
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Profile {profile_id} not found")
+    return Response(content=path.read_text(encoding="utf-8"), media_type="text/plain")
+
+
+@app.get("/cache/stats", tags=["Model"])
+async def cache_stats():
+    """Prediction cache hit/miss/eviction counters"""
+    return prediction_cache.stats()
+
+
+@app.get("/metrics", tags=["Health"], response_class=Response)
+async def prometheus_metrics():
+    """Prometheus metrics: request counts and latency, per-stage timings, batch sizes, errors, RSS"""
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/model/info", tags=["Model"])
 async def model_info():
     """Get information about the loaded model"""
@@ -594,6 +4532,13 @@ async def model_info():
     return {
         "model_type": "Keras Neural Network",
         "model_file": "sequence_model.h5",
+        "backend": "numpy" if isinstance(model, NumpyDenseModel) else "keras",
+        "precision": active_model.precision if active_model is not None else None,
+        "precision_gate": active_model.precision_gate if active_model is not None else None,
+        "uncertainty": active_model.uncertainty.summary() if active_model is not None and active_model.uncertainty else None,
+        "model_version": active_model.version if active_model is not None else None,
+        "loaded_from": active_model.loaded_from if active_model is not None else None,
+        "loaded_at": active_model.loaded_at if active_model is not None else None,
         "version": "1.0.0",
         "features": [
             "amount_of_chicken",
@@ -609,38 +4554,22 @@ async def model_info():
         "input_shape": model.input_shape if hasattr(model, 'input_shape') else "Unknown",
         "output_shape": model.output_shape if hasattr(model, 'output_shape') else "Unknown",
         "summary": model_summary,
-        "optimal_ranges": {
-            "temperature": "18-28°C",
-            "humidity": "50-70%",
-            "ammonia": "<25 ppm",
-            "light_intensity": "200-500 lux",
-            "amount_of_feeding": "200-300",
-            "noise": "<200"
-        }
+        "optimal_ranges": rules_engine.optimal_ranges() if rules_engine is not None else None,
+        "rules": rules_engine.summary() if rules_engine is not None else rules_load_error
     }
 
 
 @app.get("/recommendations", tags=["Recommendations"])
 async def get_general_recommendations():
     """Get general farm management recommendations"""
+    require_rules()
     return {
         "environmental_conditions": {
-            "temperature": {
-                "optimal_range": "18-28°C",
-                "recommendation": "Maintain consistent temperature to avoid stress. Use heating in winter, cooling in summer."
-            },
-            "humidity": {
-                "optimal_range": "50-70%",
-                "recommendation": "Proper humidity prevents respiratory issues. Use ventilation and moisture control."
-            },
-            "ammonia": {
-                "optimal_range": "<25 ppm",
-                "recommendation": "Good ventilation is crucial. Clean bedding regularly. Ammonia above 25ppm is dangerous."
-            },
-            "light_intensity": {
-                "optimal_range": "200-500 lux",
-                "recommendation": "14-16 hours of light per day for optimal egg production. Use timers for consistency."
+            rule["name"]: {
+                "optimal_range": rule["optimal_range"],
+                "recommendation": rule["guidance"]
             }
+            for rule in rules_engine.rules if rule["guidance"]
         },
         "general_tips": [
             "Maintain clean and dry bedding",
@@ -663,8 +4592,34 @@ async def get_general_recommendations():
 
 
 # Error handlers
+@app.exception_handler(InferenceOverloadedError)
+async def inference_overloaded_handler(request, exc):
+    record_error(exc)
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": f"Server busy, retry later: {exc}"},
+        headers={"Retry-After": str(RETRY_AFTER_S)}
+    )
+
+
+@app.exception_handler(InferenceDeadlineError)
+async def inference_deadline_handler(request, exc):
+    record_error(exc)
+    return JSONResponse(
+        status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+        content={"detail": str(exc)}
+    )
+
+
+@app.exception_handler(RequestValidationError)
+async def request_validation_handler(request, exc):
+    record_error(exc)
+    return await request_validation_exception_handler(request, exc)
+
+
 @app.exception_handler(ValueError)
 async def value_error_handler(request, exc):
+    record_error(exc)
     return JSONResponse(
         status_code=status.HTTP_400_BAD_REQUEST,
         content={"detail": str(exc)}
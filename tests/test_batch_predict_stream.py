@@ -0,0 +1,68 @@
+"""/batch_predict/stream keeps going past bad rows and failed chunks."""
+
+import json
+import os
+
+os.environ.setdefault("MODEL_BACKEND", "numpy")
+os.environ.setdefault("BACKGROUND_MODEL_LOAD", "0")
+os.environ["HISTORY_ENABLED"] = "0"
+os.environ["MICRO_BATCH_ENABLED"] = "0"
+
+import pytest  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+import main  # noqa: E402
+
+HEADER = b"id," + ",".join(main.FEATURE_NAMES).encode() + b"\n"
+ROW = b"2291,258.6,17.5,27.0,59.4,481.8,236.3\n"
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(main.app) as client:
+        yield client
+
+
+def post_ndjson_out(client, body):
+    response = client.post(
+        "/batch_predict/stream?output=ndjson", content=body, headers={"content-type": "text/csv"}
+    )
+    assert response.status_code == 200
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_non_utf8_row_is_a_row_error(client):
+    body = HEADER + b"a," + ROW + b"\xff\xfe,1,2\n" + b"c," + ROW
+    records = post_ndjson_out(client, body)
+    assert [r["row"] for r in records] == [1, 2, 3]
+    assert "predicted_egg_production" in records[0]
+    assert "utf-8" in records[1]["error"]
+    assert records[2]["id"] == "c" and "predicted_egg_production" in records[2]
+
+
+def test_overlong_line_is_a_row_error(client, monkeypatch):
+    monkeypatch.setattr(main, "STREAM_MAX_LINE_BYTES", 256)
+    body = HEADER + b"a," + ROW + b"x" * 10000 + b"\n" + b"c," + ROW
+    # Sent in small pieces so the overlong line is cut off while still arriving
+    records = post_ndjson_out(client, (body[i:i + 100] for i in range(0, len(body), 100)))
+    assert [r["row"] for r in records] == [1, 2, 3]
+    assert "longer than 256 bytes" in records[1]["error"]
+    assert records[2]["id"] == "c" and "predicted_egg_production" in records[2]
+
+
+def test_chunk_inference_failure_becomes_row_errors(client, monkeypatch):
+    monkeypatch.setattr(main, "STREAM_CHUNK_SIZE", 2)
+    original = main.inference_executor.run
+    calls = []
+
+    async def run(fn, *args, deadline):
+        calls.append(len(args[0]))
+        if len(calls) == 1:
+            raise main.InferenceDeadlineError("Request deadline exceeded during inference")
+        return await original(fn, *args, deadline=deadline)
+
+    monkeypatch.setattr(main.inference_executor, "run", run)
+    records = post_ndjson_out(client, HEADER + b"".join(b"%d," % i + ROW for i in range(4)))
+    assert [r["row"] for r in records] == [1, 2, 3, 4]
+    assert all("deadline" in r["error"] for r in records[:2])
+    assert all("predicted_egg_production" in r for r in records[2:])